@@ -4,16 +4,22 @@ RFID Attendance scanning routes.
 Handles member check-in via RFID tag scanning.
 """
 from fastapi import APIRouter, Request, HTTPException, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse
 from datetime import datetime, date, timedelta
+import asyncio
+import json
 import requests
-from typing import Optional
+from typing import Optional, List
 
 from ..utils.config import get_config
+from ..utils.fast_json import JSONResponse
+from ..utils.erp_client import get_erp_client
+from ..utils.read_model import get_read_model
+from ..services.attendance_service import AttendanceService
+from ..services.rank_progress import get_rank_progress
+from ..utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 # Simple in-memory cache for member lookups (clears after 5 minutes)
 _member_cache = {}
@@ -35,38 +41,95 @@ def get_erpnext_client():
     return url, headers, True
 
 
-def update_member_stats_background(url: str, headers: dict, member_id: str,
-                                    new_days_at_rank: int, new_total_days: int,
-                                    current_rank: str):
+def find_member_by_rfid(url: str, headers: dict, rfid_tag: str, fields: str, timeout: int) -> Optional[List[dict]]:
+    """
+    Members with an RFID tag, from the read model. A miss is confirmed with
+    ERPNext, where the tag may have been assigned since the last sync.
+    Returns None if ERPNext answered with an error.
+    """
+    members = get_read_model().get_list("Gym Member", [["rfid_tag", "=", rfid_tag]], limit=1)
+    if members:
+        return members
+
+    response = requests.get(
+        f"{url}/api/resource/Gym Member",
+        headers=headers,
+        params={"filters": json.dumps([["rfid_tag", "=", rfid_tag]]), "fields": fields},
+        timeout=timeout
+    )
+    if response.status_code != 200:
+        return None
+    return response.json().get("data", [])
+
+
+def oldest_unpaid_invoice(url: str, headers: dict, member_id: str, timeout: int) -> Optional[dict]:
+    """
+    The member's oldest submitted invoice with an outstanding amount, if any.
+    The read model can clear a member on its own, but an unpaid invoice it
+    finds is confirmed with ERPNext before it blocks anyone: a payment made
+    moments ago may not have reached the mirror yet.
+    """
+    filters = [["customer", "=", member_id], ["outstanding_amount", ">", 0], ["docstatus", "=", 1]]
+    invoices = get_read_model().get_list("Sales Invoice", filters, order_by="posting_date asc", limit=1)
+    if invoices == []:
+        return None
+
+    response = requests.get(
+        f"{url}/api/resource/Sales Invoice",
+        headers=headers,
+        params={
+            "filters": json.dumps(filters),
+            "fields": '["name", "posting_date", "outstanding_amount"]',
+            "order_by": "posting_date asc",
+            "limit_page_length": 1
+        },
+        timeout=timeout
+    )
+    if response.status_code == 200:
+        invoices = response.json().get("data", [])
+    # If ERPNext can't answer, the mirror's answer stands
+    return invoices[0] if invoices else None
+
+
+def todays_attendance(url: str, headers: dict, member_id: str, timeout: int) -> List[dict]:
+    """The member's Gym Attendance records for today (check-ins made here are written through)."""
+    filters = [["member", "=", member_id], ["attendance_date", "=", date.today().isoformat()]]
+    records = get_read_model().get_list("Gym Attendance", filters, limit=1)
+    if records is None:
+        response = requests.get(
+            f"{url}/api/resource/Gym Attendance",
+            headers=headers,
+            params={
+                "filters": json.dumps(filters),
+                "fields": '["name", "check_in_time"]',
+                "limit_page_length": 1
+            },
+            timeout=timeout
+        )
+        records = response.json().get("data", []) if response.status_code == 200 else []
+    return records
+
+
+def update_member_stats_background(url: str, headers: dict, member: dict, counts_towards_rank: bool):
     """Background task to update member stats after check-in."""
     try:
-        update_data = {
-            "days_at_current_rank": new_days_at_rank,
-            "total_training_days": new_total_days
+        progress = get_rank_progress().record_check_in(member, date.today(), counts_towards_rank)
+        if not counts_towards_rank:
+            return
+
+        stats = {
+            "days_at_current_rank": progress["days_at_current_rank"],
+            "total_training_days": progress["total_training_days"],
+            "eligible_for_promotion": 1 if progress["eligible_for_promotion"] else 0
         }
-
-        # Check if eligible for promotion
-        if current_rank:
-            try:
-                rank_response = requests.get(
-                    f"{url}/api/resource/Belt Rank/{current_rank}",
-                    headers=headers,
-                    timeout=5
-                )
-                if rank_response.status_code == 200:
-                    rank_data = rank_response.json().get("data", {})
-                    days_required = rank_data.get("days_required", 0)
-                    if days_required > 0 and new_days_at_rank >= days_required:
-                        update_data["eligible_for_promotion"] = 1
-            except:
-                pass
-
-        requests.put(
-            f"{url}/api/resource/Gym Member/{member_id}",
+        response = requests.put(
+            f"{url}/api/resource/Gym Member/{member['name']}",
             headers=headers,
-            json=update_data,
+            json=stats,
             timeout=5
         )
+        if response.status_code == 200:
+            get_read_model().update("Gym Member", member["name"], stats)
     except Exception as e:
         print(f"Background update failed: {e}")
 
@@ -94,25 +157,18 @@ async def lookup_member_by_rfid(rfid_tag: str):
 
     try:
         # Search for member with this RFID tag
-        response = requests.get(
-            f"{url}/api/resource/Gym Member",
-            headers=headers,
-            params={
-                "filters": f'[["rfid_tag", "=", "{rfid_tag}"]]',
-                "fields": '["name", "first_name", "last_name", "full_name", "photo", "member_type", "status", "current_rank", "current_stripes", "days_at_current_rank", "total_training_days", "payment_status", "current_membership_type", "membership_end_date", "remaining_sessions"]'
-            },
+        members = find_member_by_rfid(
+            url, headers, rfid_tag,
+            '["name", "first_name", "last_name", "full_name", "photo", "member_type", "status", "current_rank", "current_stripes", "days_at_current_rank", "total_training_days", "payment_status", "current_membership_type", "membership_end_date", "remaining_sessions"]',
             timeout=10
         )
 
-        if response.status_code != 200:
+        if members is None:
             return JSONResponse({
                 "success": False,
                 "error": "Failed to query ERPNext"
             }, status_code=500)
 
-        data = response.json()
-        members = data.get("data", [])
-
         if not members:
             return JSONResponse({
                 "success": False,
@@ -125,13 +181,16 @@ async def lookup_member_by_rfid(rfid_tag: str):
         # Get belt rank details if available
         rank_info = None
         if member.get("current_rank"):
-            rank_response = requests.get(
-                f"{url}/api/resource/Belt Rank/{member['current_rank']}",
-                headers=headers,
-                timeout=10
-            )
-            if rank_response.status_code == 200:
-                rank_data = rank_response.json().get("data", {})
+            rank_data = get_read_model().get_doc("Belt Rank", member["current_rank"])
+            if rank_data is None:
+                rank_response = requests.get(
+                    f"{url}/api/resource/Belt Rank/{member['current_rank']}",
+                    headers=headers,
+                    timeout=10
+                )
+                if rank_response.status_code == 200:
+                    rank_data = rank_response.json().get("data", {})
+            if rank_data is not None:
                 rank_info = {
                     "name": rank_data.get("rank_name"),
                     "color": rank_data.get("color"),
@@ -139,24 +198,12 @@ async def lookup_member_by_rfid(rfid_tag: str):
                 }
 
         # Check if already checked in today
-        today = date.today().isoformat()
-        attendance_response = requests.get(
-            f"{url}/api/resource/Gym Attendance",
-            headers=headers,
-            params={
-                "filters": f'[["member", "=", "{member["name"]}"], ["attendance_date", "=", "{today}"]]',
-                "fields": '["name", "check_in_time"]'
-            },
-            timeout=10
-        )
-
         already_checked_in = False
         check_in_time = None
-        if attendance_response.status_code == 200:
-            attendance_data = attendance_response.json().get("data", [])
-            if attendance_data:
-                already_checked_in = True
-                check_in_time = attendance_data[0].get("check_in_time")
+        attendance_data = todays_attendance(url, headers, member["name"], timeout=10)
+        if attendance_data:
+            already_checked_in = True
+            check_in_time = attendance_data[0].get("check_in_time")
 
         return JSONResponse({
             "success": True,
@@ -216,23 +263,18 @@ async def check_in_member(request: Request):
             }, status_code=400)
 
         # First lookup the member
-        lookup_response = requests.get(
-            f"{url}/api/resource/Gym Member",
-            headers=headers,
-            params={
-                "filters": f'[["rfid_tag", "=", "{rfid_tag}"]]',
-                "fields": '["name", "first_name", "last_name", "full_name", "photo", "status", "payment_status", "days_at_current_rank", "total_training_days", "current_rank"]'
-            },
+        members = find_member_by_rfid(
+            url, headers, rfid_tag,
+            '["name", "first_name", "last_name", "full_name", "photo", "status", "payment_status", "days_at_current_rank", "total_training_days", "current_rank"]',
             timeout=10
         )
 
-        if lookup_response.status_code != 200:
+        if members is None:
             return JSONResponse({
                 "success": False,
                 "error": "Failed to query member"
             }, status_code=500)
 
-        members = lookup_response.json().get("data", [])
         if not members:
             return JSONResponse({
                 "success": False,
@@ -255,47 +297,25 @@ async def check_in_member(request: Request):
         # Check for overdue payment > 15 days
         if member.get("payment_status") == "Overdue":
             try:
-                invoice_response = requests.get(
-                    f"{url}/api/resource/Sales Invoice",
-                    headers=headers,
-                    params={
-                        "filters": f'[["customer", "=", "{member_id}"], ["outstanding_amount", ">", 0], ["docstatus", "=", 1]]',
-                        "fields": '["name", "posting_date", "outstanding_amount"]',
-                        "order_by": "posting_date asc",
-                        "limit_page_length": 1
-                    },
-                    timeout=10
-                )
-
-                if invoice_response.status_code == 200:
-                    invoices = invoice_response.json().get("data", [])
-                    if invoices:
-                        oldest_invoice_date = datetime.strptime(invoices[0]["posting_date"], "%Y-%m-%d").date()
-                        days_overdue = (date.today() - oldest_invoice_date).days
-
-                        if days_overdue > 15:
-                            return JSONResponse({
-                                "success": False,
-                                "error": f"Payment overdue ({days_overdue} days). Please settle balance.",
-                                "member_name": full_name,
-                                "days_overdue": days_overdue,
-                                "blocked": True
-                            }, status_code=402)
+                invoice = oldest_unpaid_invoice(url, headers, member_id, timeout=10)
+                if invoice:
+                    oldest_invoice_date = datetime.strptime(invoice["posting_date"], "%Y-%m-%d").date()
+                    days_overdue = (date.today() - oldest_invoice_date).days
+
+                    if days_overdue > 15:
+                        return JSONResponse({
+                            "success": False,
+                            "error": f"Payment overdue ({days_overdue} days). Please settle balance.",
+                            "member_name": full_name,
+                            "days_overdue": days_overdue,
+                            "blocked": True
+                        }, status_code=402)
             except Exception as e:
                 print(f"Error checking overdue invoices: {e}")
 
         # Check if already checked in today
         today = date.today().isoformat()
-        existing = requests.get(
-            f"{url}/api/resource/Gym Attendance",
-            headers=headers,
-            params={
-                "filters": f'[["member", "=", "{member_id}"], ["attendance_date", "=", "{today}"]]'
-            },
-            timeout=10
-        )
-
-        if existing.status_code == 200 and existing.json().get("data"):
+        if todays_attendance(url, headers, member_id, timeout=10):
             return JSONResponse({
                 "success": True,
                 "already_checked_in": True,
@@ -338,15 +358,14 @@ async def check_in_member(request: Request):
                 "success": False,
                 "error": "Failed to create attendance record"
             }, status_code=500)
+        get_read_model().upsert("Gym Attendance", create_response.json().get("data", {}))
 
         # Update member's training days if payment is current
-        new_days_at_rank = member.get("days_at_current_rank", 0)
-        new_total_days = member.get("total_training_days", 0)
+        progress = get_rank_progress().record_check_in(member, date.today(), counts_towards_rank)
+        new_days_at_rank = progress["days_at_current_rank"]
+        new_total_days = progress["total_training_days"]
 
         if counts_towards_rank:
-            new_days_at_rank += 1
-            new_total_days += 1
-
             # Update member record
             update_data = {
                 "days_at_current_rank": new_days_at_rank,
@@ -354,24 +373,17 @@ async def check_in_member(request: Request):
             }
 
             # Check if eligible for promotion
-            if member.get("current_rank"):
-                rank_response = requests.get(
-                    f"{url}/api/resource/Belt Rank/{member['current_rank']}",
-                    headers=headers,
-                    timeout=10
-                )
-                if rank_response.status_code == 200:
-                    rank_data = rank_response.json().get("data", {})
-                    days_required = rank_data.get("days_required", 0)
-                    if days_required > 0 and new_days_at_rank >= days_required:
-                        update_data["eligible_for_promotion"] = 1
+            if progress["eligible_for_promotion"]:
+                update_data["eligible_for_promotion"] = 1
 
-            requests.put(
+            update_response = requests.put(
                 f"{url}/api/resource/Gym Member/{member_id}",
                 headers=headers,
                 json=update_data,
                 timeout=10
             )
+            if update_response.status_code == 200:
+                get_read_model().update("Gym Member", member_id, update_data)
 
         return JSONResponse({
             "success": True,
@@ -422,24 +434,19 @@ async def fast_check_in(request: Request, background_tasks: BackgroundTasks):
         today = date.today().isoformat()
         now = datetime.now()
 
-        # Single query: get member with all needed fields
-        lookup_response = requests.get(
-            f"{url}/api/resource/Gym Member",
-            headers=headers,
-            params={
-                "filters": f'[["rfid_tag", "=", "{rfid_tag}"]]',
-                "fields": '["name", "first_name", "last_name", "full_name", "photo", "status", "payment_status", "days_at_current_rank", "total_training_days", "current_rank"]'
-            },
+        # Single query: get member with all needed fields (local when the read model has it)
+        members = find_member_by_rfid(
+            url, headers, rfid_tag,
+            '["name", "first_name", "last_name", "full_name", "photo", "status", "payment_status", "days_at_current_rank", "total_training_days", "current_rank"]',
             timeout=5  # Reduced timeout
         )
 
-        if lookup_response.status_code != 200:
+        if members is None:
             return JSONResponse({
                 "success": False,
                 "error": "Connection error"
             }, status_code=500)
 
-        members = lookup_response.json().get("data", [])
         if not members:
             return JSONResponse({
                 "success": False,
@@ -462,49 +469,25 @@ async def fast_check_in(request: Request, background_tasks: BackgroundTasks):
         if member.get("payment_status") == "Overdue":
             try:
                 # Check oldest unpaid invoice
-                invoice_response = requests.get(
-                    f"{url}/api/resource/Sales Invoice",
-                    headers=headers,
-                    params={
-                        "filters": f'[["customer", "=", "{member_id}"], ["outstanding_amount", ">", 0], ["docstatus", "=", 1]]',
-                        "fields": '["name", "posting_date", "outstanding_amount"]',
-                        "order_by": "posting_date asc",
-                        "limit_page_length": 1
-                    },
-                    timeout=5
-                )
-
-                if invoice_response.status_code == 200:
-                    invoices = invoice_response.json().get("data", [])
-                    if invoices:
-                        oldest_invoice_date = datetime.strptime(invoices[0]["posting_date"], "%Y-%m-%d").date()
-                        days_overdue = (date.today() - oldest_invoice_date).days
-
-                        if days_overdue > 15:
-                            return JSONResponse({
-                                "success": False,
-                                "error": f"Payment overdue ({days_overdue} days). Please settle balance.",
-                                "member_name": full_name,
-                                "days_overdue": days_overdue,
-                                "blocked": True
-                            }, status_code=402)  # 402 Payment Required
+                invoice = oldest_unpaid_invoice(url, headers, member_id, timeout=5)
+                if invoice:
+                    oldest_invoice_date = datetime.strptime(invoice["posting_date"], "%Y-%m-%d").date()
+                    days_overdue = (date.today() - oldest_invoice_date).days
+
+                    if days_overdue > 15:
+                        return JSONResponse({
+                            "success": False,
+                            "error": f"Payment overdue ({days_overdue} days). Please settle balance.",
+                            "member_name": full_name,
+                            "days_overdue": days_overdue,
+                            "blocked": True
+                        }, status_code=402)  # 402 Payment Required
             except Exception as e:
                 print(f"Error checking overdue invoices: {e}")
                 # Continue with check-in if invoice check fails
 
         # Check if already checked in today (quick check)
-        existing = requests.get(
-            f"{url}/api/resource/Gym Attendance",
-            headers=headers,
-            params={
-                "filters": f'[["member", "=", "{member_id}"], ["attendance_date", "=", "{today}"]]',
-                "fields": '["name"]',
-                "limit_page_length": 1
-            },
-            timeout=3
-        )
-
-        if existing.status_code == 200 and existing.json().get("data"):
+        if todays_attendance(url, headers, member_id, timeout=3):
             # Already checked in - return immediately
             return JSONResponse({
                 "success": True,
@@ -540,6 +523,7 @@ async def fast_check_in(request: Request, background_tasks: BackgroundTasks):
                 "success": False,
                 "error": "Failed to record attendance"
             }, status_code=500)
+        get_read_model().upsert("Gym Attendance", create_response.json().get("data", {}))
 
         # Calculate new stats
         new_days_at_rank = member.get("days_at_current_rank", 0)
@@ -549,13 +533,8 @@ async def fast_check_in(request: Request, background_tasks: BackgroundTasks):
             new_days_at_rank += 1
             new_total_days += 1
 
-            # Update member stats in background (non-blocking)
-            background_tasks.add_task(
-                update_member_stats_background,
-                url, headers, member_id,
-                new_days_at_rank, new_total_days,
-                member.get("current_rank")
-            )
+        # Update progress and member stats in background (non-blocking)
+        background_tasks.add_task(update_member_stats_background, url, headers, member, payment_current)
 
         # Return immediately - don't wait for stats update
         return JSONResponse({
@@ -584,100 +563,97 @@ async def fast_check_in(request: Request, background_tasks: BackgroundTasks):
 @router.get("/stats/{rfid_tag}")
 async def get_member_stats(rfid_tag: str):
     """Get training statistics for a member by RFID (for self-service kiosk)."""
-    url, headers, connected = get_erpnext_client()
-
-    if not connected:
+    if not get_config().is_configured():
         return JSONResponse({
             "success": False,
             "error": "ERPNext not connected"
         }, status_code=503)
 
     try:
-        # Look up member
-        response = requests.get(
-            f"{url}/api/resource/Gym Member",
-            headers=headers,
-            params={
-                "filters": f'[["rfid_tag", "=", "{rfid_tag}"]]',
-                "fields": '["name", "first_name", "last_name", "full_name", "photo", "current_rank", "current_stripes", "days_at_current_rank", "total_training_days", "last_promotion_date", "eligible_for_promotion", "join_date"]'
-            },
-            timeout=10
-        )
-
-        if response.status_code != 200:
-            return JSONResponse({
-                "success": False,
-                "error": "Failed to query ERPNext"
-            }, status_code=500)
-
-        members = response.json().get("data", [])
-        if not members:
+        progress = await asyncio.to_thread(get_rank_progress().get, rfid=rfid_tag)
+        if not progress:
             return JSONResponse({
                 "success": False,
                 "error": "Member not found"
             }, status_code=404)
 
-        member = members[0]
+        rank = progress["rank"]
+        return JSONResponse({
+            "success": True,
+            "member": {
+                "full_name": progress["full_name"],
+                "photo": progress["photo"],
+                "join_date": progress["join_date"],
+                "rank": {
+                    "name": rank["name"],
+                    "color": rank["color"],
+                    "days_required": rank["days_required"],
+                    "stripes_available": rank["stripes_available"]
+                } if rank else None,
+                "current_stripes": progress["current_stripes"],
+                "days_at_current_rank": progress["days_at_current_rank"],
+                "total_training_days": progress["total_training_days"],
+                "days_to_next_rank": progress["days_to_next_rank"],
+                "eligible_for_promotion": progress["eligible_for_promotion"],
+                "last_promotion_date": progress["last_promotion_date"],
+                "training_days_last_30": progress["training_days_last_30"],
+                "projected_promotion_date": progress["projected_promotion_date"]
+            }
+        })
 
-        # Get rank info
-        rank_info = None
-        days_to_next_rank = None
-        if member.get("current_rank"):
-            rank_response = requests.get(
-                f"{url}/api/resource/Belt Rank/{member['current_rank']}",
-                headers=headers,
-                timeout=10
-            )
-            if rank_response.status_code == 200:
-                rank_data = rank_response.json().get("data", {})
-                days_required = rank_data.get("days_required", 0)
-                days_at_rank = member.get("days_at_current_rank", 0)
+    except Exception as e:
+        return JSONResponse({
+            "success": False,
+            "error": str(e)
+        }, status_code=500)
 
-                rank_info = {
-                    "name": rank_data.get("rank_name"),
-                    "color": rank_data.get("color"),
-                    "days_required": days_required,
-                    "stripes_available": rank_data.get("stripes_available", 4)
-                }
 
-                if days_required > 0:
-                    days_to_next_rank = max(0, days_required - days_at_rank)
+@router.get("/history/{customer_name}")
+async def get_customer_attendance_history(customer_name: str, period: str = "week", offset: int = 0):
+    """Attendance calendar (week, month or year) and training stats for a customer."""
+    if not get_config().is_configured():
+        return JSONResponse({
+            "success": False,
+            "error": "ERPNext not connected"
+        }, status_code=503)
 
-        # Get recent attendance (last 30 days)
-        thirty_days_ago = (date.today() - timedelta(days=30)).isoformat()
+    service = AttendanceService(get_erp_client())
+    result = await service.get_customer_attendance(customer_name, week_offset=offset, period=period)
+    return JSONResponse({"success": True, **result})
 
-        attendance_response = requests.get(
-            f"{url}/api/resource/Gym Attendance",
-            headers=headers,
-            params={
-                "filters": f'[["member", "=", "{member["name"]}"], ["attendance_date", ">=", "{thirty_days_ago}"]]',
-                "fields": '["attendance_date"]',
-                "limit_page_length": 100
-            },
-            timeout=10
-        )
 
-        recent_days = 0
-        if attendance_response.status_code == 200:
-            recent_days = len(attendance_response.json().get("data", []))
+@router.get("/report")
+async def get_attendance_report_data(start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """
+    Gym-wide attendance report: hour-of-week heatmap, peak hours, class type
+    counts and rank distribution. Defaults to the last four weeks.
+    """
+    if not get_config().is_configured():
+        return JSONResponse({
+            "success": False,
+            "error": "ERPNext not connected"
+        }, status_code=503)
 
+    try:
+        end = date.fromisoformat(end_date) if end_date else date.today()
+        start = date.fromisoformat(start_date) if start_date else end - timedelta(days=27)
+    except ValueError:
         return JSONResponse({
-            "success": True,
-            "member": {
-                "full_name": member.get("full_name") or f"{member.get('first_name', '')} {member.get('last_name', '')}".strip(),
-                "photo": member.get("photo"),
-                "join_date": member.get("join_date"),
-                "rank": rank_info,
-                "current_stripes": member.get("current_stripes", 0),
-                "days_at_current_rank": member.get("days_at_current_rank", 0),
-                "total_training_days": member.get("total_training_days", 0),
-                "days_to_next_rank": days_to_next_rank,
-                "eligible_for_promotion": member.get("eligible_for_promotion", False),
-                "last_promotion_date": member.get("last_promotion_date"),
-                "training_days_last_30": recent_days
-            }
-        })
+            "success": False,
+            "error": "Dates must be YYYY-MM-DD"
+        }, status_code=400)
+
+    # Imported here: the report (and NumPy, when installed) is only loaded once it is used
+    from ..services.attendance_report import get_attendance_report
 
+    try:
+        report = await asyncio.to_thread(get_attendance_report().build, start, end)
+        return JSONResponse({"success": True, **report})
+    except ValueError as e:
+        return JSONResponse({
+            "success": False,
+            "error": str(e)
+        }, status_code=400)
     except Exception as e:
         return JSONResponse({
             "success": False,
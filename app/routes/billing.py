@@ -1,15 +1,15 @@
 # app/routes/billing.py
 from fastapi import APIRouter, HTTPException, Request, Depends
-from fastapi.responses import JSONResponse
-from fastapi.templating import Jinja2Templates
 from typing import Dict, Any
+import asyncio
 import json
 from ..services.billing_service import BillingService
 from ..services.auto_billing import get_billing_service
 from ..utils.erp_client import ERPNextClient, get_erp_client
+from ..utils.fast_json import JSONResponse
+from ..utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 
 # =============================================================================
@@ -23,7 +23,7 @@ async def preview_billing():
     Shows which members are due for billing and the expected amounts.
     """
     billing_service = get_billing_service()
-    preview = billing_service.preview_billing_cycle()
+    preview = await asyncio.to_thread(billing_service.preview_billing_cycle)
     return JSONResponse(preview)
 
 
@@ -34,7 +34,8 @@ async def run_billing_cycle():
     Creates Sales Invoices in ERPNext for members with recurring memberships.
     """
     billing_service = get_billing_service()
-    result = billing_service.run_billing_cycle()
+    # Minutes of ERPNext calls and retry waits: keep them off the event loop
+    result = await asyncio.to_thread(billing_service.run_billing_cycle)
     return JSONResponse(result)
 
 
@@ -42,10 +43,10 @@ async def run_billing_cycle():
 async def get_members_due():
     """Get list of members due for billing today."""
     billing_service = get_billing_service()
-    if not billing_service._setup_connection():
+    if not await asyncio.to_thread(billing_service._setup_connection):
         return JSONResponse({"success": False, "error": "ERPNext not connected"})
 
-    members = billing_service.get_members_due_for_billing()
+    members = await asyncio.to_thread(billing_service.get_members_due_for_billing)
     return JSONResponse({
         "success": True,
         "count": len(members),
@@ -53,6 +54,19 @@ async def get_members_due():
     })
 
 
+@router.get("/auto/ledger")
+async def get_billing_ledger_entries(since: str = None):
+    """List invoices recorded in the local billing ledger and the last run checkpoint."""
+    billing_service = get_billing_service()
+    entries = billing_service.ledger.entries(period_from=since)
+    return JSONResponse({
+        "success": True,
+        "count": len(entries),
+        "entries": sorted(entries, key=lambda e: e.get("period") or "", reverse=True),
+        "checkpoint": billing_service.ledger.get_checkpoint()
+    })
+
+
 @router.get("/auto/test-invoice")
 async def test_invoice_creation():
     """Test invoice creation with a single member to see detailed errors."""
@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from typing import List
 from pydantic import BaseModel
 from ..utils.erp_client import ERPNextClient, get_erp_client
+from ..utils.search_index import get_search_index
 import json
 
 router = APIRouter()
@@ -13,6 +14,13 @@ class CustomerResponse(BaseModel):
 @router.get("/customers/search")
 async def search_customers(q: str, erp_client: ERPNextClient = Depends(get_erp_client)):
     print(f"Search query received: {q}")
+    customers = get_search_index().search("Customer", q)
+    if customers is not None:
+        return [
+            CustomerResponse(name=customer.get("customer_name") or "", email=customer.get("email_id"))
+            for customer in customers
+        ]
+
     try:
         # Use the client's API method format
         endpoint = f"{erp_client.base_url}/api/resource/Customer"
@@ -1,18 +1,18 @@
 # app/routes/enrollment.py
 """Member enrollment routes for the gym management system."""
 from fastapi import APIRouter, Request
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional
 from datetime import date, datetime
 import requests
 
 from ..utils.config import get_config
+from ..utils.fast_json import JSONResponse
+from ..utils.search_index import get_search_index
+from ..utils.templating import templates
 
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 
 def get_erpnext_client():
@@ -404,6 +404,15 @@ async def check_rfid(rfid_tag: str):
 @router.get("/search-parent")
 async def search_parent(q: str = ""):
     """Search for potential parent members."""
+    members = get_search_index().search(
+        "Gym Member", q, where=lambda m: m.get("member_type") == "Adult" and m.get("status") == "Active"
+    )
+    if members is not None:
+        return JSONResponse({
+            "success": True,
+            "members": [{"name": m["name"], "full_name": m.get("full_name"), "phone": m.get("phone")} for m in members]
+        })
+
     url, headers, connected = get_erpnext_client()
 
     if not connected:
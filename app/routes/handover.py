@@ -1,15 +1,15 @@
 # app/routes/handover.py
 from fastapi import APIRouter, Request, HTTPException, Depends
-from fastapi.templating import Jinja2Templates
 from typing import Dict, Any, Optional
 from pydantic import BaseModel
 
 from ..services.handover_service import HandoverService
 from ..models.payment import PaymentHandoverRequest
 from ..utils.erp_client import ERPNextClient, get_erp_client
+from ..utils.read_model import get_read_model
+from ..utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 class RFIDInput(BaseModel):
     rfid: str
@@ -47,21 +47,25 @@ async def handover_confirmation(
 ):
     """Screen for treasurer to confirm receipt of payment"""
     try:
-        # Get payment details
-        response = erp_client.session.get(
-            f"{erp_client.base_url}/api/resource/Payment Entry/{payment_id}"
-        )
-        
-        if response.status_code != 200:
-            return templates.TemplateResponse(
-                "payment/error.html",
-                {
-                    "request": request,
-                    "error": "Payment not found"
-                }
+        read_model = get_read_model()
+
+        # Get payment details (ERPNext only if the read model doesn't have it yet)
+        payment_data = read_model.get_doc("Payment Entry", payment_id)
+        if payment_data is None:
+            response = erp_client.session.get(
+                f"{erp_client.base_url}/api/resource/Payment Entry/{payment_id}"
             )
             
-        payment_data = response.json().get("data", {})
+            if response.status_code != 200:
+                return templates.TemplateResponse(
+                    "payment/error.html",
+                    {
+                        "request": request,
+                        "error": "Payment not found"
+                    }
+                )
+                
+            payment_data = response.json().get("data", {})
         
         # Get staff details
         staff_user_id = payment_data.get('authorized_by_staff', payment_data.get('owner'))
@@ -80,11 +84,14 @@ async def handover_confirmation(
         for ref in payment_data.get('references', []):
             if ref.get('reference_doctype') == 'Sales Invoice':
                 invoice_id = ref.get('reference_name')
-                invoice_response = erp_client.session.get(
-                    f"{erp_client.base_url}/api/resource/Sales Invoice/{invoice_id}"
-                )
-                if invoice_response.status_code == 200:
-                    invoice_data = invoice_response.json().get('data', {})
+                invoice_data = read_model.get_doc("Sales Invoice", invoice_id)
+                if invoice_data is None:
+                    invoice_response = erp_client.session.get(
+                        f"{erp_client.base_url}/api/resource/Sales Invoice/{invoice_id}"
+                    )
+                    if invoice_response.status_code == 200:
+                        invoice_data = invoice_response.json().get('data', {})
+                if invoice_data is not None:
                     invoice_details.append({
                         "invoice_id": invoice_id,
                         "amount": ref.get('allocated_amount'),
@@ -0,0 +1,54 @@
+# app/routes/health.py
+"""
+Health checks for Docker, compose and nginx.
+/healthz only proves the event loop answers; /readyz reports whether this
+worker should receive traffic; /metrics shows the ERPNext client's circuit
+breaker and timeouts, change sync cursors, the read model's state and the
+search index. None of them renders a template or calls ERPNext.
+"""
+from anyio import to_thread
+from fastapi import APIRouter
+
+from ..utils.erp_resilience import erp_metrics
+from ..utils.fast_json import JSONResponse
+from ..utils.health import get_health_monitor
+from ..utils.read_model import get_read_model
+from ..utils.search_index import get_search_index
+from ..utils.sync_engine import get_sync_engine
+
+router = APIRouter()
+
+# Health responses are never cached (or given an ETag)
+NO_STORE = {"Cache-Control": "no-store"}
+
+
+@router.get("/healthz")
+async def liveness():
+    """Liveness: the process is up and its event loop is responsive."""
+    return JSONResponse({"status": "ok"}, headers=NO_STORE)
+
+
+@router.get("/readyz")
+async def readiness():
+    """Readiness: cached ERPNext ping, worker thread pool saturation and cache warmth."""
+    limiter = to_thread.current_default_thread_limiter()
+    stats = limiter.statistics()
+    thread_pool = {
+        "in_use": stats.borrowed_tokens,
+        "capacity": limiter.total_tokens,
+        "waiting": stats.tasks_waiting,
+        "saturation": round(stats.borrowed_tokens / limiter.total_tokens, 2) if limiter.total_tokens else 0.0,
+    }
+    report = get_health_monitor().readiness(thread_pool)
+    return JSONResponse(report, status_code=200 if report["ready"] else 503, headers=NO_STORE)
+
+
+@router.get("/metrics")
+async def metrics():
+    """ERPNext client metrics (breaker state, adaptive timeouts, latencies, retries), change sync, read model and search index state."""
+    return JSONResponse({
+        "erpnext": erp_metrics(),
+        "change_sync": get_sync_engine().status(),
+        "read_model": get_read_model().status(),
+        "search_index": get_search_index().status(),
+    }, headers=NO_STORE)
@@ -1,9 +1,8 @@
 # app/routes/main.py
 from fastapi import APIRouter, Request
-from fastapi.templating import Jinja2Templates
+from ..utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 @router.get("/customers")
 async def customers_page(request: Request):
@@ -4,17 +4,17 @@ Clean URL routes for member pages.
 UI pages at /members, API endpoints stay at /api/v1/members
 """
 from fastapi import APIRouter, Request
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import JSONResponse
 import requests
 from pydantic import BaseModel
 from typing import Optional
 from datetime import date
 
 from app.utils.config import get_config
+from app.utils.fast_json import JSONResponse
+from app.utils.read_model import get_read_model
+from app.utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 
 def get_erpnext_client():
@@ -36,6 +36,20 @@ def get_erpnext_client():
     return url, headers, True
 
 
+def _belt_ranks(url: str, headers: dict) -> dict:
+    """Belt ranks keyed by name for display, from the read model when it is synced."""
+    ranks = get_read_model().get_list("Belt Rank")
+    if ranks is None:
+        resp = requests.get(
+            f"{url}/api/resource/Belt Rank",
+            headers=headers,
+            params={"fields": '["name", "rank_name", "color"]', "limit_page_length": 100},
+            timeout=10
+        )
+        ranks = resp.json().get("data", []) if resp.status_code == 200 else []
+    return {r["name"]: r for r in ranks}
+
+
 # ============================================================================
 # UI Pages (Clean URLs)
 # ============================================================================
@@ -50,30 +64,27 @@ async def members_list_page(request: Request):
 
     if connected:
         try:
-            # Fetch all members
-            resp = requests.get(
-                f"{url}/api/resource/Gym Member",
-                headers=headers,
-                params={
-                    "fields": '["name", "full_name", "phone", "email", "member_type", "status", "current_rank", "current_stripes", "payment_status", "join_date", "rfid_tag", "photo"]',
-                    "order_by": "full_name asc",
-                    "limit_page_length": 500
-                },
-                timeout=15
-            )
-            if resp.status_code == 200:
-                members = resp.json().get("data", [])
+            read_model = get_read_model()
 
-            # Fetch belt ranks for display
-            resp = requests.get(
-                f"{url}/api/resource/Belt Rank",
-                headers=headers,
-                params={"fields": '["name", "rank_name", "color"]', "limit_page_length": 100},
-                timeout=10
-            )
-            if resp.status_code == 200:
-                ranks = resp.json().get("data", [])
-                belt_ranks = {r["name"]: r for r in ranks}
+            # Fetch all members (from the local read model once it is synced)
+            mirrored = read_model.get_list("Gym Member", order_by="full_name asc", limit=500)
+            if mirrored is not None:
+                members = mirrored
+            else:
+                resp = requests.get(
+                    f"{url}/api/resource/Gym Member",
+                    headers=headers,
+                    params={
+                        "fields": '["name", "full_name", "phone", "email", "member_type", "status", "current_rank", "current_stripes", "payment_status", "join_date", "rfid_tag", "photo"]',
+                        "order_by": "full_name asc",
+                        "limit_page_length": 500
+                    },
+                    timeout=15
+                )
+                if resp.status_code == 200:
+                    members = resp.json().get("data", [])
+
+            belt_ranks = _belt_ranks(url, headers)
 
         except Exception as e:
             print(f"Error fetching members: {e}")
@@ -100,39 +111,55 @@ async def enrollment_page(request: Request):
 
     if connected:
         try:
+            read_model = get_read_model()
+
             # Fetch membership types
-            resp = requests.get(
-                f"{url}/api/resource/Membership Type",
-                headers=headers,
-                params={"filters": '[["is_active", "=", 1]]', "fields": '["name", "membership_name", "price", "membership_category"]'},
-                timeout=10
-            )
-            if resp.status_code == 200:
-                membership_types = resp.json().get("data", [])
+            mirrored = read_model.get_list("Membership Type", [["is_active", "=", 1]])
+            if mirrored is not None:
+                membership_types = mirrored
+            else:
+                resp = requests.get(
+                    f"{url}/api/resource/Membership Type",
+                    headers=headers,
+                    params={"filters": '[["is_active", "=", 1]]', "fields": '["name", "membership_name", "price", "membership_category"]'},
+                    timeout=10
+                )
+                if resp.status_code == 200:
+                    membership_types = resp.json().get("data", [])
 
             # Fetch belt ranks (for initial rank - just white belt)
-            resp = requests.get(
-                f"{url}/api/resource/Belt Rank",
-                headers=headers,
-                params={"filters": '[["rank_order", "=", 10]]', "fields": '["name", "rank_name", "color"]'},
-                timeout=10
-            )
-            if resp.status_code == 200:
-                belt_ranks = resp.json().get("data", [])
+            mirrored = read_model.get_list("Belt Rank", [["rank_order", "=", 10]])
+            if mirrored is not None:
+                belt_ranks = mirrored
+            else:
+                resp = requests.get(
+                    f"{url}/api/resource/Belt Rank",
+                    headers=headers,
+                    params={"filters": '[["rank_order", "=", 10]]', "fields": '["name", "rank_name", "color"]'},
+                    timeout=10
+                )
+                if resp.status_code == 200:
+                    belt_ranks = resp.json().get("data", [])
 
             # Fetch existing adult members (for optional parent linking)
-            resp = requests.get(
-                f"{url}/api/resource/Gym Member",
-                headers=headers,
-                params={
-                    "filters": '[["member_type", "=", "Adult"], ["status", "=", "Active"]]',
-                    "fields": '["name", "full_name", "phone"]',
-                    "limit_page_length": 500
-                },
-                timeout=10
+            mirrored = read_model.get_list(
+                "Gym Member", [["member_type", "=", "Adult"], ["status", "=", "Active"]], limit=500
             )
-            if resp.status_code == 200:
-                existing_members = resp.json().get("data", [])
+            if mirrored is not None:
+                existing_members = mirrored
+            else:
+                resp = requests.get(
+                    f"{url}/api/resource/Gym Member",
+                    headers=headers,
+                    params={
+                        "filters": '[["member_type", "=", "Adult"], ["status", "=", "Active"]]',
+                        "fields": '["name", "full_name", "phone"]',
+                        "limit_page_length": 500
+                    },
+                    timeout=10
+                )
+                if resp.status_code == 200:
+                    existing_members = resp.json().get("data", [])
 
         except Exception as e:
             print(f"Error fetching data: {e}")
@@ -161,54 +188,60 @@ async def member_detail_page(request: Request, member_id: str):
 
     if connected:
         try:
-            # Fetch member details
-            resp = requests.get(
-                f"{url}/api/resource/Gym Member/{member_id}",
-                headers=headers,
-                timeout=10
-            )
-            if resp.status_code == 200:
-                member = resp.json().get("data", {})
+            read_model = get_read_model()
 
-            # Fetch belt ranks for display
-            resp = requests.get(
-                f"{url}/api/resource/Belt Rank",
-                headers=headers,
-                params={"fields": '["name", "rank_name", "color"]', "limit_page_length": 100},
-                timeout=10
-            )
-            if resp.status_code == 200:
-                ranks = resp.json().get("data", [])
-                belt_ranks = {r["name"]: r for r in ranks}
+            # Fetch member details (a member created moments ago may not be mirrored yet)
+            member = read_model.get_doc("Gym Member", member_id)
+            if member is None:
+                resp = requests.get(
+                    f"{url}/api/resource/Gym Member/{member_id}",
+                    headers=headers,
+                    timeout=10
+                )
+                if resp.status_code == 200:
+                    member = resp.json().get("data", {})
+
+            belt_ranks = _belt_ranks(url, headers)
 
             # Fetch membership types
-            resp = requests.get(
-                f"{url}/api/resource/Membership Type",
-                headers=headers,
-                params={
-                    "filters": '[["is_active", "=", 1]]',
-                    "fields": '["name", "membership_name", "price", "membership_category", "is_recurring"]',
-                    "limit_page_length": 100
-                },
-                timeout=10
-            )
-            if resp.status_code == 200:
-                membership_types = resp.json().get("data", [])
+            mirrored = read_model.get_list("Membership Type", [["is_active", "=", 1]], limit=100)
+            if mirrored is not None:
+                membership_types = mirrored
+            else:
+                resp = requests.get(
+                    f"{url}/api/resource/Membership Type",
+                    headers=headers,
+                    params={
+                        "filters": '[["is_active", "=", 1]]',
+                        "fields": '["name", "membership_name", "price", "membership_category", "is_recurring"]',
+                        "limit_page_length": 100
+                    },
+                    timeout=10
+                )
+                if resp.status_code == 200:
+                    membership_types = resp.json().get("data", [])
 
             # Fetch recent attendance
-            resp = requests.get(
-                f"{url}/api/resource/Gym Attendance",
-                headers=headers,
-                params={
-                    "filters": f'[["member", "=", "{member_id}"]]',
-                    "fields": '["name", "check_in_time", "training_counted"]',
-                    "order_by": "check_in_time desc",
-                    "limit_page_length": 20
-                },
-                timeout=10
+            mirrored = read_model.get_list(
+                "Gym Attendance", [["member", "=", member_id]],
+                order_by="attendance_date desc, check_in_time desc", limit=20
             )
-            if resp.status_code == 200:
-                attendance_history = resp.json().get("data", [])
+            if mirrored is not None:
+                attendance_history = mirrored
+            else:
+                resp = requests.get(
+                    f"{url}/api/resource/Gym Attendance",
+                    headers=headers,
+                    params={
+                        "filters": f'[["member", "=", "{member_id}"]]',
+                        "fields": '["name", "check_in_time", "training_counted"]',
+                        "order_by": "check_in_time desc",
+                        "limit_page_length": 20
+                    },
+                    timeout=10
+                )
+                if resp.status_code == 200:
+                    attendance_history = resp.json().get("data", [])
 
         except Exception as e:
             print(f"Error fetching member details: {e}")
@@ -405,6 +438,7 @@ async def create_member(enrollment: EnrollmentRequest):
         if resp.status_code in [200, 201]:
             result = resp.json()
             member_id = result.get("data", {}).get("name")
+            get_read_model().upsert("Gym Member", result.get("data", {}))
             return JSONResponse({
                 "success": True,
                 "message": f"Member {enrollment.first_name} {enrollment.last_name} enrolled successfully",
@@ -453,6 +487,7 @@ async def update_member_status(member_id: str, req: StatusUpdateRequest):
         )
 
         if resp.status_code == 200:
+            get_read_model().upsert("Gym Member", resp.json().get("data", {}))
             action = {
                 "Active": "reactivated",
                 "Suspended": "suspended",
@@ -496,6 +531,7 @@ async def update_member_membership(member_id: str, req: MembershipUpdateRequest)
         )
 
         if resp.status_code == 200:
+            get_read_model().upsert("Gym Member", resp.json().get("data", {}))
             return JSONResponse({
                 "success": True,
                 "message": "Membership updated successfully"
@@ -534,6 +570,7 @@ async def update_payment_status(member_id: str, payment_status: str):
         )
 
         if resp.status_code == 200:
+            get_read_model().upsert("Gym Member", resp.json().get("data", {}))
             return JSONResponse({
                 "success": True,
                 "message": "Payment status updated"
@@ -557,21 +594,24 @@ async def check_rfid(rfid_tag: str):
         return JSONResponse({"success": False, "error": "Not connected"}, status_code=503)
 
     try:
-        resp = requests.get(
-            f"{url}/api/resource/Gym Member",
-            headers=headers,
-            params={"filters": f'[["rfid_tag", "=", "{rfid_tag}"]]', "fields": '["name", "full_name"]'},
-            timeout=10
-        )
+        # A tag found in the read model is in use; a miss is confirmed with ERPNext,
+        # which may have assigned it since the last sync
+        members = get_read_model().get_list("Gym Member", [["rfid_tag", "=", rfid_tag]], limit=1)
+        if not members:
+            resp = requests.get(
+                f"{url}/api/resource/Gym Member",
+                headers=headers,
+                params={"filters": f'[["rfid_tag", "=", "{rfid_tag}"]]', "fields": '["name", "full_name"]'},
+                timeout=10
+            )
+            members = resp.json().get("data", []) if resp.status_code == 200 else []
 
-        if resp.status_code == 200:
-            members = resp.json().get("data", [])
-            if members:
-                return JSONResponse({
-                    "success": True,
-                    "in_use": True,
-                    "used_by": members[0].get("full_name", "Unknown")
-                })
+        if members:
+            return JSONResponse({
+                "success": True,
+                "in_use": True,
+                "used_by": members[0].get("full_name", "Unknown")
+            })
 
         return JSONResponse({"success": True, "in_use": False})
 
@@ -651,6 +691,7 @@ async def update_member(member_id: str, req: MemberUpdateRequest):
         )
 
         if resp.status_code == 200:
+            get_read_model().upsert("Gym Member", resp.json().get("data", {}))
             return JSONResponse({
                 "success": True,
                 "message": "Member updated successfully"
@@ -687,6 +728,7 @@ async def delete_member(member_id: str):
         )
 
         if resp.status_code == 200:
+            get_read_model().delete("Gym Member", member_id)
             return JSONResponse({
                 "success": True,
                 "message": "Member deleted successfully"
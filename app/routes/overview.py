@@ -1,11 +1,22 @@
 from fastapi import APIRouter, Request, HTTPException, Depends
-from fastapi.templating import Jinja2Templates
 from ..utils.erp_client import ERPNextClient, get_erp_client
+from ..utils.read_model import get_read_model
 from datetime import datetime, timedelta
 import json
+from ..utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
+
+
+def _user_full_name(erp_client: ERPNextClient, user_id: str, names: dict):
+    """Full name of an ERPNext User, looked up once per page."""
+    if user_id not in names:
+        names[user_id] = None
+        user_response = erp_client.session.get(f"{erp_client.base_url}/api/resource/User/{user_id}")
+        if user_response.status_code == 200:
+            names[user_id] = user_response.json().get('data', {}).get('full_name')
+    return names[user_id]
+
 
 @router.get("/overview")
 async def get_overview(request: Request, days: int = 7, erp_client: ERPNextClient = Depends(get_erp_client)):
@@ -14,19 +25,18 @@ async def get_overview(request: Request, days: int = 7, erp_client: ERPNextClien
         api_endpoint = f"{erp_client.base_url}/api/method/frappe.client.get_list"
         invoice_params = {
             'doctype': 'Sales Invoice',
-            'fields': '["*"]',
             'filters': json.dumps({
                 'status': ['in', ['Unpaid', 'Overdue']],  # Get both unpaid and overdue invoices
                 'docstatus': 1,  # Only submitted invoices
                 'outstanding_amount': ['>', 0]  # Only invoices with remaining balance
             }),
-            'order_by': 'due_date asc'  # Sort by due date
+            'order_by': 'due_date asc',  # Sort by due date
+            'limit_page_length': 0  # Totals cover every unpaid invoice, as with the read model
         }
         
         # Get recent payments for the specified time period
         payment_params = {
             'doctype': 'Payment Entry',
-            'fields': '["*"]',
             'filters': json.dumps({
                 'payment_type': 'Receive',
                 'docstatus': 1,  # Submitted payments
@@ -35,31 +45,52 @@ async def get_overview(request: Request, days: int = 7, erp_client: ERPNextClien
             'order_by': 'creation desc'
         }
         
-        print("\nFetching invoices and payments...")
-        invoice_response = erp_client.session.get(api_endpoint, params=invoice_params)
-        payment_response = erp_client.session.get(api_endpoint, params=payment_params)
-        
-        print(f"\nInvoice response status: {invoice_response.status_code}")
-        print(f"Invoice response: {invoice_response.text[:500]}...")
-        
-        print(f"\nPayment response status: {payment_response.status_code}")
-        print(f"Payment response: {payment_response.text[:500]}...")
+        # Read both lists from the local read model; ask ERPNext only until it is synced
+        read_model = get_read_model()
+        invoice_rows = read_model.get_list("Sales Invoice", [
+            ["status", "in", ["Unpaid", "Overdue"]],
+            ["docstatus", "=", 1],
+            ["outstanding_amount", ">", 0]
+        ], order_by="due_date asc")
+        payment_rows = read_model.get_list("Payment Entry", [
+            ["payment_type", "=", "Receive"],
+            ["docstatus", "=", 1],
+            ["posting_date", ">=", (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')]
+        ], order_by="creation desc")
+        # Mirrored payments already carry their references
+        payments_mirrored = payment_rows is not None
+
+        if invoice_rows is None:
+            print("\nFetching invoices...")
+            invoice_response = erp_client.get_projected(api_endpoint, invoice_params, "overview_invoices")
+            print(f"\nInvoice response status: {invoice_response.status_code}")
+            if invoice_response.status_code == 200:
+                invoice_rows = invoice_response.json().get('message', [])
+
+        if payment_rows is None:
+            print("\nFetching payments...")
+            payment_response = erp_client.get_projected(api_endpoint, payment_params, "overview_payments")
+            print(f"\nPayment response status: {payment_response.status_code}")
+            if payment_response.status_code == 200:
+                payment_rows = payment_response.json().get('message', [])
         
         invoices = []
         recent_payments = []
         today = datetime.now().date()
+        user_names = {}
         
         # Process invoice data
-        if invoice_response.status_code == 200:
-            data = invoice_response.json()
-            
-            for inv in data.get('message', []):
+        if invoice_rows is not None:
+            # Customers 100 per request rather than one request each
+            customers = erp_client.search_customers_by_name(
+                list(dict.fromkeys(inv.get('customer') for inv in invoice_rows))
+            )
+            for inv in invoice_rows:
                 due_date = datetime.strptime(inv.get('due_date'), '%Y-%m-%d').date()
                 days_difference = (due_date - today).days
                 is_overdue = days_difference < 0
                 
-                # Get customer details
-                customer = erp_client.search_customer_by_name(inv.get('customer'))
+                customer = customers.get(inv.get('customer'))
                 family_group = erp_client.get_family_group(inv.get('customer')) if customer else None
                 
                 invoice_data = {
@@ -106,18 +137,18 @@ async def get_overview(request: Request, days: int = 7, erp_client: ERPNextClien
             totals = {'overdue': 0, 'unpaid': 0, 'total': 0}
         
         # Process payment data
-        if payment_response.status_code == 200:
-            payments_data = payment_response.json().get('message', [])
-            
-            for payment in payments_data:
+        if payment_rows is not None:
+            for payment in payment_rows:
                 # Get detailed payment entry
-                detail_response = erp_client.session.get(
-                    f"{erp_client.base_url}/api/resource/Payment Entry/{payment.get('name')}"
-                )
+                payment_detail = payment if payments_mirrored else None
+                if payment_detail is None:
+                    detail_response = erp_client.session.get(
+                        f"{erp_client.base_url}/api/resource/Payment Entry/{payment.get('name')}"
+                    )
+                    if detail_response.status_code == 200:
+                        payment_detail = detail_response.json().get('data', {})
                 
-                if detail_response.status_code == 200:
-                    payment_detail = detail_response.json().get('data', {})
-                    
+                if payment_detail is not None:
                     # Get staff information - First try authorized_by_staff
                     staff_user_id = payment_detail.get('authorized_by_staff')
                     processed_by = None
@@ -125,24 +156,16 @@ async def get_overview(request: Request, days: int = 7, erp_client: ERPNextClien
                     
                     if staff_user_id:
                         # Look up staff name from User document
-                        user_response = erp_client.session.get(
-                            f"{erp_client.base_url}/api/resource/User/{staff_user_id}"
-                        )
-                        if user_response.status_code == 200:
-                            user_data = user_response.json().get('data', {})
-                            processed_by = user_data.get('full_name')
+                        processed_by = _user_full_name(erp_client, staff_user_id, user_names)
+                        if processed_by:
                             processed_time = payment_detail.get('authorization_time')
                     
                     # If no authorized_by_staff, fall back to owner
                     if not processed_by:
                         owner_id = payment_detail.get('owner')
                         if owner_id:
-                            user_response = erp_client.session.get(
-                                f"{erp_client.base_url}/api/resource/User/{owner_id}"
-                            )
-                            if user_response.status_code == 200:
-                                user_data = user_response.json().get('data', {})
-                                processed_by = user_data.get('full_name')
+                            processed_by = _user_full_name(erp_client, owner_id, user_names)
+                            if processed_by:
                                 processed_time = payment_detail.get('creation')
 
                     # Get referenced invoices
@@ -1,16 +1,16 @@
 from fastapi import APIRouter, Request, HTTPException, Depends, Body
-from fastapi.templating import Jinja2Templates
 from ..utils.erp_client import ERPNextClient, get_erp_client
 from pydantic import BaseModel, ValidationError
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
+import asyncio
 import json
 import uuid
 from ..services.payment_service import PaymentService
 from ..services.handover_service import HandoverService
+from ..utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 # Models
 class RFIDInput(BaseModel):
@@ -120,6 +120,24 @@ async def process_payment(request: Request, session_id: str, erp_client: ERPNext
             }
         )
 
+@router.get("/process/{session_id}/items")
+async def get_invoice_items(session_id: str, invoices: str, erp_client: ERPNextClient = Depends(get_erp_client)):
+    """Load item rows for invoices in a payment session (when the UI expands them)"""
+    payment_service = PaymentService(erp_client)
+    session = payment_service.get_session(session_id)
+
+    if not session:
+        raise HTTPException(status_code=404, detail="Session expired, please scan card again")
+
+    # Only allow invoices that belong to this session's payer
+    session_invoices = {tx.get("data", {}).get("name") for tx in session.get("invoices", [])}
+    requested = [name for name in invoices.split(",") if name in session_invoices]
+
+    return {
+        "status": "success",
+        "items": payment_service.get_invoice_items(requested)
+    }
+
 @router.post("/authorize-staff")
 async def authorize_staff(auth_request: StaffAuthRequest, erp_client: ERPNextClient = Depends(get_erp_client)):
     try:
@@ -128,7 +146,7 @@ async def authorize_staff(auth_request: StaffAuthRequest, erp_client: ERPNextCli
         if not auth_request.staff_rfid:
             raise HTTPException(status_code=400, detail="Staff RFID required")
 
-        staff_result = erp_client.verify_staff_rfid(auth_request.staff_rfid)
+        staff_result = await asyncio.to_thread(erp_client.verify_staff_rfid, auth_request.staff_rfid)
         print(f"Staff verification result: {staff_result}")
         
         if not staff_result.get("verified"):
@@ -163,7 +181,7 @@ async def process_payment_submission(
         print(f"\nProcessing payment request: {payment_request}")
         
         # Verify staff authorization first
-        staff_auth = erp_client.verify_staff_rfid(payment_request.staff_rfid)
+        staff_auth = await asyncio.to_thread(erp_client.verify_staff_rfid, payment_request.staff_rfid)
         if not staff_auth.get("verified"):
             raise HTTPException(
                 status_code=401,
@@ -359,8 +377,9 @@ async def payment_details(
 # ============================================================
 
 from ..utils.config import get_config
+from ..utils.fast_json import JSONResponse
+from ..utils.staff_directory import get_staff_directory
 import requests as http_requests
-from fastapi.responses import JSONResponse
 
 def get_erpnext_connection():
     """Get ERPNext connection for new payment system."""
@@ -495,25 +514,15 @@ async def verify_staff_for_payment(rfid_tag: str):
         return JSONResponse({"success": False, "error": "ERPNext not connected"}, status_code=503)
 
     try:
-        response = http_requests.get(
-            f"{url}/api/resource/Gym Staff",
-            headers=headers,
-            params={
-                "filters": f'[["rfid_tag", "=", "{rfid_tag}"], ["is_active", "=", 1]]',
-                "fields": '["name", "staff_name", "role", "can_process_payments", "photo"]'
-            },
-            timeout=10
-        )
+        directory = get_staff_directory()
+        staff = await asyncio.to_thread(directory.find_staff, rfid_tag, permission="can_process_payments")
 
-        if response.status_code != 200:
+        if not directory.is_loaded():
             return JSONResponse({"success": False, "error": "Failed to query ERPNext"}, status_code=500)
 
-        staff_list = response.json().get("data", [])
-        if not staff_list:
+        if not staff:
             return JSONResponse({"success": False, "error": "Staff not found or inactive"}, status_code=404)
 
-        staff = staff_list[0]
-
         if not staff.get("can_process_payments"):
             return JSONResponse({
                 "success": False,
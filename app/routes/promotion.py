@@ -4,15 +4,22 @@ Belt promotion routes with coach RFID verification.
 Handles member rank progression in BJJ belt system.
 """
 from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse
 from datetime import date
+from typing import Optional
+import asyncio
 import requests as http_requests
 
 from ..utils.config import get_config
+from ..utils.fast_json import JSONResponse
+from ..utils.rank_table import get_rank_table
+from ..utils.read_model import get_read_model
+from ..utils.staff_directory import get_staff_directory
+from ..services.rank_progress import get_rank_progress
+from ..services.promotion_batch import apply_batch, MAX_BATCH_SIZE
+from ..utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 
 def get_erpnext_connection():
@@ -49,108 +56,43 @@ async def lookup_member_for_promotion(rfid_tag: str):
         return JSONResponse({"success": False, "error": "ERPNext not connected"}, status_code=503)
 
     try:
-        # Get member details
-        response = http_requests.get(
-            f"{url}/api/resource/Gym Member",
-            headers=headers,
-            params={
-                "filters": f'[["rfid_tag", "=", "{rfid_tag}"]]',
-                "fields": '["name", "first_name", "last_name", "full_name", "photo", "member_type", "status", "current_rank", "current_stripes", "days_at_current_rank", "total_training_days", "payment_status", "eligible_for_promotion", "last_promotion_date"]'
-            },
-            timeout=10
-        )
-
-        if response.status_code != 200:
-            return JSONResponse({"success": False, "error": "Failed to query ERPNext"}, status_code=500)
-
-        members = response.json().get("data", [])
-        if not members:
+        # Progress and ranks come from memory; ERPNext is only queried for a member not seen yet
+        progress = await asyncio.to_thread(get_rank_progress().get, rfid=rfid_tag)
+        if not progress:
             return JSONResponse({"success": False, "error": "Member not found"}, status_code=404)
 
-        member = members[0]
-        member_id = member.get("name")
-
-        # Get current rank details
-        current_rank_info = None
-        next_rank_info = None
-        days_required = 0
-
-        if member.get("current_rank"):
-            rank_response = http_requests.get(
-                f"{url}/api/resource/Belt Rank/{member['current_rank']}",
-                headers=headers,
-                timeout=10
-            )
-            if rank_response.status_code == 200:
-                rank_data = rank_response.json().get("data", {})
-                current_rank_info = {
-                    "name": rank_data.get("rank_name"),
-                    "color": rank_data.get("color"),
-                    "order": rank_data.get("rank_order"),
-                    "days_required": rank_data.get("days_required", 0),
-                    "stripes_available": rank_data.get("stripes_available", 4)
-                }
-                days_required = rank_data.get("days_required", 0)
-
-                # Find the next rank
-                next_order = rank_data.get("rank_order", 0) + 1
-                next_response = http_requests.get(
-                    f"{url}/api/resource/Belt Rank",
-                    headers=headers,
-                    params={
-                        "filters": f'[["rank_order", "=", {next_order}], ["is_active", "=", 1]]',
-                        "fields": '["name", "rank_name", "color", "rank_order", "days_required"]'
-                    },
-                    timeout=10
-                )
-                if next_response.status_code == 200:
-                    next_ranks = next_response.json().get("data", [])
-                    if next_ranks:
-                        next_rank_info = {
-                            "id": next_ranks[0].get("name"),
-                            "name": next_ranks[0].get("rank_name"),
-                            "color": next_ranks[0].get("color")
-                        }
-
-        # Get all available ranks for manual selection
-        all_ranks_response = http_requests.get(
-            f"{url}/api/resource/Belt Rank",
-            headers=headers,
-            params={
-                "filters": '[["is_active", "=", 1]]',
-                "fields": '["name", "rank_name", "color", "rank_order"]',
-                "order_by": "rank_order asc"
-            },
-            timeout=10
-        )
-
-        all_ranks = []
-        if all_ranks_response.status_code == 200:
-            all_ranks = all_ranks_response.json().get("data", [])
+        # All available ranks for manual selection
+        all_ranks = [
+            {"name": r.get("name"), "rank_name": r.get("rank_name"), "color": r.get("color"), "rank_order": r.get("rank_order")}
+            for r in get_rank_table().active_ranks()
+        ]
 
         # Check eligibility
-        days_at_rank = member.get("days_at_current_rank", 0)
-        payment_current = member.get("payment_status") == "Current"
-        meets_days_requirement = days_required > 0 and days_at_rank >= days_required
+        days_required = progress["days_required"]
+        days_at_rank = progress["days_at_current_rank"]
+        payment_current = progress["payment_status"] == "Current"
+        meets_days_requirement = progress["eligible_for_promotion"]
         is_eligible = meets_days_requirement and payment_current
 
         return JSONResponse({
             "success": True,
             "member": {
-                "id": member_id,
-                "first_name": member.get("first_name"),
-                "last_name": member.get("last_name"),
-                "full_name": member.get("full_name") or f"{member.get('first_name', '')} {member.get('last_name', '')}".strip(),
-                "photo": member.get("photo"),
-                "member_type": member.get("member_type"),
-                "status": member.get("status"),
-                "current_stripes": member.get("current_stripes", 0),
+                "id": progress["member_id"],
+                "first_name": progress["first_name"],
+                "last_name": progress["last_name"],
+                "full_name": progress["full_name"],
+                "photo": progress["photo"],
+                "member_type": progress["member_type"],
+                "status": progress["status"],
+                "current_stripes": progress["current_stripes"],
                 "days_at_current_rank": days_at_rank,
-                "total_training_days": member.get("total_training_days", 0),
-                "payment_status": member.get("payment_status"),
-                "last_promotion_date": member.get("last_promotion_date"),
-                "current_rank": current_rank_info,
-                "next_rank": next_rank_info
+                "total_training_days": progress["total_training_days"],
+                "payment_status": progress["payment_status"],
+                "last_promotion_date": progress["last_promotion_date"],
+                "current_rank": progress["rank"],
+                "next_rank": progress["next_rank"],
+                "training_days_last_30": progress["training_days_last_30"],
+                "projected_promotion_date": progress["projected_promotion_date"]
             },
             "eligibility": {
                 "is_eligible": is_eligible,
@@ -166,6 +108,74 @@ async def lookup_member_for_promotion(rfid_tag: str):
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
 
 
+# Sort keys for the candidate list (all ascending except progress)
+CANDIDATE_SORTS = {
+    "progress": lambda c: (-(c["percent_to_next_rank"] or 0), c["full_name"]),
+    "days_remaining": lambda c: (c["days_to_next_rank"] is None, c["days_to_next_rank"] or 0, c["full_name"]),
+    "projected": lambda c: (c["projected_promotion_date"] is None, c["projected_promotion_date"] or "", c["full_name"]),
+    "name": lambda c: c["full_name"].lower(),
+}
+
+
+@router.get("/candidates")
+async def list_promotion_candidates(sort: str = "progress", eligible_only: bool = False,
+                                    rank: Optional[str] = None, page: int = 1, page_size: int = 50):
+    """Active members ranked by progress towards their next belt."""
+    url, headers, connected = get_erpnext_connection()
+
+    if not connected:
+        return JSONResponse({"success": False, "error": "ERPNext not connected"}, status_code=503)
+
+    if sort not in CANDIDATE_SORTS:
+        return JSONResponse({
+            "success": False,
+            "error": f"sort must be one of: {', '.join(CANDIDATE_SORTS)}"
+        }, status_code=400)
+
+    try:
+        candidates = await asyncio.to_thread(get_rank_progress().candidates)
+
+        if eligible_only:
+            candidates = [c for c in candidates if c["is_eligible"]]
+        if rank:
+            candidates = [c for c in candidates if c["current_rank"] == rank]
+        candidates = sorted(candidates, key=CANDIDATE_SORTS[sort])
+
+        page = max(page, 1)
+        page_size = min(max(page_size, 1), 200)
+        start = (page - 1) * page_size
+
+        return JSONResponse({
+            "success": True,
+            "total": len(candidates),
+            "page": page,
+            "page_size": page_size,
+            "candidates": [
+                {
+                    "id": c["member_id"],
+                    "full_name": c["full_name"],
+                    "photo": c["photo"],
+                    "payment_status": c["payment_status"],
+                    "current_rank": c["rank"],
+                    "next_rank": c["next_rank"],
+                    "current_stripes": c["current_stripes"],
+                    "days_at_current_rank": c["days_at_current_rank"],
+                    "days_required": c["days_required"],
+                    "days_to_next_rank": c["days_to_next_rank"],
+                    "percent_to_next_rank": c["percent_to_next_rank"],
+                    "training_days_last_30": c["training_days_last_30"],
+                    "projected_promotion_date": c["projected_promotion_date"],
+                    "meets_days_requirement": c["eligible_for_promotion"],
+                    "is_eligible": c["is_eligible"]
+                }
+                for c in candidates[start:start + page_size]
+            ]
+        })
+
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
 @router.get("/coach/{rfid_tag}")
 async def verify_coach_for_promotion(rfid_tag: str):
     """Verify coach RFID for promotion authorization."""
@@ -175,25 +185,15 @@ async def verify_coach_for_promotion(rfid_tag: str):
         return JSONResponse({"success": False, "error": "ERPNext not connected"}, status_code=503)
 
     try:
-        response = http_requests.get(
-            f"{url}/api/resource/Gym Staff",
-            headers=headers,
-            params={
-                "filters": f'[["rfid_tag", "=", "{rfid_tag}"], ["is_active", "=", 1]]',
-                "fields": '["name", "staff_name", "role", "can_promote", "photo", "current_rank"]'
-            },
-            timeout=10
-        )
+        directory = get_staff_directory()
+        staff = await asyncio.to_thread(directory.find_staff, rfid_tag, permission="can_promote")
 
-        if response.status_code != 200:
+        if not directory.is_loaded():
             return JSONResponse({"success": False, "error": "Failed to query ERPNext"}, status_code=500)
 
-        staff_list = response.json().get("data", [])
-        if not staff_list:
+        if not staff:
             return JSONResponse({"success": False, "error": "Staff not found or inactive"}, status_code=404)
 
-        staff = staff_list[0]
-
         if not staff.get("can_promote"):
             return JSONResponse({
                 "success": False,
@@ -201,21 +201,6 @@ async def verify_coach_for_promotion(rfid_tag: str):
                 "staff_name": staff.get("staff_name")
             }, status_code=403)
 
-        # Get staff's rank info if available
-        staff_rank = None
-        if staff.get("current_rank"):
-            rank_response = http_requests.get(
-                f"{url}/api/resource/Belt Rank/{staff['current_rank']}",
-                headers=headers,
-                timeout=10
-            )
-            if rank_response.status_code == 200:
-                rank_data = rank_response.json().get("data", {})
-                staff_rank = {
-                    "name": rank_data.get("rank_name"),
-                    "color": rank_data.get("color")
-                }
-
         return JSONResponse({
             "success": True,
             "coach": {
@@ -223,7 +208,7 @@ async def verify_coach_for_promotion(rfid_tag: str):
                 "name": staff.get("staff_name"),
                 "role": staff.get("role"),
                 "photo": staff.get("photo"),
-                "rank": staff_rank
+                "rank": staff.get("rank")
             }
         })
 
@@ -315,19 +300,15 @@ async def promote_member(request: Request):
                 "error": "Failed to update member rank"
             }, status_code=500)
 
-        # Get new rank info for response
-        new_rank_response = http_requests.get(
-            f"{url}/api/resource/Belt Rank/{new_rank_id}",
-            headers=headers,
-            timeout=10
-        )
+        # Check-ins read the member from the mirror; a stale rank there would
+        # count days at the old rank and write them back over the reset
+        get_read_model().upsert("Gym Member", update_response.json().get("data", {}))
+        get_rank_progress().record_promotion(member_id, new_rank_id, date.today())
 
-        new_rank_name = new_rank_id
-        new_rank_color = "#000000"
-        if new_rank_response.status_code == 200:
-            new_rank_data = new_rank_response.json().get("data", {})
-            new_rank_name = new_rank_data.get("rank_name", new_rank_id)
-            new_rank_color = new_rank_data.get("color", "#000000")
+        # New rank info for response
+        new_rank_data = get_rank_table().get(new_rank_id) or {}
+        new_rank_name = new_rank_data.get("rank_name", new_rank_id)
+        new_rank_color = new_rank_data.get("color", "#000000")
 
         return JSONResponse({
             "success": True,
@@ -380,16 +361,8 @@ async def add_stripe(request: Request):
         current_rank = member_data.get("current_rank")
 
         # Check max stripes for this rank
-        max_stripes = 4
-        if current_rank:
-            rank_response = http_requests.get(
-                f"{url}/api/resource/Belt Rank/{current_rank}",
-                headers=headers,
-                timeout=10
-            )
-            if rank_response.status_code == 200:
-                rank_data = rank_response.json().get("data", {})
-                max_stripes = rank_data.get("stripes_available", 4)
+        rank_data = get_rank_table().get(current_rank) or {}
+        max_stripes = rank_data.get("stripes_available", 4)
 
         if current_stripes >= max_stripes:
             return JSONResponse({
@@ -412,6 +385,9 @@ async def add_stripe(request: Request):
                 "error": "Failed to update stripe count"
             }, status_code=500)
 
+        get_read_model().upsert("Gym Member", update_response.json().get("data", {}))
+        get_rank_progress().record_stripe(member_id, new_stripes)
+
         return JSONResponse({
             "success": True,
             "message": "Stripe added",
@@ -421,3 +397,51 @@ async def add_stripe(request: Request):
 
     except Exception as e:
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
+@router.post("/batch")
+async def batch_promote(request: Request):
+    """Apply a batch of promotions and stripes authorized by one coach scan."""
+    url, headers, connected = get_erpnext_connection()
+
+    if not connected:
+        return JSONResponse({"success": False, "error": "ERPNext not connected"}, status_code=503)
+
+    try:
+        body = await request.json()
+        coach_rfid = body.get("coach_rfid")
+        items = body.get("items") or []
+
+        if not coach_rfid or not isinstance(items, list) or not items:
+            return JSONResponse({
+                "success": False,
+                "error": "Missing required fields: coach_rfid, items"
+            }, status_code=400)
+
+        if len(items) > MAX_BATCH_SIZE:
+            return JSONResponse({
+                "success": False,
+                "error": f"At most {MAX_BATCH_SIZE} items per batch"
+            }, status_code=400)
+
+        directory = get_staff_directory()
+        coach = await asyncio.to_thread(directory.find_staff, coach_rfid, permission="can_promote")
+        if not directory.is_loaded():
+            return JSONResponse({"success": False, "error": "Failed to query ERPNext"}, status_code=500)
+        if not coach or not coach.get("can_promote"):
+            return JSONResponse({"success": False, "error": "Not authorized to promote members"}, status_code=403)
+
+        results = await asyncio.to_thread(apply_batch, url.rstrip('/'), headers, coach["name"], items)
+        applied = sum(1 for r in results if r["success"])
+
+        return JSONResponse({
+            "success": applied == len(results),
+            "message": f"{applied} of {len(results)} applied",
+            "coach": {"id": coach.get("name"), "name": coach.get("staff_name")},
+            "results": results
+        })
+
+    except Exception as e:
+        import traceback
+        print(f"Batch promotion error: {traceback.format_exc()}")
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
@@ -1,8 +1,8 @@
 # app/routes/settings.py
 from fastapi import APIRouter, Request, UploadFile, File
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pathlib import Path
+import asyncio
 import json
 import shutil
 import time
@@ -10,10 +10,10 @@ import os
 import requests
 
 from ..utils.config import get_config
-from ..utils.erpnext_init import get_initializer
+from ..utils.fast_json import JSONResponse
+from ..utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 # Paths
 STATIC_DIR = Path("app/static")
@@ -21,6 +21,10 @@ IMAGES_DIR = STATIC_DIR / "images"
 LOGO_PATH = IMAGES_DIR / "logo.png"
 CONFIG_PATH = Path("config.json")
 
+# Backup status counts are cached briefly so reopening settings is instant
+BACKUP_STATUS_CACHE_TTL = 30
+_backup_status_cache = {"url": None, "counts": {}, "loaded_at": 0.0}
+
 
 def ensure_dirs():
     """Ensure required directories exist."""
@@ -49,7 +53,6 @@ async def settings_page(request: Request):
         {
             "request": request,
             "logo_exists": LOGO_PATH.exists(),
-            "cache_bust": int(time.time()),
             "is_connected": is_connected,
             "erpnext_url": erp_config.get('url', ''),
         }
@@ -163,92 +166,66 @@ async def restore_config(config: UploadFile = File(...)):
         return JSONResponse({"success": False, "error": f"Restore failed: {str(e)}"})
 
 
-def _fetch_erpnext_data(url: str, api_key: str, api_secret: str, doctype: str, fields: list = None, limit: int = 0):
-    """Fetch data from ERPNext for a specific doctype."""
-    try:
-        headers = {
-            'Authorization': f'token {api_key}:{api_secret}',
-            'Content-Type': 'application/json'
-        }
-
-        params = {
-            'limit_page_length': limit if limit > 0 else 0  # 0 means no limit
-        }
-
-        if fields:
-            params['fields'] = json.dumps(fields)
-
-        response = requests.get(
-            f"{url}/api/resource/{doctype}",
-            headers=headers,
-            params=params,
-            timeout=60
-        )
-
-        if response.status_code == 200:
-            return response.json().get('data', [])
-        return []
-    except Exception as e:
-        print(f"Error fetching {doctype}: {str(e)}")
-        return []
-
-
 @router.get("/backup/erpnext")
-async def backup_erpnext():
-    """Download ERPNext data backup."""
+async def backup_erpnext(gzip: bool = False):
+    """Download ERPNext data backup as streamed NDJSON (optionally gzip-compressed)."""
     config = get_config()
 
     if not config.is_configured():
         return JSONResponse({"success": False, "error": "ERPNext not configured"})
 
     erp_config = config.get_erpnext_config()
-    url = erp_config.get('url', '')
-    api_key = erp_config.get('api_key', '')
-    api_secret = erp_config.get('api_secret', '')
-
-    # Create backup data structure
-    backup_data = {
-        "app": "invictus-bjj-erpnext-backup",
-        "version": "1.0.0",
-        "backup_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-        "erpnext_url": url,
-        "data": {}
+    url = erp_config.get('url', '').rstrip('/')
+    headers = {
+        'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+        'Content-Type': 'application/json'
     }
 
-    # Fetch various doctypes - adjust these based on your ERPNext setup
-    doctypes_to_backup = [
-        "Customer",
-        "Gym Member",
-        "Sales Invoice",
-        "Payment Entry",
-        "Journal Entry",
-        "Membership",
-        "Membership Type",
-    ]
-
-    for doctype in doctypes_to_backup:
-        try:
-            data = _fetch_erpnext_data(url, api_key, api_secret, doctype)
-            if data:
-                backup_data["data"][doctype] = data
-                print(f"Backed up {len(data)} {doctype} records")
-        except Exception as e:
-            print(f"Could not backup {doctype}: {str(e)}")
+    backup_filename = f"erpnext_backup_{time.strftime('%Y%m%d_%H%M%S')}.ndjson"
+    if gzip:
+        backup_filename += ".gz"
 
-    # Write to temp file
-    backup_filename = f"erpnext_backup_{time.strftime('%Y%m%d_%H%M%S')}.json"
-    backup_path = Path("/tmp") / backup_filename
+    from ..utils.erpnext_backup import stream_backup, BACKUP_DOCTYPES
 
-    with open(backup_path, 'w') as f:
-        json.dump(backup_data, f, indent=2)
-
-    return FileResponse(
-        path=backup_path,
-        filename=backup_filename,
-        media_type='application/json'
+    # Sync generator - Starlette iterates it in a worker thread, off the event loop
+    return StreamingResponse(
+        stream_backup(url, headers, BACKUP_DOCTYPES, compress=gzip),
+        media_type='application/gzip' if gzip else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{backup_filename}"'}
     )
 
 
+@router.post("/backup/erpnext/snapshot")
+async def backup_erpnext_snapshot(mode: str = "auto"):
+    """Write a full or delta backup snapshot to the server's backup directory."""
+    from ..utils.erpnext_backup import get_backup_snapshots
+    try:
+        snapshot = await asyncio.to_thread(get_backup_snapshots().take_snapshot, mode)
+        return JSONResponse({"success": True, "snapshot": snapshot})
+    except (ValueError, RuntimeError) as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"success": False, "error": f"Backup failed: {str(e)}"}, status_code=500)
+
+
+@router.get("/backup/erpnext/snapshots")
+async def backup_erpnext_snapshots():
+    """List backup snapshots and the current high-water marks."""
+    from ..utils.erpnext_backup import get_backup_snapshots
+    return JSONResponse({"success": True, **get_backup_snapshots().get_manifest()})
+
+
+@router.get("/backup/erpnext/snapshots/{filename}")
+async def download_backup_snapshot(filename: str):
+    """Download a backup snapshot listed in the manifest."""
+    from ..utils.erpnext_backup import get_backup_snapshots
+    path = get_backup_snapshots().get_snapshot_path(filename)
+    if not path:
+        return JSONResponse({"success": False, "error": "Snapshot not found"}, status_code=404)
+
+    return FileResponse(path=path, filename=filename, media_type='application/gzip')
+
+
 @router.get("/backup/erpnext/status")
 async def backup_erpnext_status():
     """Check what data is available for backup."""
@@ -258,52 +235,91 @@ async def backup_erpnext_status():
         return JSONResponse({"success": False, "error": "ERPNext not configured"})
 
     erp_config = config.get_erpnext_config()
-    url = erp_config.get('url', '')
-    api_key = erp_config.get('api_key', '')
-    api_secret = erp_config.get('api_secret', '')
+    url = erp_config.get('url', '').rstrip('/')
 
+    cached = _backup_status_cache
+    if cached["url"] == url and time.monotonic() - cached["loaded_at"] < BACKUP_STATUS_CACHE_TTL:
+        return JSONResponse({"success": True, "counts": cached["counts"]})
+
+    headers = {
+        'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+        'Content-Type': 'application/json'
+    }
+    from ..utils.erpnext_backup import count_doctypes
     doctypes = ["Customer", "Gym Member", "Sales Invoice", "Payment Entry", "Membership"]
-    counts = {}
-
-    for doctype in doctypes:
-        try:
-            headers = {
-                'Authorization': f'token {api_key}:{api_secret}',
-                'Content-Type': 'application/json'
-            }
-            response = requests.get(
-                f"{url}/api/resource/{doctype}",
-                headers=headers,
-                params={'limit_page_length': 1},
-                timeout=10
-            )
-            if response.status_code == 200:
-                # Get total count
-                count_response = requests.get(
-                    f"{url}/api/resource/{doctype}",
-                    headers=headers,
-                    params={'limit_page_length': 0, 'fields': '["name"]'},
-                    timeout=30
-                )
-                if count_response.status_code == 200:
-                    counts[doctype] = len(count_response.json().get('data', []))
-                else:
-                    counts[doctype] = 0
-            else:
-                counts[doctype] = -1  # Not accessible
-        except Exception:
-            counts[doctype] = -1
+    counts = await asyncio.to_thread(count_doctypes, url, headers, doctypes)
 
+    cached.update({"url": url, "counts": counts, "loaded_at": time.monotonic()})
     return JSONResponse({"success": True, "counts": counts})
 
 
+def _save_upload(upload: UploadFile, path: Path) -> None:
+    """Copy an uploaded file to disk in chunks."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(upload.file, f, 1024 * 1024)
+
+
+@router.post("/restore/erpnext")
+async def restore_erpnext(backup: UploadFile = File(...)):
+    """Restore ERPNext data from a backup file (runs in the background)."""
+    config = get_config()
+
+    if not config.is_configured():
+        return JSONResponse({"success": False, "error": "ERPNext not configured"})
+
+    from ..utils.erpnext_restore import get_restore, RESTORE_DIR
+    restore = get_restore()
+    if restore.is_running():
+        return JSONResponse({"success": False, "error": "A restore is already running"}, status_code=409)
+
+    filename = Path(backup.filename or "backup.ndjson").name
+    backup_path = RESTORE_DIR / f"{time.strftime('%Y%m%d_%H%M%S')}_{filename}"
+    try:
+        await asyncio.to_thread(_save_upload, backup, backup_path)
+        status = restore.start(backup_path)
+        return JSONResponse({"success": True, "status": status})
+    except (ValueError, RuntimeError) as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"success": False, "error": f"Restore failed: {str(e)}"}, status_code=500)
+
+
+@router.post("/restore/erpnext/resume")
+async def resume_restore_erpnext():
+    """Resume an interrupted restore from its checkpoint."""
+    from ..utils.erpnext_restore import get_restore
+    try:
+        return JSONResponse({"success": True, "status": get_restore().resume()})
+    except (ValueError, RuntimeError) as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+
+@router.post("/restore/erpnext/stop")
+async def stop_restore_erpnext():
+    """Stop a running restore after its in-flight batches; it can be resumed later."""
+    from ..utils.erpnext_restore import get_restore
+    get_restore().stop()
+    return JSONResponse({"success": True})
+
+
+@router.get("/restore/erpnext/status")
+async def restore_erpnext_status():
+    """Get restore progress and throughput."""
+    from ..utils.erpnext_restore import get_restore
+    return JSONResponse({"success": True, "status": get_restore().get_status()})
+
+
 # =====================
 # ERPNext Initialization
 # =====================
+# The initializer (and its doctype tables) is only imported when one of
+# these rarely used endpoints is called, like the backup/restore engines.
 
 @router.get("/init/status")
 async def initialization_status():
     """Get the initialization status of all required doctypes."""
+    from ..utils.erpnext_init import get_initializer
     initializer = get_initializer()
     config = get_config()
 
@@ -311,7 +327,7 @@ async def initialization_status():
         return JSONResponse({"success": False, "error": "ERPNext not configured"})
 
     try:
-        status = initializer.get_initialization_status()
+        status = await asyncio.to_thread(initializer.get_initialization_status)
         is_complete = all(status.values())
 
         return JSONResponse({
@@ -326,6 +342,7 @@ async def initialization_status():
 @router.post("/init/run")
 async def run_initialization():
     """Run the initialization process to create all required doctypes."""
+    from ..utils.erpnext_init import get_initializer
     initializer = get_initializer()
     config = get_config()
 
@@ -334,21 +351,15 @@ async def run_initialization():
 
     try:
         # Create doctypes
-        results = initializer.initialize_all()
+        results = await asyncio.to_thread(initializer.initialize_all)
 
         # Check if all were successful
-        all_success = all(success for success, _ in results.values())
-
-        # Format results for response
-        formatted_results = {
-            name: {"success": success, "message": message}
-            for name, (success, message) in results.items()
-        }
+        all_success = all(r.get("success", False) for r in results.values())
 
         return JSONResponse({
             "success": all_success,
             "message": "Initialization complete" if all_success else "Some doctypes failed to create",
-            "results": formatted_results
+            "results": results
         })
     except Exception as e:
         return JSONResponse({"success": False, "error": str(e)})
@@ -357,6 +368,7 @@ async def run_initialization():
 @router.post("/init/create-defaults")
 async def create_default_data():
     """Create default membership types, class types, and belt ranks."""
+    from ..utils.erpnext_init import get_initializer
     initializer = get_initializer()
     config = get_config()
 
@@ -364,7 +376,7 @@ async def create_default_data():
         return JSONResponse({"success": False, "error": "ERPNext not configured"})
 
     try:
-        results = initializer.create_default_data()
+        results = await asyncio.to_thread(initializer.create_default_data)
 
         # Results are already formatted as dict with success/message
         all_success = all(r.get("success", False) for r in results.values() if isinstance(r, dict))
@@ -381,6 +393,7 @@ async def create_default_data():
 @router.post("/init/create-belt-ranks")
 async def create_belt_ranks():
     """Create all BJJ belt ranks (adult + kids)."""
+    from ..utils.erpnext_init import get_initializer
     initializer = get_initializer()
     config = get_config()
 
@@ -388,7 +401,7 @@ async def create_belt_ranks():
         return JSONResponse({"success": False, "error": "ERPNext not configured"})
 
     try:
-        results = initializer.create_belt_ranks_only()
+        results = await asyncio.to_thread(initializer.create_belt_ranks_only)
 
         all_success = all(r.get("success", False) for r in results.values() if isinstance(r, dict))
 
@@ -404,6 +417,7 @@ async def create_belt_ranks():
 @router.post("/init/update-doctypes")
 async def update_doctypes():
     """Update existing doctypes with any missing fields."""
+    from ..utils.erpnext_init import get_initializer
     initializer = get_initializer()
     config = get_config()
 
@@ -411,7 +425,7 @@ async def update_doctypes():
         return JSONResponse({"success": False, "error": "ERPNext not configured"})
 
     try:
-        results = initializer.update_all_doctypes()
+        results = await asyncio.to_thread(initializer.update_all_doctypes)
 
         updated = [k for k, v in results.items() if v.get("success") and "Added" in v.get("message", "")]
         up_to_date = [k for k, v in results.items() if v.get("success") and "up to date" in v.get("message", "")]
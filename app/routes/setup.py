@@ -1,15 +1,14 @@
 # app/routes/setup.py
 from fastapi import APIRouter, Request, HTTPException
-from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel
 from typing import Optional
 import requests
 
 from ..utils.config import get_config
+from ..utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 
 class SetupRequest(BaseModel):
@@ -0,0 +1,245 @@
+# app/services/attendance_analytics.py
+"""
+Attendance analytics over a member's check-in history.
+History is parsed once into sorted arrays (check-in timestamps and distinct
+epoch days) and every question - calendars, streaks, weekday frequency,
+rolling counts - is answered by binary search or bucketing over those arrays.
+Parsed histories are memoized per member until new attendance arrives.
+"""
+import json
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Iterable, List, Optional, Union
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the pure-Python paths give the same results
+    np = None
+
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Parsed histories kept in memory (least recently used are dropped first)
+MAX_CACHED_MEMBERS = 1000
+
+
+def _parse_timestamp(value: Union[str, datetime, date]) -> Optional[datetime]:
+    """Parse one check-in time; returns None for values that aren't a date-time."""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    cleaned = str(value).strip().replace('"', '')
+    if 'T' not in cleaned and ' ' not in cleaned:
+        return None
+    try:
+        return datetime.fromisoformat(cleaned[:19])
+    except ValueError:
+        return None
+
+
+class AttendanceHistory:
+    """Immutable, sorted view of one member's check-ins."""
+
+    def __init__(self, check_ins: Iterable[Union[str, datetime, date]]):
+        parsed = sorted(filter(None, (_parse_timestamp(v) for v in check_ins)))
+        self._times = parsed
+        # Seconds since midnight of day 1, for range lookups on check-ins
+        self._stamps = array('d', (t.toordinal() * 86400 + t.hour * 3600 + t.minute * 60 + t.second for t in parsed))
+        # Distinct training days as proleptic ordinals
+        self._days = array('i', sorted({t.toordinal() for t in parsed}))
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+    @property
+    def total_days(self) -> int:
+        """Distinct days trained."""
+        return len(self._days)
+
+    @property
+    def last_check_in(self) -> Optional[datetime]:
+        return self._times[-1] if self._times else None
+
+    def days_between(self, start: date, end: date) -> int:
+        """Distinct training days in [start, end]."""
+        return bisect_right(self._days, end.toordinal()) - bisect_left(self._days, start.toordinal())
+
+    def check_ins_between(self, start: date, end: date) -> List[datetime]:
+        """Check-ins in [start, end]."""
+        lo = bisect_left(self._stamps, start.toordinal() * 86400)
+        hi = bisect_left(self._stamps, (end.toordinal() + 1) * 86400)
+        return self._times[lo:hi]
+
+    def calendar(self, start: date, end: date) -> List[Dict[str, Any]]:
+        """One entry per day in [start, end] with whether and when the member trained."""
+        times_by_day: Dict[int, List[str]] = {}
+        for t in self.check_ins_between(start, end):
+            times_by_day.setdefault(t.toordinal(), []).append(t.strftime('%I:%M %p'))
+
+        days = []
+        for ordinal in range(start.toordinal(), end.toordinal() + 1):
+            current = date.fromordinal(ordinal)
+            times = times_by_day.get(ordinal, [])
+            days.append({
+                'date': current.strftime('%Y-%m-%d'),
+                'day_name': current.strftime('%A'),
+                'day': current.strftime('%d'),
+                'attended': bool(times),
+                'times': times
+            })
+        return days
+
+    def rolling_counts(self, as_of: Optional[date] = None) -> Dict[str, int]:
+        """Training days in the last 30 and 90 days (inclusive of as_of)."""
+        as_of = as_of or date.today()
+        return {
+            "last_30_days": self.days_between(as_of - timedelta(days=29), as_of),
+            "last_90_days": self.days_between(as_of - timedelta(days=89), as_of),
+        }
+
+    def weekday_frequency(self) -> Dict[str, int]:
+        """Training days per weekday."""
+        if np is not None and len(self._days):
+            counts = np.bincount((np.frombuffer(self._days, dtype=np.int32) - 1) % 7, minlength=7).tolist()
+        else:
+            counts = [0] * 7
+            for ordinal in self._days:
+                counts[(ordinal - 1) % 7] += 1  # ordinal 1 (0001-01-01) is a Monday
+        return dict(zip(WEEKDAY_NAMES, counts))
+
+    def streaks(self, as_of: Optional[date] = None) -> Dict[str, int]:
+        """
+        Current and longest streaks of consecutive training days and of
+        consecutive weeks with at least one session.
+        A current streak stays alive until a full day (or week) is missed.
+        """
+        as_of = (as_of or date.today()).toordinal()
+        days = self._days
+        if not days:
+            return {"current_days": 0, "longest_days": 0, "current_weeks": 0, "longest_weeks": 0}
+
+        def runs(values) -> List[tuple]:
+            """(first, last, length) of each run of consecutive integers."""
+            result = []
+            first = prev = values[0]
+            for v in values[1:]:
+                if v != prev + 1:
+                    result.append((first, prev, prev - first + 1))
+                    first = v
+                prev = v
+            result.append((first, prev, prev - first + 1))
+            return result
+
+        day_runs = runs(days)
+        # Weeks counted from the Monday of day 1
+        weeks = sorted({(d - 1) // 7 for d in days})
+        week_runs = runs(weeks)
+        this_week = (as_of - 1) // 7
+
+        last_day_run = day_runs[-1]
+        last_week_run = week_runs[-1]
+        return {
+            "current_days": last_day_run[2] if last_day_run[1] >= as_of - 1 else 0,
+            "longest_days": max(r[2] for r in day_runs),
+            "current_weeks": last_week_run[2] if last_week_run[1] >= this_week - 1 else 0,
+            "longest_weeks": max(r[2] for r in week_runs),
+        }
+
+    def summary(self, as_of: Optional[date] = None) -> Dict[str, Any]:
+        """Headline numbers for a member."""
+        return {
+            "total_classes": len(self),
+            "total_days": self.total_days,
+            **self.rolling_counts(as_of),
+            "streaks": self.streaks(as_of),
+            "weekday_frequency": self.weekday_frequency(),
+            "last_check_in": self.last_check_in.strftime('%Y-%m-%d %H:%M:%S') if self.last_check_in else None,
+        }
+
+
+def week_range(offset: int = 0, today: Optional[date] = None):
+    """Monday and Sunday of the week offset from the current one."""
+    today = today or date.today()
+    start = today - timedelta(days=today.weekday()) + timedelta(weeks=offset)
+    return start, start + timedelta(days=6)
+
+
+def month_range(offset: int = 0, today: Optional[date] = None):
+    """First and last day of the month offset from the current one."""
+    today = today or date.today()
+    month_index = today.year * 12 + today.month - 1 + offset
+    start = date(month_index // 12, month_index % 12 + 1, 1)
+    next_index = month_index + 1
+    end = date(next_index // 12, next_index % 12 + 1, 1) - timedelta(days=1)
+    return start, end
+
+
+def year_range(offset: int = 0, today: Optional[date] = None):
+    """First and last day of the year offset from the current one."""
+    year = (today or date.today()).year + offset
+    return date(year, 1, 1), date(year, 12, 31)
+
+
+class AttendanceHistoryCache:
+    """Parsed histories per member, reused until the member's attendance changes."""
+
+    def __init__(self, max_members: int = MAX_CACHED_MEMBERS):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._max_members = max_members
+
+    def get(self, member: str, check_ins: Union[str, Iterable], version: Any = None) -> AttendanceHistory:
+        """
+        Get the parsed history for a member.
+        version identifies the raw data (e.g. the record's modified timestamp);
+        if omitted it is derived from the raw data itself. Raw data may be the
+        JSON string stored on the customer or an iterable of check-in times.
+        """
+        if isinstance(check_ins, str):
+            raw = check_ins
+            if version is None:
+                version = hash(raw)
+        else:
+            raw = list(check_ins)
+            if version is None:
+                version = (len(raw), str(raw[-1]) if raw else None)
+
+        with self._lock:
+            entry = self._entries.get(member)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(member)
+                return entry[1]
+
+        if isinstance(raw, str):
+            try:
+                raw = json.loads(raw or "[]") or []
+            except json.JSONDecodeError:
+                raw = []
+        history = AttendanceHistory(raw)
+
+        with self._lock:
+            self._entries[member] = (version, history)
+            self._entries.move_to_end(member)
+            while len(self._entries) > self._max_members:
+                self._entries.popitem(last=False)
+        return history
+
+    def invalidate(self, member: str) -> None:
+        """Drop a member's history (call after a check-in)."""
+        with self._lock:
+            self._entries.pop(member, None)
+
+
+# Singleton instance
+_history_cache = None
+
+
+def get_attendance_history_cache() -> AttendanceHistoryCache:
+    """Get the attendance history cache singleton."""
+    global _history_cache
+    if _history_cache is None:
+        _history_cache = AttendanceHistoryCache()
+    return _history_cache
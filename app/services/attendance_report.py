@@ -0,0 +1,292 @@
+# app/services/attendance_report.py
+"""
+Gym-wide attendance report: hour-of-week heatmap, class type counts and
+belt rank distribution over a date range.
+
+Gym Attendance rows for the range are pulled in one paginated pass and
+bucketed per day (vectorized when NumPy is available). Aggregates for closed
+days - anything before today - can no longer change, so they are stored on
+disk and a historical range is answered without touching ERPNext.
+"""
+import json
+import threading
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional
+
+from ..utils.config import get_config
+from ..utils.erp_paging import iter_doctype
+from .attendance_analytics import WEEKDAY_NAMES
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the pure-Python paths give the same results
+    np = None
+
+# Closed-day aggregates, keyed by ISO date
+REPORT_CACHE_FILE = Path(__file__).parent.parent.parent / "data" / "attendance_report_days.json"
+
+# Rows per page when fetching Gym Attendance
+REPORT_PAGE_SIZE = 1000
+
+# Longest range a single report may cover
+MAX_REPORT_DAYS = 366
+
+# Hour-of-week slots listed as peaks
+PEAK_SLOTS = 5
+
+ATTENDANCE_FIELDS = ["member", "attendance_date", "check_in_time", "class_type"]
+
+
+def _hour(check_in_time: Any) -> Optional[int]:
+    """Hour of a Time value such as '18:05:00' or '7:30:00.000000'."""
+    try:
+        hour = int(str(check_in_time).split(':', 1)[0])
+    except (TypeError, ValueError):
+        return None
+    return hour if 0 <= hour < 24 else None
+
+
+def _empty_day() -> Dict[str, Any]:
+    return {"total": 0, "hours": [0] * 24, "untimed": 0, "class_types": {}, "ranks": {}, "members": {}}
+
+
+def bucket_days(records: Iterable[Dict[str, Any]], member_ranks: Dict[str, str],
+                start: date, end: date) -> Dict[str, Dict[str, Any]]:
+    """
+    Aggregate attendance rows into one bucket per day in [start, end].
+    Each bucket holds check-ins per hour, per class type and per rank, plus
+    the members seen that day with their rank (for distinct counts later).
+    """
+    first = start.toordinal()
+    n_days = end.toordinal() - first + 1
+    day_index: List[int] = []
+    hours: List[int] = []
+    buckets = {date.fromordinal(first + i).isoformat(): _empty_day() for i in range(n_days)}
+
+    for record in records:
+        try:
+            ordinal = date.fromisoformat(str(record.get("attendance_date"))[:10]).toordinal()
+        except ValueError:
+            continue
+        if not 0 <= ordinal - first < n_days:
+            continue
+        bucket = buckets[date.fromordinal(ordinal).isoformat()]
+        bucket["total"] += 1
+
+        hour = _hour(record.get("check_in_time"))
+        if hour is None:
+            bucket["untimed"] += 1
+        else:
+            day_index.append(ordinal - first)
+            hours.append(hour)
+
+        class_type = record.get("class_type") or "Unspecified"
+        bucket["class_types"][class_type] = bucket["class_types"].get(class_type, 0) + 1
+
+        member = record.get("member")
+        rank = member_ranks.get(member) or "Unranked"
+        bucket["ranks"][rank] = bucket["ranks"].get(rank, 0) + 1
+        if member:
+            bucket["members"][member] = rank
+
+    # Hour histogram for every day at once: one slot per (day, hour)
+    if np is not None and hours:
+        slots = np.asarray(day_index, dtype=np.int64) * 24 + np.asarray(hours, dtype=np.int64)
+        grid = np.bincount(slots, minlength=n_days * 24).reshape(n_days, 24).tolist()
+    else:
+        grid = [[0] * 24 for _ in range(n_days)]
+        for d, h in zip(day_index, hours):
+            grid[d][h] += 1
+
+    for i, counts in enumerate(grid):
+        buckets[date.fromordinal(first + i).isoformat()]["hours"] = counts
+    return buckets
+
+
+def combine_days(days: Dict[str, Dict[str, Any]], start: date, end: date) -> Dict[str, Any]:
+    """Fold per-day buckets in [start, end] into the report."""
+    ordered = [date.fromordinal(o) for o in range(start.toordinal(), end.toordinal() + 1)]
+    weekdays = [d.weekday() for d in ordered]
+    day_hours = [days[d.isoformat()]["hours"] for d in ordered]
+
+    # Occurrences of each weekday in the range, for per-session averages
+    weekday_counts = Counter(weekdays)
+
+    if np is not None:
+        heatmap_arr = np.zeros((7, 24), dtype=np.int64)
+        np.add.at(heatmap_arr, np.asarray(weekdays, dtype=np.int64), np.asarray(day_hours, dtype=np.int64))
+        occurrences = np.asarray([weekday_counts.get(w, 0) for w in range(7)], dtype=np.float64)
+        average_arr = np.divide(heatmap_arr, occurrences[:, None],
+                                out=np.zeros((7, 24)), where=occurrences[:, None] > 0)
+        heatmap = heatmap_arr.tolist()
+        average = np.round(average_arr, 2).tolist()
+    else:
+        heatmap = [[0] * 24 for _ in range(7)]
+        for weekday, counts in zip(weekdays, day_hours):
+            row = heatmap[weekday]
+            for h, c in enumerate(counts):
+                row[h] += c
+        average = [
+            [round(c / weekday_counts[w], 2) if weekday_counts.get(w) else 0.0 for c in heatmap[w]]
+            for w in range(7)
+        ]
+
+    class_types: Counter = Counter()
+    rank_check_ins: Counter = Counter()
+    rank_members: Dict[str, set] = {}
+    daily = []
+    total = untimed = 0
+    for d in ordered:
+        bucket = days[d.isoformat()]
+        total += bucket["total"]
+        untimed += bucket["untimed"]
+        class_types.update(bucket["class_types"])
+        rank_check_ins.update(bucket["ranks"])
+        for member, rank in bucket["members"].items():
+            rank_members.setdefault(rank, set()).add(member)
+        daily.append({"date": d.isoformat(), "total": bucket["total"]})
+
+    slots = sorted(
+        ((average[w][h], w, h) for w in range(7) for h in range(24) if heatmap[w][h]),
+        reverse=True
+    )[:PEAK_SLOTS]
+
+    return {
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "total_check_ins": total,
+        "untimed_check_ins": untimed,
+        "distinct_members": len(set().union(*rank_members.values())) if rank_members else 0,
+        "weekdays": WEEKDAY_NAMES,
+        "heatmap": heatmap,
+        "average_heatmap": average,
+        "peak_hours": [
+            {"weekday": WEEKDAY_NAMES[w], "hour": h, "average": avg, "total": heatmap[w][h]}
+            for avg, w, h in slots
+        ],
+        "class_types": dict(class_types.most_common()),
+        "ranks": {
+            rank: {"check_ins": count, "members": len(rank_members.get(rank, ()))}
+            for rank, count in rank_check_ins.most_common()
+        },
+        "daily": daily,
+    }
+
+
+class AttendanceReport:
+    """Builds attendance reports, keeping closed-day aggregates on disk."""
+
+    def __init__(self, cache_file: Path = REPORT_CACHE_FILE):
+        self._cache_file = cache_file
+        self._lock = threading.Lock()
+        self._days: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def _connection(self):
+        """Get ERPNext URL and headers from configuration."""
+        config = get_config()
+        if not config.is_configured():
+            return None, None
+
+        erp_config = config.get_erpnext_config()
+        headers = {
+            'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+            'Content-Type': 'application/json'
+        }
+        return erp_config.get('url', '').rstrip('/'), headers
+
+    def _closed_days(self) -> Dict[str, Dict[str, Any]]:
+        """Closed-day aggregates (loaded from disk on first use)."""
+        if self._days is None:
+            self._days = {}
+            if self._cache_file.exists():
+                try:
+                    with open(self._cache_file, 'r') as f:
+                        self._days = json.load(f)
+                except (json.JSONDecodeError, IOError) as e:
+                    print(f"[Report] Error loading day cache: {e}")
+        return self._days
+
+    def _save(self) -> None:
+        """Write the closed-day aggregates atomically."""
+        self._cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._cache_file.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self._days, f)
+        tmp_path.replace(self._cache_file)
+
+    def _fetch_days(self, start: date, end: date) -> Dict[str, Dict[str, Any]]:
+        """Fetch and bucket every check-in in [start, end]."""
+        url, headers = self._connection()
+        if not url:
+            raise RuntimeError("ERPNext not configured")
+
+        member_ranks = {
+            m["name"]: m.get("current_rank")
+            for m in iter_doctype(url, headers, "Gym Member", fields=["current_rank"],
+                                  page_size=REPORT_PAGE_SIZE)
+        }
+        records = iter_doctype(
+            url, headers, "Gym Attendance",
+            filters=[["attendance_date", ">=", start.isoformat()], ["attendance_date", "<=", end.isoformat()]],
+            fields=ATTENDANCE_FIELDS,
+            page_size=REPORT_PAGE_SIZE
+        )
+        return bucket_days(records, member_ranks, start, end)
+
+    def build(self, start: date, end: date, today: Optional[date] = None) -> Dict[str, Any]:
+        """
+        Report for [start, end].
+        Only days not cached yet (and today, which is still open) are fetched,
+        in a single pass spanning the earliest to the latest of them.
+        """
+        today = today or date.today()
+        if end < start:
+            raise ValueError("end_date is before start_date")
+        if (end - start).days + 1 > MAX_REPORT_DAYS:
+            raise ValueError(f"Range is limited to {MAX_REPORT_DAYS} days")
+        # Days after today have no attendance yet
+        fetch_end = min(end, today)
+
+        with self._lock:
+            closed = self._closed_days()
+            missing = [
+                date.fromordinal(o) for o in range(start.toordinal(), fetch_end.toordinal() + 1)
+                if o >= today.toordinal() or date.fromordinal(o).isoformat() not in closed
+            ]
+
+        days = {}
+        if missing:
+            fetched = self._fetch_days(missing[0], missing[-1])
+            print(f"[Report] Fetched attendance for {missing[0]} to {missing[-1]}")
+            newly_closed = {
+                day: bucket for day, bucket in fetched.items()
+                if date.fromisoformat(day) < today and day not in closed
+            }
+            with self._lock:
+                if newly_closed:
+                    closed.update(newly_closed)
+                    self._save()
+            days.update(fetched)
+
+        with self._lock:
+            for o in range(start.toordinal(), end.toordinal() + 1):
+                day = date.fromordinal(o).isoformat()
+                days.setdefault(day, closed.get(day) or _empty_day())
+
+        report = combine_days(days, start, end)
+        report["cached_days"] = max(0, (fetch_end - start).days + 1 - len(missing))
+        return report
+
+
+# Singleton instance
+_attendance_report = None
+
+
+def get_attendance_report() -> AttendanceReport:
+    """Get the attendance report singleton."""
+    global _attendance_report
+    if _attendance_report is None:
+        _attendance_report = AttendanceReport()
+    return _attendance_report
@@ -1,69 +1,29 @@
-from datetime import datetime, timedelta
-import json
-from collections import Counter
-import calendar
+from .attendance_analytics import AttendanceHistory, get_attendance_history_cache, week_range, month_range, year_range
+
+# Calendar periods supported by get_customer_attendance
+PERIOD_RANGES = {
+    "week": week_range,
+    "month": month_range,
+    "year": year_range,
+}
 
 class AttendanceService:
     def __init__(self, erp_client):
         self.erp_client = erp_client
 
-    async def get_customer_attendance(self, customer_name: str, week_offset: int = 0) -> dict:
+    async def get_customer_attendance(self, customer_name: str, week_offset: int = 0, period: str = "week") -> dict:
+        """Attendance calendar for a week, month or year (offset from the current one) plus summary stats"""
         try:
             # Fetch customer data
             customer = self.erp_client.search_customer_by_name(customer_name)
             if not customer:
-                return self._create_empty_response(customer_name)
-
-            # Get attendance data and handle empty/None case
-            attendance_data = customer.get("custom_attendance", "[]")
-            if attendance_data is None:
-                attendance_data = "[]"
-
-            # Parse attendance dates
-            try:
-                dates = json.loads(attendance_data)
-                valid_dates = []
-                for date_str in dates:
-                    try:
-                        # Clean and parse date string
-                        cleaned_date = str(date_str).strip().replace('"', '')
-                        if 'T' in cleaned_date:
-                            dt = datetime.fromisoformat(cleaned_date.split('.')[0])
-                            valid_dates.append(dt)
-                    except (ValueError, TypeError) as e:
-                        print(f"Invalid date: {date_str} - {e}")
-                        continue
-            except json.JSONDecodeError:
-                valid_dates = []
+                return self._create_empty_response(customer_name, week_offset, period)
 
-            # Calculate week boundaries
-            today = datetime.now()
-            start_of_current_week = today - timedelta(days=today.weekday())
-            target_week_start = start_of_current_week + timedelta(weeks=week_offset)
-            target_week_end = target_week_start + timedelta(days=6)
-
-            # Filter dates for the target week
-            week_attendance = [
-                date for date in valid_dates
-                if target_week_start <= date <= target_week_end
-            ]
-
-            # Create week calendar
-            week_calendar = []
-            for i in range(7):
-                current_date = target_week_start + timedelta(days=i)
-                attended = any(d.date() == current_date.date() for d in week_attendance)
-                week_calendar.append({
-                    'date': current_date.strftime('%Y-%m-%d'),
-                    'day_name': current_date.strftime('%A'),
-                    'day': current_date.strftime('%d'),
-                    'attended': attended,
-                    'times': [
-                        d.strftime('%I:%M %p') 
-                        for d in week_attendance 
-                        if d.date() == current_date.date()
-                    ]
-                })
+            # Parsed once per member and reused until custom_attendance changes
+            history = get_attendance_history_cache().get(
+                customer.get("name") or customer_name,
+                customer.get("custom_attendance") or "[]"
+            )
 
             # Process image URL
             image_url = ""
@@ -71,61 +31,52 @@ class AttendanceService:
             if isinstance(raw_image, str) and raw_image:
                 image_url = raw_image.split('/')[-1]
 
-            return {
-                "customer": {
-                    "name": customer.get("customer_name", ""),
-                    "belt_rank": customer.get("custom_current_belt_rank", "Not assigned"),
-                    "image": image_url
-                },
-                "week_info": {
-                    "start_date": target_week_start.strftime('%Y-%m-%d'),
-                    "end_date": target_week_end.strftime('%Y-%m-%d'),
-                    "current_week": week_offset == 0,
-                    "week_number": target_week_start.isocalendar()[1]
-                },
-                "calendar": week_calendar,
-                "summary": {
-                    "total_classes": len(valid_dates),
-                    "classes_this_week": len(week_attendance)
-                }
-            }
+            return self._build_response({
+                "name": customer.get("customer_name", ""),
+                "belt_rank": customer.get("custom_current_belt_rank", "Not assigned"),
+                "image": image_url
+            }, history, week_offset, period)
 
         except Exception as e:
             print(f"Error processing attendance: {str(e)}")
-            return self._create_empty_response(customer_name)
+            return self._create_empty_response(customer_name, week_offset, period)
 
-    def _create_empty_response(self, customer_name: str) -> dict:
-        """Create an empty response structure when no data is available"""
-        today = datetime.now()
-        start_of_current_week = today - timedelta(days=today.weekday())
-        
-        # Create empty week calendar
-        week_calendar = []
-        for i in range(7):
-            current_date = start_of_current_week + timedelta(days=i)
-            week_calendar.append({
-                'date': current_date.strftime('%Y-%m-%d'),
-                'day_name': current_date.strftime('%A'),
-                'day': current_date.strftime('%d'),
-                'attended': False,
-                'times': []
-            })
+    def _build_response(self, customer_info: dict, history: AttendanceHistory, week_offset: int, period: str) -> dict:
+        """Calendar and summary for the requested period; same shape with or without data"""
+        if period not in PERIOD_RANGES:
+            period = "week"
+        period_start, period_end = PERIOD_RANGES[period](week_offset)
+        period_calendar = history.calendar(period_start, period_end)
+        classes_in_period = sum(len(day['times']) for day in period_calendar)
+
+        # classes_this_week is always a week count: the displayed week in the
+        # week view, the current week when a month or year is shown
+        if period == "week":
+            classes_this_week = classes_in_period
+        else:
+            classes_this_week = len(history.check_ins_between(*week_range()))
 
         return {
-            "customer": {
-                "name": customer_name,
-                "belt_rank": "Not assigned",
-                "image": ""
-            },
+            "customer": customer_info,
             "week_info": {
-                "start_date": start_of_current_week.strftime('%Y-%m-%d'),
-                "end_date": (start_of_current_week + timedelta(days=6)).strftime('%Y-%m-%d'),
-                "current_week": True,
-                "week_number": start_of_current_week.isocalendar()[1]
+                "start_date": period_start.strftime('%Y-%m-%d'),
+                "end_date": period_end.strftime('%Y-%m-%d'),
+                "current_week": week_offset == 0,
+                "week_number": period_start.isocalendar()[1],
+                "period": period
             },
-            "calendar": week_calendar,
+            "calendar": period_calendar,
             "summary": {
-                "total_classes": 0,
-                "classes_this_week": 0
+                **history.summary(),
+                "classes_in_period": classes_in_period,
+                "classes_this_week": classes_this_week
             }
-        }
\ No newline at end of file
+        }
+
+    def _create_empty_response(self, customer_name: str, week_offset: int = 0, period: str = "week") -> dict:
+        """Create an empty response structure when no data is available"""
+        return self._build_response({
+            "name": customer_name,
+            "belt_rank": "Not assigned",
+            "image": ""
+        }, AttendanceHistory([]), week_offset, period)
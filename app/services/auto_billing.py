@@ -3,12 +3,21 @@
 Auto-billing service for recurring membership invoices.
 Generates invoices for members with recurring memberships on their billing date.
 """
+import json
+import threading
+import time
 import requests
 from datetime import date, timedelta
 from typing import Dict, List, Tuple, Optional
 from dateutil.relativedelta import relativedelta
 
 from ..utils.config import get_config
+from .billing_ledger import get_billing_ledger
+
+# Attempts per member within a single billing run. Failed members are retried
+# after the rest of the run, at least RETRY_BACKOFF_SECONDS * attempt after their last failure
+MAX_INVOICE_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 2
 
 
 class AutoBillingService:
@@ -18,6 +27,8 @@ class AutoBillingService:
         self._url = None
         self._headers = None
         self._company = None
+        self._run_lock = threading.Lock()
+        self.ledger = get_billing_ledger()
 
     def _setup_connection(self) -> bool:
         """Setup ERPNext connection."""
@@ -104,9 +115,50 @@ class AutoBillingService:
             print(f"Error fetching membership type: {e}")
             return None
 
-    def create_sales_invoice(self, member: Dict, membership_type: Dict) -> Tuple[bool, str, Optional[str]]:
+    @staticmethod
+    def _billing_marker(member_id: str, billing_period: str) -> str:
+        """Idempotency marker stored in the invoice remarks."""
+        return f"Auto-billing {member_id} period {billing_period}"
+
+    def find_existing_invoice(self, member_id: str, billing_period: str) -> Tuple[bool, Optional[str]]:
+        """
+        Look up an invoice already created in ERPNext for this member and period.
+        Used when a previous attempt may have created the invoice without us seeing the reply.
+        Returns (checked, invoice_name); checked is False when ERPNext couldn't be asked,
+        in which case the member must not be billed.
+        """
+        if not self._url:
+            return False, None
+
+        try:
+            response = requests.get(
+                f"{self._url}/api/resource/Sales Invoice",
+                headers=self._headers,
+                params={
+                    "filters": json.dumps([
+                        ["remarks", "=", self._billing_marker(member_id, billing_period)],
+                        ["docstatus", "<", 2]
+                    ]),
+                    "fields": '["name"]',
+                    "limit_page_length": 1
+                },
+                timeout=10
+            )
+
+            if response.status_code != 200:
+                print(f"[Auto-Billing] Existing invoice lookup failed: HTTP {response.status_code}")
+                return False, None
+            invoices = response.json().get("data", [])
+            return True, invoices[0].get("name") if invoices else None
+        except Exception as e:
+            print(f"[Auto-Billing] Error looking up existing invoice: {e}")
+            return False, None
+
+    def create_sales_invoice(self, member: Dict, membership_type: Dict,
+                             billing_period: Optional[str] = None) -> Tuple[bool, str, Optional[str]]:
         """
         Create a Sales Invoice in ERPNext for a member.
+        When billing_period is given the invoice is tagged so it can be found again on retry.
         Returns (success, message, invoice_name).
         """
         if not self._url:
@@ -147,6 +199,9 @@ class AutoBillingService:
                 ]
             }
 
+            if billing_period:
+                invoice_data["remarks"] = self._billing_marker(member.get("name"), billing_period)
+
             # Create the invoice
             response = requests.post(
                 f"{self._url}/api/resource/Sales Invoice",
@@ -382,10 +437,20 @@ class AutoBillingService:
         """
         Run a complete billing cycle.
         - Find all members due for billing
-        - Generate invoices for each
+        - Generate invoices for each (skipping periods already in the ledger)
         - Update next billing dates
         Returns summary of results.
         """
+        if not self._run_lock.acquire(blocking=False):
+            return {"success": False, "error": "Billing cycle already running"}
+
+        try:
+            return self._run_billing_cycle()
+        finally:
+            self._run_lock.release()
+
+    def _run_billing_cycle(self) -> Dict:
+        """Billing cycle body, called with the run lock held."""
         if not self._setup_connection():
             return {"success": False, "error": "ERPNext not connected"}
 
@@ -393,10 +458,17 @@ class AutoBillingService:
             "success": True,
             "processed": 0,
             "invoices_created": 0,
+            "already_billed": 0,
             "errors": [],
             "details": []
         }
 
+        # Members left pending by an interrupted run may have an invoice we never recorded
+        interrupted = set(self.ledger.interrupted_members())
+        if interrupted:
+            print(f"[Auto-Billing] Resuming interrupted run ({len(interrupted)} members pending)")
+            results["resumed"] = len(interrupted)
+
         # Get members due for billing
         members = self.get_members_due_for_billing()
         results["processed"] = len(members)
@@ -405,54 +477,120 @@ class AutoBillingService:
             results["message"] = "No members due for billing"
             return results
 
-        for member in members:
-            member_name = member.get("full_name", member.get("name"))
-            membership_type_name = member.get("current_membership_type")
+        self.ledger.start_run([m.get("name") for m in members])
+        membership_types = {}
+
+        # A failed invoice is retried once the other members are done instead of stalling the run
+        queue = members
+        retry_at = {}
+        for attempt in range(MAX_INVOICE_ATTEMPTS):
+            failed = []
+            for member in queue:
+                member_id = member.get("name")
+                wait = retry_at.get(member_id, 0) - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                final = attempt == MAX_INVOICE_ATTEMPTS - 1
+                if self._bill_member(member, membership_types, attempt > 0 or member_id in interrupted, final, results):
+                    self.ledger.checkpoint_member(member_id)
+                else:
+                    failed.append(member)
+                    retry_at[member_id] = time.monotonic() + RETRY_BACKOFF_SECONDS * (attempt + 1)
+            queue = failed
+            if not queue:
+                break
 
-            if not membership_type_name:
-                results["errors"].append(f"{member_name}: No membership type assigned")
-                continue
-
-            # Get membership type details
-            membership_type = self.get_membership_type_details(membership_type_name)
-            if not membership_type:
-                results["errors"].append(f"{member_name}: Could not fetch membership type")
-                continue
-
-            # Skip non-recurring memberships
-            if not membership_type.get("is_recurring"):
-                # Just update the next billing date to null or far future
-                self.update_next_billing_date(member.get("name"), {"duration_months": 0, "duration_days": 0})
-                results["details"].append({
-                    "member": member_name,
-                    "status": "skipped",
-                    "reason": "Non-recurring membership"
-                })
-                continue
-
-            # Create invoice
-            success, message, invoice_name = self.create_sales_invoice(member, membership_type)
-
-            if success:
-                results["invoices_created"] += 1
-                # Update next billing date
-                self.update_next_billing_date(member.get("name"), membership_type)
-                results["details"].append({
-                    "member": member_name,
-                    "status": "success",
-                    "invoice": invoice_name
-                })
-            else:
-                results["errors"].append(f"{member_name}: {message}")
-                results["details"].append({
-                    "member": member_name,
-                    "status": "error",
-                    "error": message
-                })
+        self.ledger.finish_run()
 
         results["message"] = f"Created {results['invoices_created']} invoices for {results['processed']} members"
+        if results["already_billed"]:
+            results["message"] += f" ({results['already_billed']} already billed)"
         return results
 
+    def _bill_member(self, member: Dict, membership_types: Dict, check_existing: bool, final: bool,
+                     results: Dict) -> bool:
+        """
+        Bill a single member for their current billing period.
+        Returns False when creating the invoice failed and another attempt
+        should follow; on the final attempt the failure is recorded instead.
+        check_existing looks for an invoice an earlier attempt may have created.
+        """
+        member_id = member.get("name")
+        member_name = member.get("full_name", member_id)
+        membership_type_name = member.get("current_membership_type")
+        billing_period = member.get("next_billing_date")
+
+        if not membership_type_name:
+            results["errors"].append(f"{member_name}: No membership type assigned")
+            return True
+
+        # Get membership type details (once per type per run)
+        if membership_type_name not in membership_types:
+            membership_types[membership_type_name] = self.get_membership_type_details(membership_type_name)
+        membership_type = membership_types[membership_type_name]
+        if not membership_type:
+            results["errors"].append(f"{member_name}: Could not fetch membership type")
+            return True
+
+        # Skip non-recurring memberships
+        if not membership_type.get("is_recurring"):
+            # Just update the next billing date to null or far future
+            self.update_next_billing_date(member_id, {"duration_months": 0, "duration_days": 0})
+            results["details"].append({
+                "member": member_name,
+                "status": "skipped",
+                "reason": "Non-recurring membership"
+            })
+            return True
+
+        # Already invoiced for this period - only finish advancing the billing date
+        entry = self.ledger.get(member_id, billing_period)
+        if entry:
+            if not entry.get("next_billing_updated"):
+                if self.update_next_billing_date(member_id, membership_type):
+                    self.ledger.mark_billing_date_updated(member_id, billing_period)
+            results["already_billed"] += 1
+            results["details"].append({
+                "member": member_name,
+                "status": "already_billed",
+                "invoice": entry.get("invoice")
+            })
+            return True
+
+        # The ERPNext lookup guards against double-billing after a failed or interrupted attempt
+        checked, existing = self.find_existing_invoice(member_id, billing_period) if check_existing else (True, None)
+        if not checked:
+            # An earlier attempt may have created the invoice: never create another blind
+            success, message, invoice_name = False, "Could not check ERPNext for an existing invoice", None
+        elif existing:
+            success, message, invoice_name = True, f"Invoice {existing} already exists", existing
+        else:
+            success, message, invoice_name = self.create_sales_invoice(member, membership_type, billing_period)
+
+        if success:
+            self.ledger.record_invoice(member_id, billing_period, invoice_name, "draft" not in message)
+            results["invoices_created"] += 1
+            # Update next billing date
+            if self.update_next_billing_date(member_id, membership_type):
+                self.ledger.mark_billing_date_updated(member_id, billing_period)
+            results["details"].append({
+                "member": member_name,
+                "status": "success",
+                "invoice": invoice_name
+            })
+        elif not final:
+            return False
+        else:
+            # The invoice may exist anyway; the next run looks it up before billing again
+            self.ledger.mark_unverified(member_id)
+            results["errors"].append(f"{member_name}: {message}")
+            results["details"].append({
+                "member": member_name,
+                "status": "error",
+                "error": message
+            })
+        return True
+
     def preview_billing_cycle(self) -> Dict:
         """
         Preview what would be billed without actually creating invoices.
@@ -479,13 +617,14 @@ class AutoBillingService:
                 "membership": membership_type_name or "None",
                 "next_billing_date": member.get("next_billing_date"),
                 "amount": 0,
-                "is_recurring": False
+                "is_recurring": False,
+                "already_billed": self.ledger.get(member.get("name"), member.get("next_billing_date")) is not None
             }
 
             if membership_type:
                 member_info["amount"] = float(membership_type.get("price", 0))
                 member_info["is_recurring"] = membership_type.get("is_recurring", False)
-                if member_info["is_recurring"]:
+                if member_info["is_recurring"] and not member_info["already_billed"]:
                     preview["total_amount"] += member_info["amount"]
 
             preview["members"].append(member_info)
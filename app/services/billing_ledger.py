@@ -0,0 +1,213 @@
+# app/services/billing_ledger.py
+"""
+Local ledger of invoices created by the auto-billing engine.
+Entries are keyed by (member, billing period) so a crashed or repeated
+billing run never invoices the same member twice for the same period.
+
+Changes during a run are appended to a journal (one JSON line each) and
+replayed on load; the full ledger is only rewritten, and the journal
+cleared, when a run starts or finishes. A billing run therefore costs one
+small append per member instead of one full rewrite.
+"""
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+
+# Ledger file path - stored next to config.json under data/
+LEDGER_FILE = Path(__file__).parent.parent.parent / "data" / "billing_ledger.json"
+
+# Entries older than this are dropped when the ledger is saved
+RETENTION_DAYS = 400
+
+
+class BillingLedger:
+    """Billing ledger backed by a JSON file and a journal of the changes since it was written."""
+
+    def __init__(self, path: Path = LEDGER_FILE):
+        self._path = path
+        self._journal_path = path.with_suffix(".journal")
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._checkpoint: Dict[str, Any] = {}
+        self._load()
+
+    @staticmethod
+    def make_key(member_id: str, period: str) -> str:
+        """Build the ledger key for a member and billing period."""
+        return f"{member_id}|{period}"
+
+    def _load(self) -> None:
+        """Load the ledger from disk and replay the journal on top of it."""
+        if self._path.exists():
+            try:
+                with open(self._path, 'r') as f:
+                    data = json.load(f)
+                self._entries = data.get("entries", {})
+                self._checkpoint = data.get("checkpoint", {})
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"[Billing-Ledger] Error loading ledger: {e}")
+                self._entries = {}
+                self._checkpoint = {}
+
+        if not self._journal_path.exists():
+            return
+        torn = False
+        try:
+            with open(self._journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A line cut short by a crash mid-append
+                        torn = True
+        except IOError as e:
+            print(f"[Billing-Ledger] Error loading journal: {e}")
+        if torn:
+            # Compact now, or the next append would be glued onto the torn line
+            self._save()
+
+    def _apply(self, change: Dict[str, Any]) -> None:
+        """Apply one journal change. Replaying a change twice has no further effect."""
+        op = change.get("op")
+        if op == "invoice":
+            entry = change["entry"]
+            self._entries[self.make_key(entry["member"], entry["period"])] = entry
+        elif op == "billing_date_updated":
+            entry = self._entries.get(change["key"])
+            if entry:
+                entry["next_billing_updated"] = True
+        elif op == "member_done":
+            member_id = change["member"]
+            pending = self._checkpoint.get("pending", [])
+            if member_id in pending:
+                pending.remove(member_id)
+            done = self._checkpoint.setdefault("done", [])
+            if member_id not in done:
+                done.append(member_id)
+        elif op == "unverified":
+            unverified = self._checkpoint.setdefault("unverified", [])
+            if change["member"] not in unverified:
+                unverified.append(change["member"])
+
+    def _append(self, change: Dict[str, Any]) -> None:
+        """Apply a change and append it to the journal."""
+        self._apply(change)
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._journal_path, 'a') as f:
+                f.write(json.dumps(change) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except IOError as e:
+            print(f"[Billing-Ledger] Error appending to journal: {e}")
+
+    def _save(self) -> None:
+        """Write the ledger to disk atomically and clear the journal it now contains."""
+        cutoff = (date.today() - timedelta(days=RETENTION_DAYS)).isoformat()
+        self._entries = {
+            key: entry for key, entry in self._entries.items()
+            if (entry.get("period") or "") >= cutoff
+        }
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._path.with_suffix(".tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump({"entries": self._entries, "checkpoint": self._checkpoint}, f, indent=2)
+            tmp_path.replace(self._path)
+            self._journal_path.unlink(missing_ok=True)
+        except IOError as e:
+            print(f"[Billing-Ledger] Error saving ledger: {e}")
+
+    def get(self, member_id: str, period: str) -> Optional[Dict[str, Any]]:
+        """Get the ledger entry for a member and billing period."""
+        with self._lock:
+            entry = self._entries.get(self.make_key(member_id, period))
+            return dict(entry) if entry else None
+
+    def record_invoice(self, member_id: str, period: str, invoice_name: str, submitted: bool) -> None:
+        """Record an invoice created for a member and billing period."""
+        with self._lock:
+            self._append({"op": "invoice", "entry": {
+                "member": member_id,
+                "period": period,
+                "invoice": invoice_name,
+                "submitted": submitted,
+                "next_billing_updated": False,
+                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }})
+
+    def mark_billing_date_updated(self, member_id: str, period: str) -> None:
+        """Mark that the member's next billing date was advanced past this period."""
+        with self._lock:
+            key = self.make_key(member_id, period)
+            if key in self._entries:
+                self._append({"op": "billing_date_updated", "key": key})
+
+    def entries(self, period_from: Optional[str] = None) -> List[Dict[str, Any]]:
+        """List ledger entries, optionally from a billing period onwards."""
+        with self._lock:
+            return [
+                dict(entry) for entry in self._entries.values()
+                if not period_from or (entry.get("period") or "") >= period_from
+            ]
+
+    def start_run(self, member_ids: List[str]) -> None:
+        """Checkpoint the start of a billing run."""
+        with self._lock:
+            self._checkpoint = {
+                "started_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "completed_at": None,
+                "pending": list(member_ids),
+                "done": []
+            }
+            self._save()
+
+    def checkpoint_member(self, member_id: str) -> None:
+        """Checkpoint a member as handled in the current billing run."""
+        with self._lock:
+            self._append({"op": "member_done", "member": member_id})
+
+    def mark_unverified(self, member_id: str) -> None:
+        """
+        Record that a member's billing ended without knowing whether ERPNext
+        created the invoice; the next run checks ERPNext before billing them.
+        """
+        with self._lock:
+            self._append({"op": "unverified", "member": member_id})
+
+    def finish_run(self) -> None:
+        """Checkpoint the end of a billing run."""
+        with self._lock:
+            self._checkpoint["completed_at"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self._save()
+
+    def get_checkpoint(self) -> Dict[str, Any]:
+        """Get the checkpoint of the last billing run."""
+        with self._lock:
+            return dict(self._checkpoint)
+
+    def interrupted_members(self) -> List[str]:
+        """
+        Members the last billing run left unsure about: pending when it never
+        finished, and any it marked unverified.
+        """
+        with self._lock:
+            members = list(self._checkpoint.get("unverified", []))
+            if self._checkpoint and not self._checkpoint.get("completed_at"):
+                members += [m for m in self._checkpoint.get("pending", []) if m not in members]
+            return members
+
+
+# Singleton instance
+_ledger = None
+
+
+def get_billing_ledger() -> BillingLedger:
+    """Get the billing ledger singleton."""
+    global _ledger
+    if _ledger is None:
+        _ledger = BillingLedger()
+    return _ledger
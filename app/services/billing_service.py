@@ -3,6 +3,7 @@ from typing import Dict, Any
 from datetime import datetime
 import json
 from ..utils.erp_client import ERPNextClient
+from ..utils.read_model import get_read_model
 
 # app/services/billing_service.py
 
@@ -38,22 +39,27 @@ class BillingService:
 
             print(f"Found customer: {customer.get('customer_name')}")
 
-            # Get transactions with doctype filter for Sales Invoices
-            api_endpoint = f"{self.erp_client.base_url}/api/method/frappe.client.get_list"
-            params = {
-                'doctype': 'Sales Invoice',
-                'fields': '["*"]',
-                'filters': json.dumps({
-                    'customer': customer["name"],
-                    'docstatus': 1  # Only submitted invoices
-                })
-            }
-            
-            response = self.erp_client.session.get(api_endpoint, params=params)
-            if response.status_code != 200:
-                raise Exception("Failed to fetch invoices")
+            # Get submitted Sales Invoices (from the local read model once it is synced)
+            invoices = get_read_model().get_list("Sales Invoice", [
+                ["customer", "=", customer["name"]],
+                ["docstatus", "=", 1]
+            ], order_by="posting_date desc")
+
+            if invoices is None:
+                api_endpoint = f"{self.erp_client.base_url}/api/method/frappe.client.get_list"
+                params = {
+                    'doctype': 'Sales Invoice',
+                    'filters': json.dumps({
+                        'customer': customer["name"],
+                        'docstatus': 1  # Only submitted invoices
+                    })
+                }
                 
-            invoices = response.json().get('message', [])
+                response = self.erp_client.get_projected(api_endpoint, params, "billing_invoices")
+                if response.status_code != 200:
+                    raise Exception("Failed to fetch invoices")
+                    
+                invoices = response.json().get('message', [])
             print(f"Found {len(invoices)} invoices")
             
             # Format customer info
@@ -1,15 +1,14 @@
 # app/routes/handover.py
 from fastapi import APIRouter, Request, HTTPException, Depends
-from fastapi.templating import Jinja2Templates
 from typing import Dict, Any, Optional
 from pydantic import BaseModel
 
 from ..services.handover_service import HandoverService
 from ..models.payment import PaymentHandoverRequest
 from ..utils.erp_client import ERPNextClient, get_erp_client
+from ..utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 class RFIDInput(BaseModel):
     rfid: str
@@ -1,83 +1,114 @@
 # app/services/handover_service.py
+import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
 import json
 
 from ..models.payment import PaymentStatus, PaymentHandoverRequest
 from ..utils.erp_client import ERPNextClient
+from ..utils.read_model import get_read_model
 
 class HandoverService:
     def __init__(self, erp_client: ERPNextClient):
         self.erp_client = erp_client
         
-    async def get_pending_handovers(self) -> List[Dict[str, Any]]:
-        """Get all payments received by coaches that haven't been handed over to treasurer"""
-        try:
-            print("Fetching pending payment handovers")
-            
-            # Get all Payment Entries that don't have a corresponding Payment Handover
-            # First, get all handovers
-            handovers_endpoint = f"{self.erp_client.base_url}/api/method/frappe.client.get_list"
-            handovers_params = {
+    def _handed_over_payments(self) -> List[str]:
+        """
+        Names of every payment with a submitted handover. Raises if ERPNext
+        can't answer: treating that as "no handovers" would list every
+        payment as pending and let it be handed over twice.
+        """
+        response = self.erp_client.session.get(
+            f"{self.erp_client.base_url}/api/method/frappe.client.get_list",
+            params={
                 'doctype': 'Payment Handover',
                 'fields': '["payment_entry"]',
                 'filters': json.dumps({
                     'docstatus': 1  # Only submitted handovers
-                })
-            }
-            
-            handovers_response = self.erp_client.session.get(handovers_endpoint, params=handovers_params)
-            processed_payments = []
-            
-            if handovers_response.status_code == 200:
-                handovers = handovers_response.json().get('message', [])
-                processed_payments = [h.get('payment_entry') for h in handovers if h.get('payment_entry')]
-            
-            # Now get payments that don't have a handover
-            api_endpoint = f"{self.erp_client.base_url}/api/method/frappe.client.get_list"
-            params = {
-                'doctype': 'Payment Entry',
-                'fields': '["*"]',
-                'filters': json.dumps({
-                    'payment_type': 'Receive',
-                    'docstatus': 1,  # Only submitted payments
-                    'name': ['not in', processed_payments] if processed_payments else None
                 }),
-                'order_by': 'creation desc'
+                'limit_page_length': 0  # All of them, not Frappe's default 20
             }
-            
-            response = self.erp_client.session.get(api_endpoint, params=params)
-            
-            if response.status_code != 200:
-                print(f"Error fetching pending handovers: {response.text}")
-                return []
-                    
-            payments = response.json().get('message', [])
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"Could not load payment handovers (HTTP {response.status_code})")
+        handovers = response.json().get('message', [])
+        return [h.get('payment_entry') for h in handovers if h.get('payment_entry')]
+
+    async def get_pending_handovers(self) -> List[Dict[str, Any]]:
+        """
+        Get all payments received by coaches that haven't been handed over to treasurer.
+        Raises if the existing handovers can't be loaded.
+        """
+        print("Fetching pending payment handovers")
+
+        # Get all Payment Entries that don't have a corresponding Payment Handover
+        # First, get all handovers
+        processed_payments = await asyncio.to_thread(self._handed_over_payments)
+
+        try:
+            # Now get payments that don't have a handover (from the local read model,
+            # whose payments carry their references, once it is synced)
+            payments = get_read_model().get_list("Payment Entry", [
+                ["payment_type", "=", "Receive"],
+                ["docstatus", "=", 1],
+                ["name", "not in", processed_payments]
+            ], order_by="creation desc")
+            payments_mirrored = payments is not None
+
+            if payments is None:
+                api_endpoint = f"{self.erp_client.base_url}/api/method/frappe.client.get_list"
+                params = {
+                    'doctype': 'Payment Entry',
+                    'filters': json.dumps({
+                        'payment_type': 'Receive',
+                        'docstatus': 1  # Only submitted payments
+                    }),
+                    'order_by': 'creation desc',
+                    'limit_page_length': 0
+                }
+                
+                response = self.erp_client.get_projected(api_endpoint, params, "handover_payments")
+                
+                if response.status_code != 200:
+                    print(f"Error fetching pending handovers: {response.text}")
+                    return []
+                        
+                # Handed-over payments are dropped here rather than in the query,
+                # whose URL would grow with every handover ever made
+                handed_over = set(processed_payments)
+                payments = [p for p in response.json().get('message', []) if p.get('name') not in handed_over]
             
             # Format payments for display
             formatted_payments = []
+            staff_names = {}
             for payment in payments:
                 try:
-                    # Get coach/staff details
+                    # Get coach/staff details (once per staff member)
                     staff_user_id = payment.get('authorized_by_staff', payment.get('owner'))
                     staff_name = "Unknown"
                     
                     if staff_user_id:
-                        user_response = self.erp_client.session.get(
-                            f"{self.erp_client.base_url}/api/resource/User/{staff_user_id}"
-                        )
-                        if user_response.status_code == 200:
-                            user_data = user_response.json().get('data', {})
-                            staff_name = user_data.get('full_name')
+                        if staff_user_id not in staff_names:
+                            staff_names[staff_user_id] = "Unknown"
+                            user_response = self.erp_client.session.get(
+                                f"{self.erp_client.base_url}/api/resource/User/{staff_user_id}"
+                            )
+                            if user_response.status_code == 200:
+                                user_data = user_response.json().get('data', {})
+                                staff_names[staff_user_id] = user_data.get('full_name')
+                        staff_name = staff_names[staff_user_id]
                     
                     # Get invoice references
                     invoice_refs = []
-                    detailed_response = self.erp_client.session.get(
-                        f"{self.erp_client.base_url}/api/resource/Payment Entry/{payment.get('name')}"
-                    )
+                    payment_detail = payment if payments_mirrored else None
+                    if payment_detail is None:
+                        detailed_response = self.erp_client.session.get(
+                            f"{self.erp_client.base_url}/api/resource/Payment Entry/{payment.get('name')}"
+                        )
+                        if detailed_response.status_code == 200:
+                            payment_detail = detailed_response.json().get('data', {})
                     
-                    if detailed_response.status_code == 200:
-                        payment_detail = detailed_response.json().get('data', {})
+                    if payment_detail is not None:
                         for ref in payment_detail.get('references', []):
                             if ref.get('reference_doctype') == 'Sales Invoice':
                                 invoice_refs.append(ref.get('reference_name'))
@@ -115,7 +146,7 @@ class HandoverService:
             print(f"Processing handover for payment: {handover_request.payment_id}")
             
             # Verify treasurer/head coach RFID first
-            treasurer = self.erp_client.verify_staff_rfid(handover_request.treasurer_rfid)
+            treasurer = await asyncio.to_thread(self.erp_client.verify_staff_rfid, handover_request.treasurer_rfid)
             if not treasurer.get("verified"):
                 return {
                     "success": False,
@@ -236,13 +267,12 @@ class HandoverService:
             handovers_endpoint = f"{self.erp_client.base_url}/api/method/frappe.client.get_list"
             handovers_params = {
                 'doctype': 'Payment Handover',
-                'fields': '["*"]',
                 'filters': json.dumps({
                     'docstatus': 1  # Only submitted handovers
                 })
             }
             
-            handovers_response = self.erp_client.session.get(handovers_endpoint, params=handovers_params)
+            handovers_response = self.erp_client.get_projected(handovers_endpoint, handovers_params, "payment_handovers")
             handovers_by_payment = {}
             payment_ids_with_handovers = []
             
@@ -261,7 +291,6 @@ class HandoverService:
             api_endpoint = f"{self.erp_client.base_url}/api/method/frappe.client.get_list"
             params = {
                 'doctype': 'Payment Entry',
-                'fields': '["*"]',
                 'filters': json.dumps({
                     'payment_type': 'Receive',
                     'docstatus': 1,  # Only submitted payments
@@ -270,7 +299,7 @@ class HandoverService:
                 'order_by': 'creation desc'
             }
             
-            response = self.erp_client.session.get(api_endpoint, params=params)
+            response = self.erp_client.get_projected(api_endpoint, params, "handover_payments")
             
             if response.status_code != 200:
                 print(f"Error fetching payment history: {response.status_code} - {response.text}")
@@ -286,13 +315,12 @@ class HandoverService:
                 # Get payments by ID without date filter
                 params = {
                     'doctype': 'Payment Entry',
-                    'fields': '["*"]',
                     'filters': json.dumps({
                         'name': ['in', payment_ids_with_handovers]
                     })
                 }
                 
-                response = self.erp_client.session.get(api_endpoint, params=params)
+                response = self.erp_client.get_projected(api_endpoint, params, "handover_payments")
                 
                 if response.status_code == 200:
                     payments = response.json().get('message', [])
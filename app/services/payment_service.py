@@ -1,8 +1,10 @@
 # app/services/payment_service.py
+import asyncio
 from datetime import datetime
 import json
 from typing import Dict, Any, Optional, List
 import uuid
+from ..utils.read_model import get_read_model
 from ..utils.session_store import session_store
 
 class PaymentService:
@@ -10,24 +12,28 @@ class PaymentService:
         self.erp_client = erp_client
 
     async def _get_payer_invoices(self, payer_name: str) -> List[Dict[str, Any]]:
+        """Get all unpaid invoices for a payer (runs off the event loop so fetches can overlap)"""
+        return await asyncio.to_thread(self._fetch_payer_invoices, payer_name)
+
+    def _fetch_payer_invoices(self, payer_name: str) -> List[Dict[str, Any]]:
         """Get all unpaid invoices for a payer"""
         try:
             print(f"\nGetting invoices for payer: {payer_name}")
             
-            # Use the client's API method to get invoices
+            # Use the client's API method to get invoices - one query with every field the selection screen needs
             api_endpoint = f"{self.erp_client.base_url}/api/method/frappe.client.get_list"
             params = {
                 'doctype': 'Sales Invoice',
-                'fields': '["*"]',
                 'filters': json.dumps({
                     'customer': payer_name,
                     'docstatus': 1,  # Only submitted invoices
                     'status': ['in', ['Unpaid', 'Overdue']],  # Get both unpaid and overdue invoices
                     'outstanding_amount': ['>', 0]  # Only invoices with remaining balance
-                })
+                }),
+                'limit_page_length': 0
             }
             
-            response = self.erp_client.session.get(api_endpoint, params=params)
+            response = self.erp_client.get_projected(api_endpoint, params, "invoice_selection")
             print(f"Invoice response status: {response.status_code}")
             
             if response.status_code == 200:
@@ -37,52 +43,35 @@ class PaymentService:
                 formatted_invoices = []
                 for invoice in invoices:
                     try:
-                        # Initialize the base invoice data
+                        # Create item description
+                        item_description = "Monthly Subscription"
+                        if invoice.get('subscription'):
+                            item_description += f" - {invoice.get('subscription')}"
+                        if invoice.get('from_date') and invoice.get('to_date'):
+                            item_description += f"\n({invoice.get('from_date')} to {invoice.get('to_date')})"
+
                         formatted_invoice = {
                             "type": "Sales Invoice",
                             "data": {
                                 "name": invoice.get("name"),
                                 "posting_date": invoice.get("posting_date"),
                                 "due_date": invoice.get("due_date"),
-                                "outstanding_amount": float(invoice.get("outstanding_amount", 0)),
-                                "grand_total": float(invoice.get("grand_total", 0)),
+                                "outstanding_amount": float(invoice.get("outstanding_amount") or 0),
+                                "grand_total": float(invoice.get("grand_total") or 0),
                                 "status": invoice.get("status", "Unknown"),
                                 "customer_name": invoice.get("customer_name"),
-                                "subscription": None,
-                                "from_date": None,
-                                "to_date": None,
-                                "items": []  # Initialize empty items list
+                                "subscription": invoice.get("subscription"),
+                                "from_date": invoice.get("from_date"),
+                                "to_date": invoice.get("to_date"),
+                                # Summary line; item rows load on demand via get_invoice_items
+                                "items": [{
+                                    "description": item_description,
+                                    "amount": float(invoice.get("grand_total") or 0)
+                                }]
                             }
                         }
-
-                        # Get detailed invoice information
-                        detail_response = self.erp_client.session.get(
-                            f"{self.erp_client.base_url}/api/resource/Sales Invoice/{invoice.get('name')}"
-                        )
-                        
-                        if detail_response.status_code == 200:
-                            invoice_detail = detail_response.json().get('data', {})
-                            
-                            # Update with subscription details if available
-                            formatted_invoice["data"]["subscription"] = invoice_detail.get("subscription")
-                            formatted_invoice["data"]["from_date"] = invoice_detail.get("from_date")
-                            formatted_invoice["data"]["to_date"] = invoice_detail.get("to_date")
-                            
-                            # Create item description
-                            item_description = "Monthly Subscription"
-                            if invoice_detail.get('subscription'):
-                                item_description += f" - {invoice_detail.get('subscription')}"
-                            if invoice_detail.get('from_date') and invoice_detail.get('to_date'):
-                                item_description += f"\n({invoice_detail.get('from_date')} to {invoice_detail.get('to_date')})"
-                            
-                            # Add item to items list
-                            formatted_invoice["data"]["items"].append({
-                                "description": item_description,
-                                "amount": float(invoice_detail.get("grand_total", 0))
-                            })
                         
                         formatted_invoices.append(formatted_invoice)
-                        print(f"Processed invoice {formatted_invoice['data']['name']}")
                         
                     except Exception as e:
                         print(f"Error processing invoice {invoice.get('name')}: {str(e)}")
@@ -97,33 +86,83 @@ class PaymentService:
             print(f"Error getting payer invoices: {str(e)}")
             return []
 
+    def get_invoice_items(self, invoice_names: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Get item rows for several invoices in one query, grouped by invoice"""
+        items_by_invoice = {name: [] for name in invoice_names}
+        if not invoice_names:
+            return items_by_invoice
+
+        try:
+            response = self.erp_client.session.get(
+                f"{self.erp_client.base_url}/api/method/frappe.client.get_list",
+                params={
+                    'doctype': 'Sales Invoice Item',
+                    'parent': 'Sales Invoice',
+                    'fields': json.dumps(["parent", "item_code", "item_name", "description", "qty", "rate", "amount"]),
+                    'filters': json.dumps([["parent", "in", invoice_names]]),
+                    'order_by': 'idx asc',
+                    'limit_page_length': 0
+                }
+            )
+
+            if response.status_code == 200:
+                for item in response.json().get('message', []):
+                    parent = item.pop("parent", None)
+                    if parent in items_by_invoice:
+                        items_by_invoice[parent].append(item)
+            else:
+                print(f"Error getting invoice items: {response.status_code}")
+
+        except Exception as e:
+            print(f"Error getting invoice items: {str(e)}")
+
+        return items_by_invoice
+
     async def process_initial_scan(self, rfid: str) -> Dict[str, Any]:
         """Process initial RFID scan and return customer/family info"""
         try:
             print(f"Processing RFID scan: {rfid}")
             # First try to find the customer by RFID
-            customer_result = self.erp_client.search_customer(rfid)
+            customer = await asyncio.to_thread(self.erp_client.get_customer_by_rfid, rfid)
             
-            if not customer_result or not customer_result.get("customer"):
+            if not customer:
                 print(f"No customer found with RFID: {rfid}")
                 raise ValueError(f"No customer found with RFID card: {rfid}")
             
-            customer = customer_result["customer"]
             print(f"Found customer: {customer.get('customer_name')}")
             
+            # Start fetching the customer's own invoices while the family group resolves;
+            # they are discarded if somebody else pays for this customer
+            own_invoices = asyncio.create_task(self._get_payer_invoices(customer["name"]))
+            
             # Check if customer is part of a family group
-            family_group = self.erp_client.get_family_group(customer["name"])
+            family_group = await asyncio.to_thread(self.erp_client.get_family_group, customer["name"])
             
             if family_group:
                 print(f"Customer is part of family group: {family_group.get('name')}")
-                # If customer is part of family, get primary payer's info
-                primary_payer = self.erp_client.search_customer_by_name(family_group["primary_payer"])
-                
-                if not primary_payer:
-                    raise ValueError(f"Could not find primary payer: {family_group['primary_payer']}")
+                payer_name = family_group["primary_payer"]
+                if payer_name in (customer["name"], customer.get("customer_name")):
+                    # Scanned customer is the primary payer - the prefetch is the answer
+                    primary_payer = customer
+                    invoices = await own_invoices
+                else:
+                    own_invoices.cancel()
+                    # Customer IDs normally equal the customer name, so fetch the payer's
+                    # invoices alongside the payer lookup instead of after it
+                    payer_invoices = asyncio.create_task(self._get_payer_invoices(payer_name))
+                    primary_payer = await asyncio.to_thread(self.erp_client.search_customer_by_name, payer_name)
+                    
+                    if not primary_payer:
+                        payer_invoices.cancel()
+                        raise ValueError(f"Could not find primary payer: {payer_name}")
+                    
+                    if primary_payer["name"] == payer_name:
+                        invoices = await payer_invoices
+                    else:
+                        payer_invoices.cancel()
+                        invoices = await self._get_payer_invoices(primary_payer["name"])
                 
                 print(f"Primary payer: {primary_payer.get('customer_name')}")
-                invoices = await self._get_payer_invoices(primary_payer["name"])
                 
                 session_id = str(uuid.uuid4())
                 session_data = {
@@ -148,7 +187,7 @@ class PaymentService:
             else:
                 print("Customer is individual (not part of family group)")
                 # Customer is not part of family, treat as individual
-                invoices = await self._get_payer_invoices(customer["name"])
+                invoices = await own_invoices
                 
                 session_id = str(uuid.uuid4())
                 session_data = {
@@ -180,6 +219,44 @@ class PaymentService:
         """End a payment session"""
         session_store.delete_session(session_id)
 
+    def _write_through(self, payment: Dict[str, Any], invoice_ids: List[str], party: str) -> None:
+        """Store a submitted payment, and re-read the invoices and members it changed, in the read model"""
+        read_model = get_read_model()
+        try:
+            read_model.upsert("Payment Entry", payment)
+
+            customers = {party}
+            if invoice_ids and read_model.is_ready("Sales Invoice"):
+                response = self.erp_client.session.get(
+                    f"{self.erp_client.base_url}/api/resource/Sales Invoice",
+                    params={
+                        "filters": json.dumps([["name", "in", invoice_ids]]),
+                        "fields": '["*"]',
+                        "limit_page_length": 0
+                    }
+                )
+                response.raise_for_status()
+                for invoice in response.json().get("data", []):
+                    read_model.upsert("Sales Invoice", invoice)
+                    customers.add(invoice.get("customer"))
+
+            # ERPNext may update the members' payment status on payment
+            if read_model.is_ready("Gym Member"):
+                response = self.erp_client.session.get(
+                    f"{self.erp_client.base_url}/api/resource/Gym Member",
+                    params={
+                        "filters": json.dumps([["customer", "in", sorted(filter(None, customers))]]),
+                        "fields": '["*"]',
+                        "limit_page_length": 0
+                    }
+                )
+                response.raise_for_status()
+                for member in response.json().get("data", []):
+                    read_model.upsert("Gym Member", member)
+        except Exception as e:
+            # The change sync delivers the same rows shortly
+            print(f"Read model write-through after payment failed: {str(e)}")
+
     async def process_payment(self, payment_request: Any) -> Dict[str, Any]:
         """Process payment for selected invoices"""
         try:
@@ -189,7 +266,7 @@ class PaymentService:
             if not hasattr(payment_request, 'staff_rfid'):
                 raise ValueError("Staff authorization required")
 
-            staff_result = self.erp_client.verify_staff_rfid(payment_request.staff_rfid)
+            staff_result = await asyncio.to_thread(self.erp_client.verify_staff_rfid, payment_request.staff_rfid)
             if not staff_result.get("verified"):
                 raise ValueError(staff_result.get("error", "Staff authorization failed"))
 
@@ -315,6 +392,15 @@ class PaymentService:
                 raise Exception(f"Failed to submit payment: {submit_response.text}")
 
             print(f"Successfully submitted payment: {payment_name}")
+
+            # So the next check-in doesn't see the paid invoices as outstanding
+            await asyncio.to_thread(
+                self._write_through,
+                submit_response.json().get("message") or {},
+                [ref["reference_name"] for ref in payment_data.get("references", [])],
+                payment_request.customer_name
+            )
+
             return {
                 "status": "success",
                 "payment_id": payment_name,
@@ -0,0 +1,257 @@
+# app/services/promotion_batch.py
+"""
+Batch belt promotions and stripes (e.g. after a belt ceremony).
+The members in the batch are refreshed in one query and every item is
+validated against the cached rank table. Rank History records are written
+with one insert_many call and member updates with one bulk_update call, so
+the cost of a ceremony no longer grows by four requests per member.
+"""
+import json
+from datetime import date
+from typing import Dict, Any, List, Optional, Tuple
+
+import requests
+
+from ..utils.rank_table import get_rank_table
+from ..utils.read_model import get_read_model
+from .rank_progress import get_rank_progress
+
+# Largest batch accepted in one request
+MAX_BATCH_SIZE = 100
+
+ACTIONS = ("promote", "stripe")
+
+
+def _validate(item: Dict[str, Any], progress: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Return an error for an item, or None if it can be applied."""
+    if not progress:
+        return "Member not found"
+
+    if item["action"] == "promote":
+        new_rank = get_rank_table().get(item.get("new_rank_id"))
+        if not new_rank or not new_rank.get("is_active", 1):
+            return "Unknown or inactive rank"
+        if new_rank["name"] == progress["current_rank"]:
+            return "Member already holds this rank"
+        return None
+
+    stripes = item.get("stripes", 1)
+    if not isinstance(stripes, int) or stripes < 1:
+        return "stripes must be a positive whole number"
+    max_stripes = (progress["rank"] or {}).get("stripes_available", 4)
+    if progress["current_stripes"] + stripes > max_stripes:
+        return f"Maximum stripes ({max_stripes}) would be exceeded"
+    return None
+
+
+def _existing_histories(url: str, headers: dict, docs: List[Dict[str, Any]]) -> set:
+    """
+    (member, to_rank, promotion_date) of the given Rank History records that
+    ERPNext already holds, e.g. written by an attempt whose reply was lost.
+    Raises if ERPNext can't be asked.
+    """
+    response = requests.get(
+        f"{url}/api/resource/Rank History",
+        headers=headers,
+        params={
+            "fields": json.dumps(["member", "to_rank", "promotion_date"]),
+            "filters": json.dumps([
+                ["member", "in", [doc["member"] for doc in docs]],
+                ["promotion_date", "in", sorted({doc["promotion_date"] for doc in docs})]
+            ]),
+            "limit_page_length": 0
+        },
+        timeout=10
+    )
+    response.raise_for_status()
+    return {(h["member"], h["to_rank"], h["promotion_date"]) for h in response.json().get("data", [])}
+
+
+def _insert_histories(url: str, headers: dict, docs: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Insert Rank History records with one insert_many call, falling back to
+    one insert per record if the batch is rejected or its reply is lost.
+    Histories ERPNext already holds (a coach retrying a batch that timed
+    out) are not inserted again.
+    Returns errors keyed by member.
+    """
+    if not docs:
+        return {}
+
+    def missing(docs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """The docs still to insert, or errors for all of them if that can't be told."""
+        try:
+            existing = _existing_histories(url, headers, docs)
+        except requests.RequestException as e:
+            print(f"[Promotion-Batch] Could not check existing rank history: {e}")
+            return [], {doc["member"]: "Could not check ERPNext for existing rank history" for doc in docs}
+        return [d for d in docs if (d["member"], d["to_rank"], d["promotion_date"]) not in existing], {}
+
+    docs, errors = missing(docs)
+    if not docs:
+        return errors
+
+    try:
+        response = requests.post(
+            f"{url}/api/method/frappe.client.insert_many",
+            headers=headers,
+            json={"docs": docs},
+            timeout=60
+        )
+        if response.status_code == 200:
+            return {}
+        print(f"[Promotion-Batch] insert_many rejected ({response.status_code}), inserting one by one")
+    except requests.RequestException as e:
+        # ERPNext may have committed the batch before the reply was lost
+        print(f"[Promotion-Batch] insert_many failed ({e}), inserting what is missing one by one")
+        docs, errors = missing(docs)
+
+    for doc in docs:
+        try:
+            single = requests.post(f"{url}/api/resource/Rank History", headers=headers, json=doc, timeout=10)
+            if single.status_code not in (200, 201):
+                errors[doc["member"]] = "Failed to create rank history"
+        except Exception as e:
+            errors[doc["member"]] = str(e)
+    return errors
+
+
+def _update_members(url: str, headers: dict, updates: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Update Gym Members with one bulk_update call, falling back to one PUT per
+    member if the call itself fails.
+    Returns errors keyed by member.
+    """
+    if not updates:
+        return {}
+    docs = [{"doctype": "Gym Member", "docname": member_id, **fields} for member_id, fields in updates.items()]
+    try:
+        response = requests.post(
+            f"{url}/api/method/frappe.client.bulk_update",
+            headers=headers,
+            json={"docs": json.dumps(docs)},
+            timeout=60
+        )
+        if response.status_code == 200:
+            failed = (response.json().get("message") or {}).get("failed_docs", [])
+            return {f.get("doc", {}).get("docname"): "Failed to update member" for f in failed}
+        print(f"[Promotion-Batch] bulk_update rejected ({response.status_code}), updating one by one")
+    except requests.RequestException as e:
+        # The fields are absolute values, so writing them again is harmless
+        print(f"[Promotion-Batch] bulk_update failed ({e}), updating one by one")
+
+    errors = {}
+    for member_id, fields in updates.items():
+        try:
+            single = requests.put(f"{url}/api/resource/Gym Member/{member_id}", headers=headers, json=fields, timeout=10)
+            if single.status_code not in (200, 201):
+                errors[member_id] = "Failed to update member"
+        except Exception as e:
+            errors[member_id] = str(e)
+    return errors
+
+
+def apply_batch(url: str, headers: dict, coach_id: str, items: List[Dict[str, Any]],
+                today: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Apply promotions and stripes authorized by one coach.
+    Each item is {"member_id", "action": "promote" | "stripe", "new_rank_id"
+    (promote), "stripes" (stripe, default 1), "notes"}. Returns one result per
+    item, in order; invalid items are reported without blocking the rest.
+    """
+    today = today or date.today()
+    engine = get_rank_progress()
+    ranks = get_rank_table()
+
+    member_ids = list(dict.fromkeys(item.get("member_id") for item in items if item.get("member_id")))
+    progress = engine.refresh_members(member_ids, today)
+
+    results: List[Dict[str, Any]] = []
+    accepted: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    seen = set()
+    for item in items:
+        member_id = item.get("member_id")
+        member = progress.get(member_id)
+        result = {
+            "member_id": member_id,
+            "full_name": member["full_name"] if member else None,
+            "action": item.get("action"),
+            "success": False
+        }
+        results.append(result)
+
+        if not member_id or item.get("action") not in ACTIONS:
+            result["error"] = "member_id and an action (promote or stripe) are required"
+        elif member_id in seen:
+            result["error"] = "Member appears more than once in the batch"
+        else:
+            result["error"] = _validate(item, member)
+        if result["error"]:
+            continue
+        del result["error"]
+        seen.add(member_id)
+        accepted.append((item, result))
+
+    # Rank History first; a member is only updated once their history exists
+    histories = [
+        {
+            "doctype": "Rank History",
+            "member": item["member_id"],
+            "from_rank": progress[item["member_id"]]["current_rank"],
+            "to_rank": item["new_rank_id"],
+            "promotion_date": today.isoformat(),
+            "days_in_previous_rank": progress[item["member_id"]]["days_at_current_rank"],
+            "promoted_by": coach_id,
+            "promoter_rfid_verified": 1,
+            "notes": item.get("notes", "")
+        }
+        for item, _ in accepted if item["action"] == "promote"
+    ]
+    errors = _insert_histories(url, headers, histories)
+
+    updates = {}
+    for item, result in accepted:
+        member_id = item["member_id"]
+        if member_id in errors:
+            continue
+        if item["action"] == "promote":
+            updates[member_id] = {
+                "current_rank": item["new_rank_id"],
+                "current_stripes": 0,
+                "days_at_current_rank": 0,
+                "last_promotion_date": today.isoformat(),
+                "eligible_for_promotion": 0
+            }
+        else:
+            updates[member_id] = {"current_stripes": progress[member_id]["current_stripes"] + item.get("stripes", 1)}
+    errors.update(_update_members(url, headers, updates))
+
+    # bulk_update returns no documents, so the mirror is patched with the fields written
+    read_model = get_read_model()
+    for member_id, fields in updates.items():
+        if member_id not in errors:
+            read_model.update("Gym Member", member_id, fields)
+
+    for item, result in accepted:
+        member_id = item["member_id"]
+        if member_id in errors:
+            result["error"] = errors[member_id]
+            continue
+        result["success"] = True
+        if item["action"] == "promote":
+            engine.record_promotion(member_id, item["new_rank_id"], today)
+            new_rank = ranks.get(item["new_rank_id"]) or {}
+            result["new_rank"] = {
+                "name": new_rank.get("rank_name", item["new_rank_id"]),
+                "color": new_rank.get("color", "#000000")
+            }
+            result["days_at_previous_rank"] = progress[member_id]["days_at_current_rank"]
+        else:
+            stripes = updates[member_id]["current_stripes"]
+            engine.record_stripe(member_id, stripes)
+            result["current_stripes"] = stripes
+            result["max_stripes"] = (progress[member_id]["rank"] or {}).get("stripes_available", 4)
+
+    done = sum(1 for r in results if r["success"])
+    print(f"[Promotion-Batch] {done}/{len(items)} applied by {coach_id}")
+    return results
@@ -0,0 +1,446 @@
+# app/services/rank_progress.py
+"""
+Rank progress per member, kept in memory.
+Each entry holds the member's rank counters plus the dates of their check-ins
+in the last 30 days. Check-ins, promotions and stripes update the entry as
+they happen, so the kiosk stats screen and the promotion page read progress
+without querying ERPNext. Members not seen yet are loaded on first read.
+Gym Member edits made in ERPNext (new members, rank and stripe changes)
+arrive through change sync. State is saved under data/ after each change,
+and a nightly sweep rebuilds every entry from ERPNext to correct drift.
+"""
+import json
+import math
+import threading
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import requests
+
+from ..utils.config import get_config
+from ..utils.erp_paging import iter_doctype
+from ..utils.rank_table import get_rank_table
+from ..utils.sync_engine import get_sync_engine
+
+RANK_PROGRESS_FILE = Path(__file__).parent.parent.parent / "data" / "rank_progress.json"
+
+# Days of check-ins kept per member (recent frequency and the kiosk's 30-day count)
+RECENT_WINDOW_DAYS = 30
+
+MEMBER_FIELDS = [
+    "name", "first_name", "last_name", "full_name", "photo", "rfid_tag", "member_type",
+    "status", "payment_status", "join_date", "current_rank", "current_stripes",
+    "days_at_current_rank", "total_training_days", "last_promotion_date", "eligible_for_promotion"
+]
+
+
+class RankProgress:
+    """Rank progress keyed by member, indexed by RFID tag."""
+
+    def __init__(self, state_file: Path = RANK_PROGRESS_FILE):
+        self._state_file = state_file
+        self._lock = threading.RLock()
+        self._members: Dict[str, Dict[str, Any]] = {}
+        self._by_rfid: Dict[str, str] = {}
+        self._loaded = False
+        self._swept_at: Optional[str] = None
+        # Bumped on every change; derived results are cached against it
+        self._version = 0
+        self._candidates: Optional[tuple] = None
+
+    def _connection(self):
+        """Get ERPNext URL and headers from configuration."""
+        config = get_config()
+        if not config.is_configured():
+            return None, None
+
+        erp_config = config.get_erpnext_config()
+        headers = {
+            'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+            'Content-Type': 'application/json'
+        }
+        return erp_config.get('url', '').rstrip('/'), headers
+
+    def _load(self) -> None:
+        """Load the last saved state (once per process)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self._state_file.exists():
+            return
+        try:
+            with open(self._state_file, 'r') as f:
+                state = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"[Rank-Progress] Error loading state: {e}")
+            return
+        self._swept_at = state.get("swept_at")
+        for entry in state.get("members", {}).values():
+            self._store(entry)
+
+    def _save(self) -> None:
+        """Write the state atomically."""
+        self._state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._state_file.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"swept_at": self._swept_at, "members": self._members}, f)
+        tmp_path.replace(self._state_file)
+
+    def _store(self, entry: Dict[str, Any]) -> None:
+        """Add or replace an entry and its RFID index."""
+        previous = self._members.get(entry["name"])
+        if previous and previous.get("rfid_tag") and previous.get("rfid_tag") != entry.get("rfid_tag"):
+            self._by_rfid.pop(previous["rfid_tag"], None)
+        self._members[entry["name"]] = entry
+        if entry.get("rfid_tag"):
+            self._by_rfid[entry["rfid_tag"]] = entry["name"]
+        self._version += 1
+
+    @staticmethod
+    def _entry(member: Dict[str, Any], recent: List[List[Any]]) -> Dict[str, Any]:
+        """Build an entry from a Gym Member record and its recent check-ins."""
+        entry = {field: member.get(field) for field in MEMBER_FIELDS}
+        entry["current_stripes"] = entry["current_stripes"] or 0
+        entry["days_at_current_rank"] = entry["days_at_current_rank"] or 0
+        entry["total_training_days"] = entry["total_training_days"] or 0
+        # [attendance_date, counts_towards_rank] sorted by date
+        entry["recent"] = sorted(recent)
+        return entry
+
+    def _fetch_recent(self, url: str, headers: dict, since: date,
+                      member_ids: Optional[List[str]] = None) -> Dict[str, List[List[Any]]]:
+        """Check-ins since a date, grouped by member."""
+        filters = [["attendance_date", ">=", since.isoformat()]]
+        if member_ids:
+            filters.append(["member", "in", member_ids])
+
+        recent: Dict[str, List[List[Any]]] = {}
+        for row in iter_doctype(url, headers, "Gym Attendance", filters=filters,
+                                fields=["member", "attendance_date", "counts_towards_rank"]):
+            recent.setdefault(row.get("member"), []).append(
+                [str(row.get("attendance_date"))[:10], 1 if row.get("counts_towards_rank") else 0]
+            )
+        return recent
+
+    def _load_member(self, field: str, value: str, today: date) -> Optional[Dict[str, Any]]:
+        """Load one member from ERPNext into the state (used on a cache miss)."""
+        url, headers = self._connection()
+        if not url:
+            return None
+
+        response = requests.get(
+            f"{url}/api/resource/Gym Member",
+            headers=headers,
+            params={
+                "filters": json.dumps([[field, "=", value]]),
+                "fields": json.dumps(MEMBER_FIELDS),
+                "limit_page_length": 1
+            },
+            timeout=10
+        )
+        response.raise_for_status()
+        members = response.json().get("data", [])
+        if not members:
+            return None
+
+        member = members[0]
+        since = today - timedelta(days=RECENT_WINDOW_DAYS - 1)
+        recent = self._fetch_recent(url, headers, since, member_ids=[member["name"]])
+        entry = self._entry(member, recent.get(member["name"], []))
+        with self._lock:
+            self._store(entry)
+            self._save()
+        return entry
+
+    def _view(self, entry: Dict[str, Any], today: date) -> Dict[str, Any]:
+        """Progress for an entry as of a day."""
+        ranks = get_rank_table()
+        rank = ranks.get(entry.get("current_rank"))
+        next_rank = ranks.next_rank(entry.get("current_rank"))
+
+        recent = entry.get("recent")
+        window_start = (today - timedelta(days=RECENT_WINDOW_DAYS - 1)).isoformat()
+        if recent is None:
+            last_30 = counted_30 = None
+        else:
+            in_window = recent[bisect_left(recent, [window_start, -1]):]
+            last_30 = len(in_window)
+            counted_30 = sum(counted for _, counted in in_window)
+
+        days_at_rank = entry.get("days_at_current_rank") or 0
+        days_required = (rank or {}).get("days_required") or 0
+        meets_days = days_required > 0 and days_at_rank >= days_required
+        days_to_next = max(0, days_required - days_at_rank) if days_required > 0 else None
+
+        # Projected promotion date at the member's 30-day training frequency
+        projected = None
+        if days_to_next == 0:
+            projected = today.isoformat()
+        elif days_to_next and counted_30:
+            per_day = counted_30 / RECENT_WINDOW_DAYS
+            projected = (today + timedelta(days=math.ceil(days_to_next / per_day))).isoformat()
+
+        return {
+            "member_id": entry["name"],
+            "full_name": entry.get("full_name") or f"{entry.get('first_name') or ''} {entry.get('last_name') or ''}".strip(),
+            "first_name": entry.get("first_name"),
+            "last_name": entry.get("last_name"),
+            "photo": entry.get("photo"),
+            "member_type": entry.get("member_type"),
+            "status": entry.get("status"),
+            "payment_status": entry.get("payment_status"),
+            "join_date": entry.get("join_date"),
+            "current_rank": entry.get("current_rank"),
+            "rank": {
+                "name": rank.get("rank_name"),
+                "color": rank.get("color"),
+                "order": rank.get("rank_order"),
+                "days_required": days_required,
+                "stripes_available": rank.get("stripes_available", 4)
+            } if rank else None,
+            "next_rank": {
+                "id": next_rank.get("name"),
+                "name": next_rank.get("rank_name"),
+                "color": next_rank.get("color")
+            } if next_rank else None,
+            "current_stripes": entry.get("current_stripes") or 0,
+            "days_at_current_rank": days_at_rank,
+            "total_training_days": entry.get("total_training_days") or 0,
+            "last_promotion_date": entry.get("last_promotion_date"),
+            "days_required": days_required,
+            "days_to_next_rank": days_to_next,
+            "eligible_for_promotion": meets_days,
+            "training_days_last_30": last_30,
+            "counted_days_last_30": counted_30,
+            "projected_promotion_date": projected,
+        }
+
+    def get(self, member_id: Optional[str] = None, rfid: Optional[str] = None,
+            today: Optional[date] = None) -> Optional[Dict[str, Any]]:
+        """
+        Progress for a member by id or RFID tag.
+        Served from memory; a member not seen yet is loaded from ERPNext.
+        """
+        today = today or date.today()
+        with self._lock:
+            self._load()
+            key = member_id or self._by_rfid.get(rfid)
+            entry = self._members.get(key) if key else None
+
+        if entry is None:
+            entry = self._load_member("name" if member_id else "rfid_tag", member_id or rfid, today)
+            if entry is None:
+                return None
+        return self._view(entry, today)
+
+    def refresh_members(self, member_ids: List[str], today: Optional[date] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Reload several members from ERPNext (one Gym Member and one Gym
+        Attendance query) and return their progress keyed by member id.
+        Members that don't exist are left out.
+        """
+        today = today or date.today()
+        url, headers = self._connection()
+        if not url or not member_ids:
+            return {}
+
+        members = list(iter_doctype(url, headers, "Gym Member", filters=[["name", "in", member_ids]],
+                                    fields=MEMBER_FIELDS))
+        since = today - timedelta(days=RECENT_WINDOW_DAYS - 1)
+        recent = self._fetch_recent(url, headers, since, member_ids=[m["name"] for m in members]) if members else {}
+
+        entries = [self._entry(m, recent.get(m["name"], [])) for m in members]
+        with self._lock:
+            self._load()
+            for entry in entries:
+                self._store(entry)
+            self._save()
+        return {entry["name"]: self._view(entry, today) for entry in entries}
+
+    def record_check_in(self, member: Dict[str, Any], day: date, counts_towards_rank: bool) -> Dict[str, Any]:
+        """
+        Apply a check-in. member is the Gym Member record read before the
+        check-in, so its counters are taken as current and incremented here.
+        Returns the member's progress after the check-in.
+        """
+        with self._lock:
+            self._load()
+            entry = self._members.get(member["name"])
+            merged = {**(entry or {}), **{k: v for k, v in member.items() if k in MEMBER_FIELDS}}
+            updated = self._entry(merged, entry["recent"] if entry else [])
+
+            if counts_towards_rank:
+                updated["days_at_current_rank"] += 1
+                updated["total_training_days"] += 1
+
+            if entry:
+                window_start = (day - timedelta(days=RECENT_WINDOW_DAYS - 1)).isoformat()
+                updated["recent"] = [r for r in updated["recent"] if r[0] >= window_start]
+                updated["recent"].append([day.isoformat(), 1 if counts_towards_rank else 0])
+            else:
+                # 30-day window unknown until the member is loaded or swept
+                updated["recent"] = None
+
+        progress = self._view(updated, day)
+        updated["eligible_for_promotion"] = 1 if progress["eligible_for_promotion"] else 0
+        if entry:
+            with self._lock:
+                self._store(updated)
+                self._save()
+        return progress
+
+    def record_promotion(self, member_id: str, rank_id: str, day: date) -> None:
+        """Apply a belt promotion: new rank, stripes and days at rank reset."""
+        self._update(member_id, {
+            "current_rank": rank_id,
+            "current_stripes": 0,
+            "days_at_current_rank": 0,
+            "last_promotion_date": day.isoformat(),
+            "eligible_for_promotion": 0
+        })
+
+    def record_stripe(self, member_id: str, stripes: int) -> None:
+        """Apply a stripe change."""
+        self._update(member_id, {"current_stripes": stripes})
+
+    def _update(self, member_id: str, changes: Dict[str, Any]) -> None:
+        """Apply field changes to a known member and persist them."""
+        with self._lock:
+            self._load()
+            entry = self._members.get(member_id)
+            if entry:
+                entry.update(changes)
+                self._version += 1
+                self._save()
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """
+        Change sync subscriber: apply Gym Member edits made in ERPNext.
+        Counters and rank are replaced, recent check-ins kept. Members not
+        seen yet are added once a sweep has loaded every member; before
+        that they are loaded on first read.
+        """
+        if event["kind"] != "changes" or event["initial"]:
+            return
+        with self._lock:
+            self._load()
+            for member in event["changed"]:
+                previous = self._members.get(member["name"])
+                if previous is None and self._swept_at is None:
+                    continue
+                entry = self._entry(member, [])
+                # A member new to the state has no check-ins loaded yet
+                entry["recent"] = previous["recent"] if previous else None
+                self._store(entry)
+            for name in event["deleted"]:
+                previous = self._members.pop(name, None)
+                if previous is None:
+                    continue
+                if self._by_rfid.get(previous.get("rfid_tag")) == name:
+                    del self._by_rfid[previous["rfid_tag"]]
+                self._version += 1
+            self._save()
+
+    def sweep(self, today: Optional[date] = None, correct_flags: bool = True) -> Dict[str, Any]:
+        """
+        Rebuild every entry from ERPNext (one paged pass over Gym Member and
+        one over the last 30 days of Gym Attendance), count entries whose
+        counters had drifted, and correct stale eligible_for_promotion flags.
+        """
+        today = today or date.today()
+        url, headers = self._connection()
+        if not url:
+            return {"success": False, "error": "ERPNext not configured"}
+
+        get_rank_table().refresh()
+        since = today - timedelta(days=RECENT_WINDOW_DAYS - 1)
+        members = list(iter_doctype(url, headers, "Gym Member", fields=MEMBER_FIELDS))
+        recent = self._fetch_recent(url, headers, since)
+
+        drifted = corrected = 0
+        entries = {}
+        for member in members:
+            entry = self._entry(member, recent.get(member["name"], []))
+            previous = self._members.get(member["name"])
+            if previous and (previous.get("days_at_current_rank"), previous.get("total_training_days")) != \
+                    (entry["days_at_current_rank"], entry["total_training_days"]):
+                drifted += 1
+
+            eligible = 1 if self._view(entry, today)["eligible_for_promotion"] else 0
+            if correct_flags and eligible != (1 if entry.get("eligible_for_promotion") else 0):
+                try:
+                    requests.put(
+                        f"{url}/api/resource/Gym Member/{member['name']}",
+                        headers=headers,
+                        json={"eligible_for_promotion": eligible},
+                        timeout=10
+                    ).raise_for_status()
+                    entry["eligible_for_promotion"] = eligible
+                    corrected += 1
+                except Exception as e:
+                    print(f"[Rank-Progress] Could not correct {member['name']}: {e}")
+            entries[member["name"]] = entry
+
+        with self._lock:
+            self._loaded = True
+            self._members = {}
+            self._by_rfid = {}
+            for entry in entries.values():
+                self._store(entry)
+            self._swept_at = datetime.now().isoformat()
+            self._save()
+
+        print(f"[Rank-Progress] Swept {len(entries)} members ({drifted} drifted, {corrected} flags corrected)")
+        return {"success": True, "members": len(entries), "drifted": drifted, "flags_corrected": corrected}
+
+    def candidates(self, today: Optional[date] = None) -> List[Dict[str, Any]]:
+        """
+        Progress of every active member, with promotion eligibility and
+        percent of the days required for the next rank.
+        Computed in one pass over the state and cached until a check-in,
+        promotion, stripe or rank table reload changes it.
+        """
+        today = today or date.today()
+        with self._lock:
+            self._load()
+            never_swept = self._swept_at is None
+        if never_swept:
+            # All members are needed at once; load them in bulk rather than one by one
+            self.sweep(today, correct_flags=False)
+
+        key = (self._version, get_rank_table().version, today)
+        cached = self._candidates
+        if cached and cached[0] == key:
+            return cached[1]
+
+        with self._lock:
+            entries = [e for e in self._members.values() if e.get("status") == "Active"]
+
+        result = []
+        for entry in entries:
+            view = self._view(entry, today)
+            days_required = view["days_required"]
+            view["percent_to_next_rank"] = (
+                round(min(100.0, view["days_at_current_rank"] * 100.0 / days_required), 1)
+                if days_required else None
+            )
+            view["is_eligible"] = view["eligible_for_promotion"] and view["payment_status"] == "Current"
+            result.append(view)
+
+        self._candidates = (key, result)
+        return result
+
+
+# Singleton instance
+_rank_progress = None
+
+
+def get_rank_progress() -> RankProgress:
+    """Get the rank progress singleton."""
+    global _rank_progress
+    if _rank_progress is None:
+        _rank_progress = RankProgress()
+        get_sync_engine().subscribe(["Gym Member"], _rank_progress.apply)
+    return _rank_progress
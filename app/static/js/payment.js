@@ -95,6 +95,13 @@ class PaymentManager {
             this.elements.proceedButton.addEventListener('click', () => this.handleProceedClick());
         }
 
+        document.querySelectorAll('.invoice-items-toggle').forEach(button => {
+            button.addEventListener('click', (e) => {
+                e.preventDefault();
+                this.toggleInvoiceItems(button);
+            });
+        });
+
         if (this.elements.staffRfidInput) {
             this.elements.staffRfidInput.addEventListener('input', (e) => {
                 if (e.target.value.length >= 8) {
@@ -150,6 +157,52 @@ class PaymentManager {
         console.log(`Visible invoices: ${visibleInvoices}`);
     }
 
+    async toggleInvoiceItems(button) {
+        const invoice = button.dataset.invoice;
+        const container = document.getElementById(`items-${invoice}`);
+        if (!container) return;
+
+        if (!container.classList.contains('hidden')) {
+            container.classList.add('hidden');
+            button.textContent = 'Show items';
+            return;
+        }
+
+        // Item rows are only fetched the first time an invoice is expanded
+        if (!container.dataset.loaded) {
+            button.textContent = 'Loading...';
+            try {
+                const sessionId = this.elements.sessionId ? this.elements.sessionId.value : '';
+                const response = await fetch(`/api/v1/payment/process/${sessionId}/items?invoices=${encodeURIComponent(invoice)}`);
+                const data = await response.json();
+                const items = (data.items && data.items[invoice]) || [];
+
+                container.innerHTML = '';
+                items.forEach(item => {
+                    const row = document.createElement('div');
+                    row.className = 'flex justify-between items-center py-1';
+                    const label = document.createElement('span');
+                    label.textContent = `${item.qty} x ${item.item_name || item.item_code}`;
+                    const amount = document.createElement('span');
+                    amount.textContent = `SRD ${parseFloat(item.amount || 0).toFixed(2)}`;
+                    row.append(label, amount);
+                    container.appendChild(row);
+                });
+                if (items.length === 0) {
+                    container.textContent = 'No item details available';
+                }
+                container.dataset.loaded = 'true';
+            } catch (error) {
+                console.error('Error loading invoice items:', error);
+                button.textContent = 'Show items';
+                return;
+            }
+        }
+
+        container.classList.remove('hidden');
+        button.textContent = 'Hide items';
+    }
+
     updateTotal() {
         let total = 0;
         this.selectedInvoices.clear();
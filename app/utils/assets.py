@@ -0,0 +1,188 @@
+# app/utils/assets.py
+"""
+Fingerprinted static assets without a build step.
+Files under app/static are hashed when first requested (or at startup) and
+templates link them through asset_url(), which puts the content hash in the
+file name: css/index.css -> /static/css/index.3f2a9c1b04de.css. A
+fingerprinted URL never changes meaning, so it is served as immutable for a
+year; a changed file gets a new URL. Text assets are also kept precompressed
+(gzip, and Brotli when available) so they are never compressed per request.
+Files replaced at runtime, such as an uploaded logo, are re-hashed when
+their size or modification time changes.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from stat import S_ISREG
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip variants are always built
+    brotli = None
+
+STATIC_DIR = Path(__file__).parent.parent / "static"
+STATIC_URL = "/static"
+
+# Hex digits of the content hash put in file names
+FINGERPRINT_LENGTH = 12
+
+# Text assets kept precompressed in memory (larger files are served as-is)
+PRECOMPRESS_SUFFIXES = {".css", ".js", ".svg", ".json", ".txt", ".ico", ".map"}
+PRECOMPRESS_MAX_SIZE = 2 * 1024 * 1024
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# Un-fingerprinted URLs are revalidated on every use
+REVALIDATE_CACHE = "no-cache"
+
+_FINGERPRINT_RE = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<suffix>\.[^./]+)$" % FINGERPRINT_LENGTH)
+
+
+class AssetManifest:
+    """Content hashes and precompressed variants of the static files."""
+
+    def __init__(self, directory: Path = STATIC_DIR):
+        self._dir = directory
+        self._root = directory.resolve()
+        self._lock = threading.Lock()
+        # relative path -> {"stat": (size, mtime), "hash": str, "variants": {"br": bytes, "gzip": bytes}}
+        self._assets: Dict[str, Dict[str, Any]] = {}
+
+    def build(self) -> int:
+        """Hash (and precompress) every static file; returns the number of files."""
+        count = 0
+        for path in self._dir.rglob("*"):
+            if path.is_file():
+                self._entry(path.relative_to(self._dir).as_posix())
+                count += 1
+        print(f"[Assets] Fingerprinted {count} static files")
+        return count
+
+    def _path(self, rel_path: str) -> Optional[Path]:
+        """The file a relative path names, or None if it leaves the static directory."""
+        try:
+            path = (self._root / rel_path).resolve()
+        except (OSError, RuntimeError, ValueError):
+            return None
+        if path != self._root and self._root in path.parents:
+            return path
+        return None
+
+    def _entry(self, rel_path: str) -> Optional[Dict[str, Any]]:
+        """Current entry for a file, re-hashed if the file changed."""
+        path = self._path(rel_path)
+        if path is None:
+            return None
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        key = (stat.st_size, stat.st_mtime_ns)
+
+        entry = self._assets.get(rel_path)
+        if entry and entry["stat"] == key:
+            return entry
+
+        data = path.read_bytes()
+        variants = {}
+        if path.suffix.lower() in PRECOMPRESS_SUFFIXES and len(data) <= PRECOMPRESS_MAX_SIZE:
+            variants["gzip"] = gzip.compress(data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                variants["br"] = brotli.compress(data, quality=11)
+            # Keep only variants that are actually smaller
+            variants = {k: v for k, v in variants.items() if len(v) < len(data)}
+
+        entry = {
+            "stat": key,
+            "hash": hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH],
+            "variants": variants,
+        }
+        with self._lock:
+            self._assets[rel_path] = entry
+        return entry
+
+    def url(self, rel_path: str) -> str:
+        """Fingerprinted URL of a static file (plain URL if the file is missing)."""
+        rel_path = rel_path.lstrip("/")
+        entry = self._entry(rel_path)
+        if entry is None:
+            return f"{STATIC_URL}/{rel_path}"
+        stem, dot, suffix = rel_path.rpartition(".")
+        if not dot or "/" in suffix or not stem or stem.endswith("/"):
+            # No extension to put the hash in front of
+            return f"{STATIC_URL}/{rel_path}?v={entry['hash']}"
+        return f"{STATIC_URL}/{stem}.{entry['hash']}.{suffix}"
+
+    def resolve(self, rel_path: str) -> Tuple[str, Optional[Dict[str, Any]], bool]:
+        """
+        Map a requested path to (file path, entry, fingerprint is current).
+        A stale fingerprint still resolves to the current file, but is not
+        marked current so it isn't cached as immutable.
+        """
+        match = _FINGERPRINT_RE.match(rel_path)
+        if match:
+            original = match.group("stem") + match.group("suffix")
+            entry = self._entry(original)
+            if entry is not None:
+                return original, entry, entry["hash"] == match.group("hash")
+        return rel_path, self._entry(rel_path), False
+
+
+class StaticAssets(StaticFiles):
+    """StaticFiles that understands fingerprinted names and serves precompressed variants."""
+
+    def __init__(self, *args, manifest: "AssetManifest", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope) -> Response:
+        rel_path, entry, current = self.manifest.resolve(path.replace(os.sep, "/"))
+        cache_control = IMMUTABLE_CACHE if current else REVALIDATE_CACHE
+
+        if entry and entry["variants"] and scope["method"] in ("GET", "HEAD"):
+            headers = dict(scope.get("headers") or [])
+            accepted = headers.get(b"accept-encoding", b"").decode("latin-1").lower()
+            for encoding in ("br", "gzip"):
+                if encoding in entry["variants"] and encoding in accepted:
+                    etag = f'"{entry["hash"]}-{encoding}"'
+                    response_headers = {
+                        "Cache-Control": cache_control,
+                        "Content-Encoding": encoding,
+                        "Vary": "Accept-Encoding",
+                        "ETag": etag,
+                    }
+                    if etag in headers.get(b"if-none-match", b"").decode("latin-1"):
+                        return Response(status_code=304, headers=response_headers)
+                    media_type = mimetypes.guess_type(rel_path)[0] or "application/octet-stream"
+                    return Response(entry["variants"][encoding], media_type=media_type, headers=response_headers)
+
+        response = await super().get_response(rel_path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = cache_control
+        return response
+
+
+# Singleton instance
+_manifest = None
+
+
+def get_asset_manifest() -> AssetManifest:
+    """Get the asset manifest singleton."""
+    global _manifest
+    if _manifest is None:
+        _manifest = AssetManifest()
+    return _manifest
+
+
+def asset_url(path: str) -> str:
+    """Template helper: fingerprinted URL for a file under app/static."""
+    return get_asset_manifest().url(path)
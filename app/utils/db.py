@@ -0,0 +1,48 @@
+# app/utils/db.py
+"""
+SQLite connections for local state (the read model and change sync cursors).
+sqlite3 connections must not be shared between threads, so each thread gets
+its own, opened once and reused. Databases run in WAL mode: page reads
+never wait for the sync's writes, and a write only waits for another write.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+DB_FILE = Path(__file__).parent.parent.parent / "data" / "read_model.sqlite3"
+
+# Seconds a writer waits for another writer's lock before failing
+BUSY_TIMEOUT = 5
+
+_local = threading.local()
+
+
+def connect(path: Path = DB_FILE) -> sqlite3.Connection:
+    """This thread's connection to the database at path (autocommit, rows as sqlite3.Row)."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(path)
+    if conn is None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(path), timeout=BUSY_TIMEOUT, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Durable enough for a mirror that can always be rebuilt from ERPNext
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[path] = conn
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """Run a block of writes as one transaction, rolled back if the block raises."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
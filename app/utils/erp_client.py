@@ -1,9 +1,86 @@
 # app/utils/erp_client.py
 import requests
 import json
+import time
 from typing import Dict, Any, List
 
 from .config import get_config
+from .fast_json import parse_once
+from .erp_resilience import ResilientSession
+from .staff_directory import get_staff_directory
+from .sync_engine import get_sync_engine
+
+# Family groups change rarely; the detailed groups are cached and updated from
+# change sync events (or reloaded after this TTL while change sync isn't live)
+FAMILY_GROUP_CACHE_TTL = 120  # 2 minutes
+_family_group_cache = {"groups": None, "base_url": None, "loaded_at": 0.0}
+
+# Columns each view reads. List queries request only these instead of
+# fields ["*"], which pulls every column of the doctype over the wire.
+FIELD_PROJECTIONS = {
+    # Customer record used by payment, billing, attendance and overview screens
+    "customer": [
+        "name", "customer_name", "custom_customer_rfid", "custom_current_belt_rank",
+        "custom_attendance", "custom_registration_fee", "email_id", "mobile_no",
+        "primary_address", "image"
+    ],
+    # Unpaid invoices on the payment invoice selection screen
+    "invoice_selection": [
+        "name", "posting_date", "due_date", "outstanding_amount", "grand_total",
+        "status", "customer_name", "subscription", "from_date", "to_date"
+    ],
+    # Unpaid invoices returned by get_customer_transactions
+    "customer_transactions": [
+        "name", "customer", "customer_name", "posting_date", "due_date",
+        "grand_total", "outstanding_amount", "status"
+    ],
+    # Invoice history on the customer billing page
+    "billing_invoices": [
+        "name", "posting_date", "due_date", "grand_total", "outstanding_amount",
+        "status", "remarks"
+    ],
+    # Unpaid invoices on the overview page
+    "overview_invoices": ["name", "customer", "due_date", "grand_total", "outstanding_amount"],
+    # Recent payments on the overview page
+    "overview_payments": ["name", "party", "paid_amount", "posting_date", "reference_no", "creation"],
+    # Payments on the handover dashboard and payment history
+    "handover_payments": [
+        "name", "party", "paid_amount", "posting_date", "reference_no", "creation",
+        "owner", "authorized_by_staff"
+    ],
+    # Handover records matched against payments
+    "payment_handovers": [
+        "name", "payment_entry", "received_by", "received_at", "transferred_to",
+        "transferred_at", "handover_notes"
+    ],
+}
+
+# Views whose projection this ERPNext rejected (e.g. a custom field is missing
+# or not readable), with when; they use fields ["*"] until PROJECTION_RETRY_INTERVAL has passed
+_unprojected_views: Dict[str, float] = {}
+PROJECTION_RETRY_INTERVAL = 10 * 60
+
+# Error text Frappe returns when a requested column is unknown or not permitted.
+# Any other error (a timeout, a deadlock, a server bug) says nothing about the projection.
+PROJECTION_ERRORS = ("Unknown column", "not permitted in query", "Invalid field")
+
+
+def projection(view: str) -> str:
+    """Get the JSON fields parameter for a view"""
+    rejected_at = _unprojected_views.get(view)
+    if rejected_at is not None and time.monotonic() - rejected_at < PROJECTION_RETRY_INTERVAL:
+        return '["*"]'
+    return json.dumps(FIELD_PROJECTIONS[view])
+
+
+def _projection_rejected(response: requests.Response) -> bool:
+    """Whether an error response says a requested column is unknown or not permitted"""
+    if response.status_code not in (403, 417, 500):
+        return False
+    return any(marker in response.text for marker in PROJECTION_ERRORS)
+
+# Roles allowed to authorize payments with their RFID card
+STAFF_AUTHORIZED_ROLES = ["Accounts User", "System Manager", "Administrator"]
 
 class ERPNextClient:
     def __init__(self, base_url: str = "", api_key: str = "", api_secret: str = ""):
@@ -12,8 +89,11 @@ class ERPNextClient:
             'Authorization': f'token {api_key}:{api_secret}',
             'Content-Type': 'application/json'
         }
-        self.session = requests.Session()
+        # Timeouts, read retries and the circuit breaker are applied per request
+        self.session = ResilientSession()
         self.session.headers.update(self.headers)
+        # Replies are decoded once, with orjson when available
+        self.session.hooks['response'].append(parse_once)
 
     def get_file_url(self, file_path: str) -> tuple[str, dict]:
         """Convert ERPNext file path to full URL with authentication"""
@@ -31,6 +111,23 @@ class ERPNextClient:
         
         return url, self.headers
 
+    def get_projected(self, endpoint: str, params: Dict[str, Any], view: str) -> requests.Response:
+        """
+        GET a list endpoint requesting only the columns of a view.
+        If ERPNext rejects the projection (unknown or restricted column),
+        retry once with every column and use every column for that view
+        until PROJECTION_RETRY_INTERVAL has passed.
+        """
+        fields = projection(view)
+        response = self.session.get(endpoint, params={**params, 'fields': fields})
+        if fields != '["*"]' and _projection_rejected(response):
+            print(f"Projection '{view}' rejected ({response.status_code}), retrying with all fields")
+            fallback = self.session.get(endpoint, params={**params, 'fields': '["*"]'})
+            if fallback.status_code == 200:
+                _unprojected_views[view] = time.monotonic()
+            return fallback
+        return response
+
     def search_customer_by_name(self, customer_name: str) -> Dict[str, Any]:
         """Search for a customer by name with detailed debugging"""
         try:
@@ -38,14 +135,13 @@ class ERPNextClient:
             endpoint = f"{self.base_url}/api/resource/Customer"
             
             params = {
-                'fields': '["*"]',
                 'filters': json.dumps([["customer_name", "=", customer_name]])
             }
             
             print(f"URL: {endpoint}")
             print(f"Params: {params}")
             
-            response = self.session.get(endpoint, params=params)
+            response = self.get_projected(endpoint, params, "customer")
             print(f"Response status: {response.status_code}")
             print(f"Response content: {response.text}")
 
@@ -67,21 +163,54 @@ class ERPNextClient:
             print(f"Error in search_customer_by_name: {str(e)}")
             return {}
 
-    def search_customer(self, search_term: str) -> Dict[str, Any]:
-        """Search for a customer by RFID and get family info"""
+    def search_customers_by_name(self, customer_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Look up many customers by customer_name, 100 per request, keyed by customer_name"""
+        customers = {}
+        try:
+            for i in range(0, len(customer_names), 100):
+                response = self.get_projected(f"{self.base_url}/api/resource/Customer", {
+                    'filters': json.dumps([["customer_name", "in", customer_names[i:i + 100]]]),
+                    'limit_page_length': 0
+                }, "customer")
+                if response.status_code != 200:
+                    print(f"Error searching customers: {response.status_code}")
+                    continue
+                for customer in response.json().get('data', []):
+                    # First match wins, as with search_customer_by_name
+                    customers.setdefault(customer.get('customer_name'), customer)
+            return customers
+
+        except Exception as e:
+            print(f"Error in search_customers_by_name: {str(e)}")
+            return {}
+
+    def get_customer_by_rfid(self, rfid: str) -> Dict[str, Any]:
+        """Get the customer record for an RFID card (no family resolution)"""
         try:
-            print(f"\nDEBUG: Searching customer with term: {search_term}")
             endpoint = f"{self.base_url}/api/resource/Customer"
             
             # Search by custom_customer_rfid field
             params = {
-                'fields': '["*"]',
-                'filters': json.dumps([["custom_customer_rfid", "=", search_term]])
+                'filters': json.dumps([["custom_customer_rfid", "=", rfid]])
             }
             
-            response = self.session.get(endpoint, params=params)
-            if response.status_code == 200 and response.json().get("data"):
-                customer_data = response.json()["data"][0]
+            response = self.get_projected(endpoint, params, "customer")
+            if response.status_code == 200:
+                customers = response.json().get("data", [])
+                if customers:
+                    return customers[0]
+            return {}
+
+        except Exception as e:
+            print(f"Error in get_customer_by_rfid: {str(e)}")
+            return {}
+
+    def search_customer(self, search_term: str) -> Dict[str, Any]:
+        """Search for a customer by RFID and get family info"""
+        try:
+            print(f"\nDEBUG: Searching customer with term: {search_term}")
+            customer_data = self.get_customer_by_rfid(search_term)
+            if customer_data:
                 print("\nProcessed customer data:")
                 print(json.dumps(customer_data, indent=2))
                 
@@ -118,56 +247,61 @@ class ERPNextClient:
             print(f"Error in search: {str(e)}")
             return {}
 
+    def _get_family_groups(self) -> List[Dict[str, Any]]:
+        """Get all active family groups with their members (cached briefly)"""
+        cache = _family_group_cache
+        if (cache["groups"] is not None and cache["base_url"] == self.base_url
+                and (time.monotonic() - cache["loaded_at"] < FAMILY_GROUP_CACHE_TTL
+                     or get_sync_engine().is_live(["Family Group"]))):
+            return cache["groups"]
+
+        endpoint = f"{self.base_url}/api/resource/Family Group"
+
+        # Get all active family groups
+        response = self.session.get(endpoint, params={
+            'fields': '["name"]',
+            'filters': json.dumps([["status", "=", "Active"]]),
+            'limit_page_length': 0
+        })
+
+        if response.status_code != 200:
+            print(f"Error getting family groups: {response.status_code}")
+            print(f"Error response: {response.text}")
+            return None
+
+        groups = []
+        for group in response.json().get('data', []):
+            # Get detailed group data including family members
+            group_response = self.session.get(f"{endpoint}/{group['name']}")
+            if group_response.status_code == 200:
+                groups.append(group_response.json().get('data', {}))
+
+        print(f"\nLoaded {len(groups)} family groups")
+        cache.update({"groups": groups, "base_url": self.base_url, "loaded_at": time.monotonic()})
+        return groups
+
     def get_family_group(self, customer_name: str) -> Dict[str, Any]:
         """Get family group information for a customer"""
         try:
             print(f"\nGetting family group for customer: {customer_name}")
-            endpoint = f"{self.base_url}/api/resource/Family Group"
-            
-            # Get all active family groups
-            response = self.session.get(endpoint, params={
-                'fields': '["*"]',
-                'filters': json.dumps([["status", "=", "Active"]])
-            })
-            
-            print(f"Family groups response: {response.text}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                all_groups = data.get('data', [])
-                print(f"\nFound {len(all_groups)} family groups")
-                
-                for group in all_groups:
-                    print(f"\nChecking group: {json.dumps(group, indent=2)}")
-                    
-                    # Get detailed group data including family members
-                    group_response = self.session.get(f"{endpoint}/{group['name']}")
-                    if group_response.status_code == 200:
-                        group_data = group_response.json().get('data', {})
-                        print(f"Detailed group data: {json.dumps(group_data, indent=2)}")
-                        
-                        # Check if primary payer
-                        if group_data.get('primary_payer') == customer_name:
-                            print(f"Found as primary payer in: {group_data.get('name')}")
-                            return group_data
-                        
-                        # Check family members table
-                        family_members = group_data.get('family_members', [])
-                        print(f"Family members: {json.dumps(family_members, indent=2)}")
-                        
-                        for member in family_members:
-                            print(f"Checking member: {member.get('member_name')} against {customer_name}")
-                            if member.get('member_name') == customer_name:
-                                print(f"Found as family member in: {group_data.get('name')}")
-                                return group_data
-                    
-                print("No matching family group found")
-                return None
-                    
-            else:
-                print(f"Error getting family groups: {response.status_code}")
-                print(f"Error response: {response.text}")
+            all_groups = self._get_family_groups()
+            if all_groups is None:
                 return None
+
+            for group_data in all_groups:
+                # Check if primary payer
+                if group_data.get('primary_payer') == customer_name:
+                    print(f"Found as primary payer in: {group_data.get('name')}")
+                    return group_data
+
+                # Check family members table
+                for member in group_data.get('family_members', []):
+                    if member.get('member_name') == customer_name:
+                        print(f"Found as family member in: {group_data.get('name')}")
+                        return group_data
+
+            print("No matching family group found")
+            return None
                     
         except Exception as e:
             print(f"Error getting family group: {str(e)}")
@@ -181,80 +315,41 @@ class ERPNextClient:
         """Verify if RFID belongs to authorized staff member"""
         try:
             print(f"Verifying staff RFID: {rfid}")
-            
-            # Get user with roles included
-            user_endpoint = f"{self.base_url}/api/resource/User"
-            user_response = self.session.get(
-                user_endpoint,
-                params={
-                    'filters': json.dumps([
-                        ["custom_user_rfid", "=", rfid],
-                        ["enabled", "=", 1]
-                    ]),
-                    'fields': json.dumps([
-                        "name",  # This is the email/user ID
-                        "full_name",
-                        "custom_user_rfid", 
-                        "enabled",
-                        "user_type",
-                        "role_profile_name"
-                    ])
+
+            # Resolve user and roles from the cached staff directory
+            directory = get_staff_directory()
+            user = directory.find_user(rfid, roles=STAFF_AUTHORIZED_ROLES)
+
+            if not directory.is_loaded():
+                return {
+                    "verified": False,
+                    "error": "Failed to verify user"
                 }
-            )
-            
-            print(f"User response: {user_response.text}")
-            
-            if user_response.status_code == 200:
-                users = user_response.json().get("data", [])
-                
-                if users:
-                    user = users[0]
-                    user_id = user.get("name")  # This is their email/user ID
-                    
-                    # Get user document with roles
-                    detailed_user_endpoint = f"{self.base_url}/api/method/frappe.client.get"
-                    detailed_response = self.session.get(
-                        detailed_user_endpoint,
-                        params={
-                            'doctype': 'User',
-                            'name': user_id
-                        }
-                    )
-                    
-                    print(f"Detailed user response: {detailed_response.text}")
-                    
-                    if detailed_response.status_code == 200:
-                        user_data = detailed_response.json().get("message", {})
-                        roles = [r.get("role") for r in user_data.get("roles", [])]
-                        
-                        print(f"User roles: {roles}")
-                        
-                        # Check if user has required roles
-                        authorized_roles = ["Accounts User", "System Manager", "Administrator"]
-                        if any(role in roles for role in authorized_roles):
-                            return {
-                                "verified": True,
-                                "name": user.get("full_name"),
-                                "user_id": user_id,  # Return the user ID (email)
-                                "roles": roles
-                            }
-                        else:
-                            print(f"User doesn't have required roles. Required: {authorized_roles}, Has: {roles}")
-                            return {
-                                "verified": False,
-                                "error": "User does not have required roles"
-                            }
-                
+
+            if not user:
                 return {
                     "verified": False,
                     "error": "Invalid RFID"
                 }
-                    
+
+            roles = user.get("roles", [])
+            print(f"User roles: {roles}")
+
+            # Check if user has required roles
+            if any(role in roles for role in STAFF_AUTHORIZED_ROLES):
+                return {
+                    "verified": True,
+                    "name": user.get("name"),
+                    "user_id": user.get("user_id"),  # Return the user ID (email)
+                    "roles": roles
+                }
+
+            print(f"User doesn't have required roles. Required: {STAFF_AUTHORIZED_ROLES}, Has: {roles}")
             return {
                 "verified": False,
-                "error": "Failed to verify user"
+                "error": "User does not have required roles"
             }
-                
+
         except Exception as e:
             print(f"Error verifying staff: {str(e)}")
             import traceback
@@ -273,7 +368,6 @@ class ERPNextClient:
             api_endpoint = f"{self.base_url}/api/method/frappe.client.get_list"
             params = {
                 'doctype': 'Sales Invoice',
-                'fields': '["*"]',
                 'filters': json.dumps({
                     'customer': payer_name,
                     'docstatus': 1,  # Only submitted invoices
@@ -286,7 +380,7 @@ class ERPNextClient:
             print(f"API endpoint: {api_endpoint}")  # Debug logging
             print(f"Params: {params}")  # Debug logging
 
-            response = self.session.get(api_endpoint, params=params)
+            response = self.get_projected(api_endpoint, params, "customer_transactions")
             print(f"Invoice response status: {response.status_code}")
             print(f"Invoice response: {response.text}")
 
@@ -306,6 +400,35 @@ class ERPNextClient:
             print(f"Traceback: {traceback.format_exc()}")
             return []  # Return an empty list in case of an exception
 
+def _apply_family_group_changes(event: Dict[str, Any]) -> None:
+    """Change sync subscriber: refetch only the cached family groups that changed."""
+    cache = _family_group_cache
+    if event["kind"] == "reset":
+        cache["groups"] = None
+        return
+    if event["kind"] != "changes" or event["initial"] or cache["groups"] is None:
+        return
+
+    client = get_erp_client()
+    if cache["base_url"] != client.base_url:
+        return
+    changed = {r["name"]: r for r in event["changed"]}
+    groups = [g for g in cache["groups"] if g.get("name") not in changed and g.get("name") not in event["deleted"]]
+    for name, record in changed.items():
+        if record.get("status") != "Active":
+            continue
+        # List records carry no family members; the group document does
+        response = client.session.get(f"{client.base_url}/api/resource/Family Group/{name}")
+        if response.status_code != 200:
+            cache["groups"] = None  # reload them all on next use
+            return
+        groups.append(response.json().get("data", {}))
+    cache["groups"] = groups
+
+
+get_sync_engine().subscribe(["Family Group"], _apply_family_group_changes)
+
+
 def get_erp_client():
     """Get ERPNext client using configuration from setup."""
     config = get_config()
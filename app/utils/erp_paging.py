@@ -0,0 +1,87 @@
+# app/utils/erp_paging.py
+"""
+Paging through ERPNext list queries.
+Kept apart from the backup module so the caches, the sync engine and the
+search index can read whole doctypes without importing the backup code.
+"""
+import json
+import threading
+from typing import Dict, Any, Iterator, List, Optional
+
+import requests
+
+from .fast_json import loads
+
+# Records fetched per request
+PAGE_SIZE = 500
+
+# Parents per child table request, and records per request when fetching by name
+CHILD_CHUNK_SIZE = 100
+
+
+def iter_doctype(url: str, headers: dict, doctype: str, filters: Optional[list] = None,
+                 page_size: int = PAGE_SIZE, stop: Optional[threading.Event] = None,
+                 fields: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yield every record of a doctype, one page at a time.
+    Pages are keyed on name rather than offset, so records created during
+    paging cannot shift a page and cause rows to be skipped or repeated.
+    fields limits the columns fetched (name is always included).
+    """
+    columns = json.dumps(['name'] + [f for f in fields if f != 'name']) if fields else '["*"]'
+    last_name = None
+    while not (stop and stop.is_set()):
+        page_filters = list(filters or [])
+        if last_name is not None:
+            page_filters.append(["name", ">", last_name])
+
+        response = requests.get(
+            f"{url}/api/resource/{doctype}",
+            headers=headers,
+            params={
+                'fields': columns,
+                'filters': json.dumps(page_filters),
+                'order_by': 'name asc',
+                'limit_page_length': page_size
+            },
+            timeout=60
+        )
+        response.raise_for_status()
+        records = loads(response.content).get('data', [])
+
+        yield from records
+
+        if len(records) < page_size:
+            return
+        last_name = records[-1]['name']
+
+
+def attach_children(url: str, headers: dict, doctype: str, records: List[Dict[str, Any]],
+                    tables: Dict[str, str]) -> None:
+    """Fetch the child rows of records and store them under their table field (tables maps field -> child doctype)."""
+    for field, child_doctype in tables.items():
+        by_parent = {}
+        for record in records:
+            record[field] = []
+            by_parent[record["name"]] = record
+
+        names = list(by_parent)
+        for i in range(0, len(names), CHILD_CHUNK_SIZE):
+            response = requests.get(
+                f"{url}/api/method/frappe.client.get_list",
+                headers=headers,
+                params={
+                    "doctype": child_doctype,
+                    "parent": doctype,
+                    "filters": json.dumps([["parent", "in", names[i:i + CHILD_CHUNK_SIZE]]]),
+                    "fields": '["*"]',
+                    "order_by": "idx asc",
+                    "limit_page_length": 0
+                },
+                timeout=30
+            )
+            response.raise_for_status()
+            for row in loads(response.content).get("message", []):
+                parent = by_parent.get(row.get("parent"))
+                if parent is not None:
+                    parent[field].append(row)
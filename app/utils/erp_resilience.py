@@ -0,0 +1,342 @@
+# app/utils/erp_resilience.py
+"""
+Resilience layer for ERPNextClient.session.
+Every request gets a timeout from its endpoint class (resource reads,
+resource writes, whitelisted methods, files), adapted to the latency seen
+recently: p95 x TIMEOUT_FACTOR, kept inside the class budget. Idempotent
+reads are retried with jittered exponential backoff. A circuit breaker per
+ERPNext site opens after consecutive failures and then fails fast; while
+it is open, reads of reference data (STALE_SAFE_DOCTYPES) that succeeded
+before are answered from a small cache of recent responses instead of
+waiting on a hung ERPNext. Invoices, payments, members and attendance are
+never answered stale: a paid invoice must not show as outstanding.
+"""
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+import requests
+
+# Read timeout budget (min, max) in seconds per endpoint class
+TIMEOUT_BUDGETS = {
+    "read": (2.0, 15.0),     # GET /api/resource
+    "write": (5.0, 30.0),    # POST/PUT/DELETE /api/resource
+    "method": (5.0, 60.0),   # /api/method (bulk calls can be slow)
+    "file": (5.0, 30.0),     # /files, /private/files
+}
+CONNECT_TIMEOUT = 3.05
+
+# Adaptive timeout = p95 of recent latencies x this factor (within the budget)
+TIMEOUT_FACTOR = 4
+LATENCY_WINDOW = 100
+# Until this many samples exist, the class maximum is used
+MIN_LATENCY_SAMPLES = 10
+
+# Retries for idempotent reads
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.25
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Circuit breaker
+FAILURE_THRESHOLD = 5
+OPEN_SECONDS = 30
+
+# Recent successful GET responses served while the breaker is open
+STALE_CACHE_ENTRIES = 500
+STALE_CACHE_MAX_BODY = 512 * 1024
+STALE_HEADER = "X-ERPNext-Stale"
+
+# Doctypes whose cached reads are safe to show while ERPNext is down: they
+# change rarely and carry no balances or payment state
+STALE_SAFE_DOCTYPES = {
+    "Belt Rank", "Membership Type", "Customer", "Family Group", "User", "Gym Staff", "Has Role",
+    "Item", "Item Group", "Company", "Rank History", "DocType", "DocField", "Custom Field",
+}
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """ERPNext is failing; the request was not sent."""
+
+
+def endpoint_class(method: str, url: str) -> str:
+    """Classify a request for its timeout budget."""
+    if "/files/" in url:
+        return "file"
+    if "/api/method/" in url:
+        return "method"
+    if method.upper() in IDEMPOTENT_METHODS:
+        return "read"
+    return "write"
+
+
+class EndpointStats:
+    """Latency window and counters for one endpoint class."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.timeouts = 0
+
+    def record(self, seconds: float) -> None:
+        self._latencies.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def timeout(self) -> float:
+        low, high = TIMEOUT_BUDGETS[self.name]
+        p95 = self.percentile(0.95)
+        if p95 is None or len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return high
+        return max(low, min(high, p95 * TIMEOUT_FACTOR))
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "timeout_s": round(self.timeout(), 2),
+            "p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+        }
+
+
+class CircuitBreaker:
+    """Closed -> open after FAILURE_THRESHOLD failures -> half-open probe after OPEN_SECONDS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= OPEN_SECONDS:
+                self.state = "half-open"
+            if self.state == "half-open" and not self._probing:
+                # Let one request through to test ERPNext
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self) -> None:
+        """End a probe whose outcome says nothing about ERPNext's health (the next request probes again)."""
+        with self._lock:
+            self._probing = False
+
+    def success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                print("[ERP-Breaker] ERPNext recovered, circuit closed")
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half-open" or (self.state == "closed" and self.failures >= FAILURE_THRESHOLD):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                print(f"[ERP-Breaker] Circuit open after {self.failures} failures, failing fast for {OPEN_SECONDS}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = OPEN_SECONDS - (time.monotonic() - self.opened_at) if self.state == "open" else 0
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "retry_in_s": round(max(0.0, retry_in), 1),
+            }
+
+
+class StaleCache:
+    """LRU of recent successful GET responses, keyed by URL and params."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+
+    @staticmethod
+    def key(url: str, params: Any) -> Tuple:
+        if isinstance(params, dict):
+            params = tuple(sorted((k, str(v)) for k, v in params.items()))
+        return url, params if isinstance(params, (tuple, str, type(None))) else str(params)
+
+    def put(self, key: Tuple, response: requests.Response) -> None:
+        if len(response.content) > STALE_CACHE_MAX_BODY:
+            return
+        entry = {
+            "content": response.content,
+            "headers": dict(response.headers),
+            "encoding": response.encoding,
+            "url": response.url,
+            "stored_at": time.time(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > STALE_CACHE_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def get(self, key: Tuple) -> Optional[requests.Response]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self.hits += 1
+        response = requests.Response()
+        response.status_code = 200
+        response._content = entry["content"]
+        response.headers.update(entry["headers"])
+        response.headers[STALE_HEADER] = str(round(time.time() - entry["stored_at"]))
+        response.encoding = entry["encoding"]
+        response.url = entry["url"]
+        return response
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits}
+
+
+# Shared by every ERPNextClient (clients are created per request)
+_lock = threading.Lock()
+_breakers: Dict[str, CircuitBreaker] = {}
+_stats = {name: EndpointStats(name) for name in TIMEOUT_BUDGETS}
+_stale_cache = StaleCache()
+
+
+def _doctype(url: str, params: Any) -> Optional[str]:
+    """The doctype a read is for: /api/resource/<doctype>[/<name>] or a method call's doctype param."""
+    path = unquote(urlsplit(url).path)
+    if path.startswith("/api/resource/"):
+        return path[len("/api/resource/"):].split("/", 1)[0]
+    if isinstance(params, dict):
+        return params.get("doctype")
+    return None
+
+
+def _site(url: str) -> str:
+    scheme, _, rest = url.partition("://")
+    return f"{scheme}://{rest.split('/', 1)[0]}"
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    """Circuit breaker for the ERPNext site a URL belongs to."""
+    site = _site(url)
+    with _lock:
+        if site not in _breakers:
+            _breakers[site] = CircuitBreaker()
+        return _breakers[site]
+
+
+def _is_failure(response: Optional[requests.Response]) -> bool:
+    """Outcomes that count against ERPNext health (not 4xx or application errors)."""
+    return response is None or response.status_code in RETRY_STATUSES
+
+
+class ResilientSession(requests.Session):
+    """requests.Session with endpoint-class timeouts, read retries and a circuit breaker."""
+
+    def request(self, method, url, *args, **kwargs):
+        method = method.upper()
+        stats = _stats[endpoint_class(method, url)]
+        breaker = get_breaker(url)
+        idempotent = method in IDEMPOTENT_METHODS
+        cacheable = method == "GET" and _doctype(url, kwargs.get("params")) in STALE_SAFE_DOCTYPES
+        cache_key = StaleCache.key(url, kwargs.get("params")) if cacheable else None
+
+        if not breaker.allow():
+            cached = _stale_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                return cached
+            raise CircuitOpenError(f"ERPNext circuit open, not calling {url}")
+
+        # Call sites that set their own timeout keep it; the rest get the adaptive one
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = (CONNECT_TIMEOUT, stats.timeout())
+
+        _, budget = TIMEOUT_BUDGETS[stats.name]
+        deadline = time.monotonic() + budget
+        attempt = 0
+        while True:
+            stats.requests += 1
+            started = time.monotonic()
+            response = None
+            error = None
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.Timeout as e:
+                stats.timeouts += 1
+                error = e
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ContentDecodingError) as e:
+                # Refused, reset or truncated: ERPNext is unhealthy
+                error = e
+            except BaseException:
+                # Bad URL, redirect loop, interrupted call...: not ERPNext's fault,
+                # but a half-open probe must not stay claimed forever
+                breaker.release()
+                raise
+            elapsed = time.monotonic() - started
+
+            if not _is_failure(response):
+                stats.record(elapsed)
+                breaker.success()
+                if cache_key and response.status_code == 200:
+                    _stale_cache.put(cache_key, response)
+                return response
+
+            stats.failures += 1
+            breaker.failure()
+            backoff = random.uniform(0, RETRY_BACKOFF * (2 ** attempt))
+            if (not idempotent or attempt >= MAX_RETRIES or not breaker.allow()
+                    or time.monotonic() + backoff >= deadline):
+                break
+            attempt += 1
+            stats.retries += 1
+            time.sleep(backoff)
+
+        cached = _stale_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            print(f"[ERP-Breaker] Serving cached response for {url}")
+            return cached
+        if error is not None:
+            raise error
+        return response
+
+
+def erp_metrics() -> Dict[str, Any]:
+    """Breaker states, per-class timeouts and latencies, and stale cache use."""
+    with _lock:
+        breakers = dict(_breakers)
+    return {
+        "breakers": {site: breaker.snapshot() for site, breaker in breakers.items()},
+        "endpoints": {name: stats.snapshot() for name, stats in _stats.items()},
+        "stale_cache": _stale_cache.snapshot(),
+    }
@@ -0,0 +1,392 @@
+# app/utils/erpnext_backup.py
+"""
+Streaming ERPNext data backup.
+Each doctype is paged through by name in a worker thread and written as
+NDJSON (one JSON object per line), optionally gzip-compressed. Workers feed
+a bounded queue, so memory stays flat regardless of dataset size.
+
+Snapshots written to disk form chains: a full backup followed by deltas that
+hold only rows modified since the previous snapshot. The manifest records
+each doctype's high-water mark of `modified` and how snapshots chain together.
+
+Sales Invoice, Payment Entry and Journal Entry can't be inserted without
+their child rows, which list calls don't return, so BACKUP_CHILD_TABLES are
+fetched per page and stored under their table field.
+
+Backup file layout (one object per line):
+    {"type": "header", "app": ..., "version": ..., "backup_time": ..., "erpnext_url": ..., "doctypes": [...]}
+    {"type": "record", "doctype": "Customer", "data": {...}}
+    {"type": "doctype_end", "doctype": "Customer", "count": 123}
+    {"type": "error", "doctype": "Membership", "error": "..."}
+    {"type": "footer", "counts": {...}, "high_water": {...}, "complete": true}
+"""
+import json
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional
+
+import requests
+
+from .config import get_config
+from .erp_paging import attach_children, iter_doctype
+
+BACKUP_APP = "invictus-bjj-erpnext-backup"
+BACKUP_VERSION = "2.1.0"
+
+# Doctypes included in a full backup - adjust these based on your ERPNext setup
+BACKUP_DOCTYPES = [
+    "Customer",
+    "Gym Member",
+    "Sales Invoice",
+    "Payment Entry",
+    "Journal Entry",
+    "Membership",
+    "Membership Type",
+]
+
+# Child tables backed up with their parent: table field -> child doctype
+BACKUP_CHILD_TABLES = {
+    "Sales Invoice": {"items": "Sales Invoice Item", "taxes": "Sales Taxes and Charges"},
+    "Payment Entry": {"references": "Payment Entry Reference", "deductions": "Payment Entry Deduction"},
+    "Journal Entry": {"accounts": "Journal Entry Account"},
+}
+
+# Records fetched per request
+BACKUP_PAGE_SIZE = 500
+
+# Doctypes fetched at the same time
+BACKUP_WORKERS = 3
+
+# Lines buffered between the fetch workers and the response
+BACKUP_QUEUE_SIZE = 2000
+
+# Bytes collected before a chunk is written to the response
+BACKUP_CHUNK_SIZE = 64 * 1024
+
+# Snapshot files and manifest - stored next to config.json under data/
+BACKUP_DIR = Path(__file__).parent.parent.parent / "data" / "backups"
+MANIFEST_FILE = BACKUP_DIR / "manifest.json"
+
+# Auto mode starts a new chain with a full backup after this many days
+FULL_BACKUP_INTERVAL_DAYS = 7
+
+# Full + delta chains kept on disk
+KEEP_CHAINS = 4
+
+_DONE = object()
+
+
+def latest_modified(url: str, headers: dict, doctype: str) -> Optional[str]:
+    """Get the most recent `modified` timestamp of a doctype."""
+    response = requests.get(
+        f"{url}/api/resource/{doctype}",
+        headers=headers,
+        params={'fields': '["modified"]', 'order_by': 'modified desc', 'limit_page_length': 1},
+        timeout=30
+    )
+    response.raise_for_status()
+    rows = response.json().get('data', [])
+    return rows[0].get('modified') if rows else None
+
+
+def count_doctypes(url: str, headers: dict, doctypes: List[str]) -> Dict[str, int]:
+    """
+    Count records per doctype with frappe.client.get_count, all doctypes at once.
+    A doctype that can't be counted (missing or not permitted) reports -1.
+    """
+    def count(doctype: str) -> int:
+        try:
+            response = requests.get(
+                f"{url}/api/method/frappe.client.get_count",
+                headers=headers,
+                params={'doctype': doctype},
+                timeout=10
+            )
+            if response.status_code == 200:
+                return int(response.json().get('message') or 0)
+            return -1
+        except Exception:
+            return -1
+
+    with ThreadPoolExecutor(max_workers=len(doctypes) or 1) as executor:
+        return dict(zip(doctypes, executor.map(count, doctypes)))
+
+
+def _line(obj: Dict[str, Any]) -> bytes:
+    """Encode one NDJSON line."""
+    return (json.dumps(obj, default=str, separators=(',', ':')) + "\n").encode('utf-8')
+
+
+def stream_backup(url: str, headers: dict, doctypes: List[str] = None, filters: Dict[str, list] = None,
+                  compress: bool = False, header: Dict[str, Any] = None,
+                  summary: Optional[Dict[str, Any]] = None) -> Iterator[bytes]:
+    """
+    Generate a backup as NDJSON byte chunks.
+    filters optionally maps a doctype to extra list filters (used for delta backups).
+    summary, if given, is filled with the counts and high-water marks once the backup ends.
+    Closing the generator (e.g. client disconnect) stops the fetch workers.
+    """
+    doctypes = list(doctypes or BACKUP_DOCTYPES)
+    filters = filters or {}
+    lines: "queue.Queue" = queue.Queue(maxsize=BACKUP_QUEUE_SIZE)
+    stop = threading.Event()
+    pending = list(reversed(doctypes))
+    pending_lock = threading.Lock()
+    counts: Dict[str, int] = {}
+    high_water: Dict[str, Optional[str]] = {}
+
+    def put(item) -> bool:
+        """Queue an item, giving up if the backup was abandoned."""
+        while not stop.is_set():
+            try:
+                lines.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        while not stop.is_set():
+            with pending_lock:
+                if not pending:
+                    break
+                doctype = pending.pop()
+            count = 0
+            try:
+                # Taken before paging so rows modified during the backup land in the next delta
+                high_water[doctype] = latest_modified(url, headers, doctype)
+                records = iter_doctype(url, headers, doctype, filters.get(doctype), page_size=BACKUP_PAGE_SIZE, stop=stop)
+                while True:
+                    page = list(islice(records, BACKUP_PAGE_SIZE))
+                    if not page:
+                        break
+                    attach_children(url, headers, doctype, page, BACKUP_CHILD_TABLES.get(doctype, {}))
+                    for record in page:
+                        if not put(_line({"type": "record", "doctype": doctype, "data": record})):
+                            return
+                        count += 1
+                counts[doctype] = count
+                put(_line({"type": "doctype_end", "doctype": doctype, "count": count}))
+                print(f"[Backup] Backed up {count} {doctype} records")
+            except Exception as e:
+                print(f"[Backup] Could not backup {doctype}: {e}")
+                put(_line({"type": "error", "doctype": doctype, "error": str(e)}))
+        put(_DONE)
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = gzip container
+
+    def emit(data: bytes) -> bytes:
+        return compressor.compress(data) if compressor else data
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(min(BACKUP_WORKERS, len(doctypes)) or 1)]
+    try:
+        first = _line({
+            "type": "header",
+            "app": BACKUP_APP,
+            "version": BACKUP_VERSION,
+            "backup_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "erpnext_url": url,
+            "doctypes": doctypes,
+            **(header or {})
+        })
+        buffer = [first]
+        size = len(first)
+
+        for thread in workers:
+            thread.start()
+
+        running = len(workers)
+        while running:
+            item = lines.get()
+            if item is _DONE:
+                running -= 1
+                continue
+            buffer.append(item)
+            size += len(item)
+            if size >= BACKUP_CHUNK_SIZE:
+                chunk = emit(b"".join(buffer))
+                buffer, size = [], 0
+                if chunk:
+                    yield chunk
+
+        complete = len(counts) == len(doctypes)
+        if summary is not None:
+            summary.update({
+                "counts": dict(counts),
+                "high_water": {d: high_water.get(d) for d in counts},
+                "complete": complete
+            })
+        buffer.append(_line({
+            "type": "footer",
+            "counts": counts,
+            "high_water": {d: high_water.get(d) for d in counts},
+            "complete": complete
+        }))
+        tail = emit(b"".join(buffer))
+        if compressor:
+            tail += compressor.flush()
+        yield tail
+    finally:
+        stop.set()
+
+
+class BackupSnapshots:
+    """Full and delta backup snapshots on disk, tracked by a JSON manifest."""
+
+    def __init__(self, directory: Path = BACKUP_DIR):
+        self._dir = directory
+        self._manifest_path = directory / MANIFEST_FILE.name
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """Get ERPNext URL and headers from configuration."""
+        config = get_config()
+        if not config.is_configured():
+            return None, None
+
+        erp_config = config.get_erpnext_config()
+        headers = {
+            'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+            'Content-Type': 'application/json'
+        }
+        return erp_config.get('url', '').rstrip('/'), headers
+
+    def get_manifest(self) -> Dict[str, Any]:
+        """Load the manifest (empty if no snapshot was taken yet)."""
+        if not self._manifest_path.exists():
+            return {"high_water": {}, "snapshots": []}
+        try:
+            with open(self._manifest_path, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"[Backup] Error loading manifest: {e}")
+            return {"high_water": {}, "snapshots": []}
+
+    def _save_manifest(self, manifest: Dict[str, Any]) -> None:
+        """Write the manifest atomically."""
+        tmp_path = self._manifest_path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        tmp_path.replace(self._manifest_path)
+
+    def get_snapshot_path(self, filename: str) -> Optional[Path]:
+        """Resolve a snapshot file listed in the manifest."""
+        for snapshot in self.get_manifest().get("snapshots", []):
+            if snapshot["file"] == filename:
+                path = self._dir / filename
+                return path if path.exists() else None
+        return None
+
+    def _needs_full(self, manifest: Dict[str, Any]) -> bool:
+        """Check whether auto mode should start a new chain."""
+        fulls = [s for s in manifest.get("snapshots", []) if s["kind"] == "full" and s.get("complete")]
+        if not fulls:
+            return True
+        last_full = datetime.strptime(fulls[-1]["created_at"], '%Y-%m-%d %H:%M:%S')
+        return datetime.now() - last_full > timedelta(days=FULL_BACKUP_INTERVAL_DAYS)
+
+    def _prune(self, manifest: Dict[str, Any]) -> None:
+        """Drop snapshot chains beyond KEEP_CHAINS."""
+        chains = []
+        for snapshot in manifest["snapshots"]:
+            if snapshot["chain"] not in chains:
+                chains.append(snapshot["chain"])
+        expired = set(chains[:-KEEP_CHAINS])
+        if not expired:
+            return
+        for snapshot in manifest["snapshots"]:
+            if snapshot["chain"] in expired:
+                (self._dir / snapshot["file"]).unlink(missing_ok=True)
+        manifest["snapshots"] = [s for s in manifest["snapshots"] if s["chain"] not in expired]
+
+    def take_snapshot(self, mode: str = "auto") -> Dict[str, Any]:
+        """
+        Write a snapshot to disk and record it in the manifest.
+        mode: "full", "delta", or "auto" (delta unless a new chain is due).
+        """
+        if mode not in ("auto", "full", "delta"):
+            raise ValueError(f"Unknown backup mode: {mode}")
+
+        url, headers = self._connection()
+        if not url:
+            raise ValueError("ERPNext not configured")
+
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A backup snapshot is already running")
+
+        try:
+            manifest = self.get_manifest()
+            kind = mode
+            if mode == "auto":
+                kind = "full" if self._needs_full(manifest) else "delta"
+            elif mode == "delta" and not manifest.get("snapshots"):
+                kind = "full"
+
+            since = dict(manifest.get("high_water", {})) if kind == "delta" else {}
+            # Doctypes without a high-water mark (new or never backed up) are exported in full
+            filters = {d: [["modified", ">", ts]] for d, ts in since.items() if ts}
+
+            started = time.time()
+            filename = f"erpnext_{kind}_{time.strftime('%Y%m%d_%H%M%S')}.ndjson.gz"
+            self._dir.mkdir(parents=True, exist_ok=True)
+            path = self._dir / filename
+            tmp_path = path.with_suffix(".tmp")
+
+            base = manifest["snapshots"][-1] if kind == "delta" else None
+            summary: Dict[str, Any] = {}
+            with open(tmp_path, 'wb') as f:
+                for chunk in stream_backup(url, headers, BACKUP_DOCTYPES, filters=filters, compress=True,
+                                           header={"kind": kind, "since": since,
+                                                   "base": base["file"] if base else None},
+                                           summary=summary):
+                    f.write(chunk)
+            tmp_path.replace(path)
+
+            snapshot = {
+                "file": filename,
+                "kind": kind,
+                "chain": base["chain"] if base else filename,
+                "base": base["file"] if base else None,
+                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "since": since,
+                "high_water": summary.get("high_water", {}),
+                "counts": summary.get("counts", {}),
+                "complete": summary.get("complete", False),
+                "bytes": path.stat().st_size,
+                "seconds": round(time.time() - started, 1)
+            }
+
+            # Only doctypes that backed up successfully advance their mark
+            for doctype, ts in snapshot["high_water"].items():
+                if ts:
+                    manifest.setdefault("high_water", {})[doctype] = ts
+            if kind == "full":
+                # A new chain starts from this snapshot's marks only
+                manifest["high_water"] = {d: ts for d, ts in snapshot["high_water"].items() if ts}
+            manifest.setdefault("snapshots", []).append(snapshot)
+            self._prune(manifest)
+            self._save_manifest(manifest)
+
+            print(f"[Backup] {kind} snapshot {filename}: {sum(snapshot['counts'].values())} records "
+                  f"in {snapshot['seconds']}s")
+            return snapshot
+        finally:
+            self._lock.release()
+
+
+# Singleton instance
+_snapshots = None
+
+
+def get_backup_snapshots() -> BackupSnapshots:
+    """Get the backup snapshots singleton."""
+    global _snapshots
+    if _snapshots is None:
+        _snapshots = BackupSnapshots()
+    return _snapshots
@@ -5,6 +5,7 @@ Checks and creates required doctypes on first run.
 """
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, List, Tuple
 from .config import get_config
 
@@ -494,6 +495,61 @@ DEFAULT_CLASS_TYPES = [
 ]
 
 
+# Doctypes created in this order when their dependencies are equal
+DOCTYPE_ORDER = [
+    "Belt Rank",
+    "Gym Staff",
+    "Membership Type",
+    "Gym Class Type",
+    "Gym Member",
+    "Rank History",
+    "Gym Attendance",
+    "Membership",
+    "Gym Payment",
+    "Payment Handover Item",
+    "Payment Handover",
+]
+
+# Field that names each seeded doctype (matches its autoname)
+SEED_KEY_FIELDS = {
+    "Belt Rank": "rank_name",
+    "Membership Type": "membership_name",
+    "Gym Class Type": "class_name",
+}
+
+# Independent creations sent to ERPNext at the same time
+INIT_WORKERS = 4
+
+
+def doctype_levels(doctype_names: List[str]) -> List[List[str]]:
+    """
+    Group doctypes into dependency levels from their Link/Table fields.
+    Every doctype comes after the doctypes it references; doctypes within a
+    level are independent and can be created concurrently.
+    """
+    names = [d for d in DOCTYPE_ORDER if d in doctype_names] + \
+        [d for d in doctype_names if d not in DOCTYPE_ORDER]
+    depends_on = {
+        name: {
+            f.get("options") for f in GYM_DOCTYPES[name].get("fields", [])
+            if f.get("fieldtype") in ("Link", "Table", "Table MultiSelect")
+            and f.get("options") in names and f.get("options") != name
+        }
+        for name in names
+    }
+
+    levels = []
+    placed = set()
+    while len(placed) < len(names):
+        level = [n for n in names if n not in placed and depends_on[n] <= placed]
+        if not level:
+            # Circular references - create the rest in the original order
+            level = [n for n in names if n not in placed]
+        levels.append(level)
+        placed.update(level)
+    return levels
+
+
 class ERPNextInitializer:
     """Handles ERPNext initialization and doctype creation."""
 
@@ -503,12 +559,15 @@ class ERPNextInitializer:
         self._url = None
 
     def _setup_connection(self) -> bool:
-        """Setup connection parameters."""
+        """Setup connection parameters (once per initializer instance)."""
+        if self._url:
+            return True
+
         if not self.config.is_configured():
             return False
 
         erp_config = self.config.get_erpnext_config()
-        self._url = erp_config.get('url', '')
+        self._url = erp_config.get('url', '').rstrip('/')
         api_key = erp_config.get('api_key', '')
         api_secret = erp_config.get('api_secret', '')
 
@@ -518,6 +577,13 @@ class ERPNextInitializer:
         }
         return True
 
+    def _run_concurrently(self, func, items: list) -> list:
+        """Apply func to every item using INIT_WORKERS threads, keeping item order."""
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=min(INIT_WORKERS, len(items))) as executor:
+            return list(executor.map(func, items))
+
     def check_doctype_exists(self, doctype_name: str) -> bool:
         """Check if a doctype exists in ERPNext."""
         if not self._setup_connection():
@@ -534,20 +600,68 @@ class ERPNextInitializer:
             print(f"Error checking doctype {doctype_name}: {e}")
             return False
 
+    def _get_existing_doctypes(self) -> set:
+        """Get which gym doctypes exist, with one list request."""
+        if not self._setup_connection():
+            return set()
+
+        try:
+            response = requests.get(
+                f"{self._url}/api/resource/DocType",
+                headers=self._headers,
+                params={
+                    'fields': '["name"]',
+                    'filters': json.dumps([["name", "in", list(GYM_DOCTYPES.keys())]]),
+                    'limit_page_length': 0
+                },
+                timeout=10
+            )
+            if response.status_code == 200:
+                return {d["name"] for d in response.json().get("data", [])}
+            print(f"DocType list failed ({response.status_code}), checking one by one")
+        except Exception as e:
+            print(f"Error listing doctypes: {e}")
+
+        names = list(GYM_DOCTYPES.keys())
+        return {name for name, exists in zip(names, self._run_concurrently(self.check_doctype_exists, names)) if exists}
+
+    def _get_existing_fields(self, doctype_names: List[str]) -> Optional[Dict[str, set]]:
+        """Get the fieldnames of several doctypes with one DocField query (None if not readable)."""
+        try:
+            response = requests.get(
+                f"{self._url}/api/method/frappe.client.get_list",
+                headers=self._headers,
+                params={
+                    'doctype': 'DocField',
+                    'parent': 'DocType',
+                    'fields': '["parent", "fieldname"]',
+                    'filters': json.dumps([["parenttype", "=", "DocType"], ["parent", "in", doctype_names]]),
+                    'limit_page_length': 0
+                },
+                timeout=10
+            )
+            if response.status_code != 200:
+                return None
+            fields = {name: set() for name in doctype_names}
+            for row in response.json().get("message", []):
+                fields.setdefault(row.get("parent"), set()).add(row.get("fieldname"))
+            return fields
+        except Exception as e:
+            print(f"Error listing doctype fields: {e}")
+            return None
+
     def get_initialization_status(self) -> Dict[str, bool]:
         """Get the initialization status of all required doctypes."""
-        status = {}
-        for doctype_name in GYM_DOCTYPES.keys():
-            status[doctype_name] = self.check_doctype_exists(doctype_name)
-        return status
+        existing = self._get_existing_doctypes()
+        return {doctype_name: doctype_name in existing for doctype_name in GYM_DOCTYPES.keys()}
 
     def is_fully_initialized(self) -> bool:
         """Check if all required doctypes are initialized."""
         status = self.get_initialization_status()
         return all(status.values())
 
-    def create_doctype(self, doctype_name: str) -> Tuple[bool, str]:
-        """Create a single doctype in ERPNext."""
+    def create_doctype(self, doctype_name: str, exists: Optional[bool] = None) -> Tuple[bool, str]:
+        """Create a single doctype in ERPNext (exists skips the existence check when already known)."""
         if not self._setup_connection():
             return False, "ERPNext not configured"
 
@@ -555,7 +669,9 @@ class ERPNextInitializer:
             return False, f"Unknown doctype: {doctype_name}"
 
         # Check if already exists
-        if self.check_doctype_exists(doctype_name):
+        if exists is None:
+            exists = self.check_doctype_exists(doctype_name)
+        if exists:
             return True, f"{doctype_name} already exists"
 
         doctype_def = GYM_DOCTYPES[doctype_name].copy()
@@ -585,9 +701,6 @@ class ERPNextInitializer:
         if doctype_name not in GYM_DOCTYPES:
             return False, f"Unknown doctype: {doctype_name}"
 
-        if not self.check_doctype_exists(doctype_name):
-            return False, f"{doctype_name} does not exist"
-
         try:
             # Get current doctype definition
             response = requests.get(
@@ -596,6 +709,8 @@ class ERPNextInitializer:
                 timeout=10
             )
 
+            if response.status_code == 404:
+                return False, f"{doctype_name} does not exist"
             if response.status_code != 200:
                 return False, f"Failed to get {doctype_name}"
 
@@ -651,41 +766,50 @@ class ERPNextInitializer:
         """Update all doctypes with any missing fields."""
         results = {}
 
-        for doctype_name in GYM_DOCTYPES.keys():
-            if self.check_doctype_exists(doctype_name):
-                success, message = self.update_doctype_fields(doctype_name)
-                results[doctype_name] = {"success": success, "message": message}
+        existing = [d for d in GYM_DOCTYPES.keys() if d in self._get_existing_doctypes()]
+        if not existing:
+            return results
+
+        # Diff all field lists at once; only doctypes missing fields are fetched and updated
+        current_fields = self._get_existing_fields(existing)
+        to_update = []
+        for doctype_name in existing:
+            wanted = {f.get("fieldname") for f in GYM_DOCTYPES[doctype_name].get("fields", []) if f.get("fieldname")}
+            if current_fields is not None and wanted <= current_fields.get(doctype_name, set()):
+                results[doctype_name] = {"success": True, "message": f"{doctype_name} is up to date"}
+            else:
+                to_update.append(doctype_name)
+
+        for doctype_name, (success, message) in zip(to_update, self._run_concurrently(self.update_doctype_fields, to_update)):
+            results[doctype_name] = {"success": success, "message": message}
 
-        return results
+        return {d: results[d] for d in existing}
 
-    def initialize_all(self) -> Dict[str, Tuple[bool, str]]:
-        """Initialize all required doctypes."""
+    def initialize_all(self) -> Dict[str, Dict]:
+        """Initialize all required doctypes, creating only the missing ones."""
         results = {}
 
-        # Order matters - create parent doctypes first
-        ordered_doctypes = [
-            "Belt Rank",
-            "Gym Staff",
-            "Membership Type",
-            "Gym Class Type",
-            "Gym Member",
-            "Rank History",
-            "Gym Attendance",
-            "Membership",
-            "Gym Payment",
-            "Payment Handover Item",
-            "Payment Handover",
-        ]
+        if not self._setup_connection():
+            return {"error": {"success": False, "message": "ERPNext not configured"}}
 
-        for doctype_name in ordered_doctypes:
-            success, message = self.create_doctype(doctype_name)
-            results[doctype_name] = {"success": success, "message": message}
+        existing = self._get_existing_doctypes()
+        for doctype_name in DOCTYPE_ORDER:
+            if doctype_name in existing:
+                results[doctype_name] = {"success": True, "message": f"{doctype_name} already exists"}
+
+        # Order matters - referenced doctypes first; each level is created concurrently
+        missing = [d for d in GYM_DOCTYPES.keys() if d not in existing]
+        for level in doctype_levels(missing):
+            created = self._run_concurrently(lambda name: self.create_doctype(name, exists=False), level)
+            for doctype_name, (success, message) in zip(level, created):
+                results[doctype_name] = {"success": success, "message": message}
 
-            # If creation failed (and it's not because it already exists), log it
-            if not success and "already exists" not in message:
-                print(f"Failed to create {doctype_name}: {message}")
+                # If creation failed (and it's not because it already exists), log it
+                if not success and "already exists" not in message:
+                    print(f"Failed to create {doctype_name}: {message}")
 
-        return results
+        ordered = [d for d in DOCTYPE_ORDER if d in results] + [d for d in results if d not in DOCTYPE_ORDER]
+        return {d: results[d] for d in ordered}
 
     def _create_record(self, doctype: str, data: dict) -> Tuple[bool, str]:
         """Create a single record in ERPNext."""
@@ -705,53 +829,66 @@ class ERPNextInitializer:
         except Exception as e:
             return False, str(e)
 
-    def create_default_data(self) -> Dict[str, Tuple[bool, str]]:
-        """Create default data like belt ranks, membership types and class types."""
-        results = {}
+    def _get_existing_records(self, doctype: str) -> set:
+        """Get the key values of a seeded doctype's records, with one list request."""
+        key_field = SEED_KEY_FIELDS[doctype]
+        try:
+            response = requests.get(
+                f"{self._url}/api/resource/{doctype}",
+                headers=self._headers,
+                params={'fields': json.dumps([key_field]), 'limit_page_length': 0},
+                timeout=10
+            )
+            if response.status_code == 200:
+                return {r.get(key_field) for r in response.json().get("data", [])}
+        except Exception as e:
+            print(f"Error listing {doctype}: {e}")
+        # Unknown - attempt every create; duplicates are reported as already existing
+        return set()
+
+    def _seed_records(self, seeds: List[Tuple[str, str, dict]]) -> Dict[str, Dict]:
+        """
+        Create seed records that don't exist yet.
+        seeds is a list of (result label, doctype, record); missing records are created concurrently.
+        """
+        doctypes = list(dict.fromkeys(doctype for _, doctype, _ in seeds))
+        existing = dict(zip(doctypes, self._run_concurrently(self._get_existing_records, doctypes)))
 
-        if not self._setup_connection():
-            return {"error": {"success": False, "message": "ERPNext not configured"}}
+        results = {}
+        missing = []
+        for label, doctype, record in seeds:
+            if record[SEED_KEY_FIELDS[doctype]] in existing[doctype]:
+                results[label] = {"success": True, "message": "Already exists"}
+            else:
+                missing.append((label, doctype, record))
 
-        # Create Adult Belt Ranks
-        for rank in BJJ_ADULT_RANKS:
-            success, message = self._create_record("Belt Rank", rank)
-            results[f"Adult: {rank['rank_name']}"] = {"success": success, "message": message}
+        created = self._run_concurrently(lambda seed: self._create_record(seed[1], seed[2]), missing)
+        for (label, _, _), (success, message) in zip(missing, created):
+            results[label] = {"success": success, "message": message}
 
-        # Create Kids Belt Ranks
-        for rank in BJJ_KIDS_RANKS:
-            success, message = self._create_record("Belt Rank", rank)
-            results[f"Kids: {rank['rank_name']}"] = {"success": success, "message": message}
+        return {label: results[label] for label, _, _ in seeds}
 
-        # Create Membership Types
-        for membership in DEFAULT_MEMBERSHIP_TYPES:
-            success, message = self._create_record("Membership Type", membership)
-            results[f"Membership: {membership['membership_name']}"] = {"success": success, "message": message}
+    def _belt_rank_seeds(self) -> List[Tuple[str, str, dict]]:
+        """Adult and kids belt rank seed records."""
+        return [(f"Adult: {rank['rank_name']}", "Belt Rank", rank) for rank in BJJ_ADULT_RANKS] + \
+            [(f"Kids: {rank['rank_name']}", "Belt Rank", rank) for rank in BJJ_KIDS_RANKS]
 
-        # Create Class Types
-        for class_type in DEFAULT_CLASS_TYPES:
-            success, message = self._create_record("Gym Class Type", class_type)
-            results[f"Class: {class_type['class_name']}"] = {"success": success, "message": message}
+    def create_default_data(self) -> Dict[str, Tuple[bool, str]]:
+        """Create default data like belt ranks, membership types and class types."""
+        if not self._setup_connection():
+            return {"error": {"success": False, "message": "ERPNext not configured"}}
 
-        return results
+        seeds = self._belt_rank_seeds()
+        seeds += [(f"Membership: {m['membership_name']}", "Membership Type", m) for m in DEFAULT_MEMBERSHIP_TYPES]
+        seeds += [(f"Class: {c['class_name']}", "Gym Class Type", c) for c in DEFAULT_CLASS_TYPES]
+        return self._seed_records(seeds)
 
     def create_belt_ranks_only(self) -> Dict[str, Tuple[bool, str]]:
         """Create only belt ranks (adult + kids)."""
-        results = {}
-
         if not self._setup_connection():
             return {"error": {"success": False, "message": "ERPNext not configured"}}
 
-        # Create Adult Belt Ranks
-        for rank in BJJ_ADULT_RANKS:
-            success, message = self._create_record("Belt Rank", rank)
-            results[f"Adult: {rank['rank_name']}"] = {"success": success, "message": message}
-
-        # Create Kids Belt Ranks
-        for rank in BJJ_KIDS_RANKS:
-            success, message = self._create_record("Belt Rank", rank)
-            results[f"Kids: {rank['rank_name']}"] = {"success": success, "message": message}
-
-        return results
+        return self._seed_records(self._belt_rank_seeds())
 
 
 def get_initializer() -> ERPNextInitializer:
@@ -0,0 +1,517 @@
+# app/utils/erpnext_restore.py
+"""
+Restore ERPNext data from a backup file.
+The backup is streamed once and split into per-doctype spool files, then
+each doctype is inserted in dependency order with bulk insert_many calls and
+bounded concurrency. Progress is checkpointed after every batch, so an
+interrupted restore resumes where it stopped.
+
+Doctypes named from a field (or by prompt) keep their names through
+insert_many. ERPNext names the others itself (naming series, hash), so
+they are inserted one at a time and every old -> new name is appended to a
+log; links in later records and their child rows are rewritten through it,
+using each doctype's metadata to find its Link and Dynamic Link fields.
+Backups older than version 2.1.0 have no child rows, so their Sales
+Invoices, Payment Entries and Journal Entries are reported as failed.
+"""
+import gzip
+import json
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import requests
+
+from .config import get_config
+from .erpnext_backup import BACKUP_CHILD_TABLES
+
+# Uploaded backups, spool files and the checkpoint - stored next to config.json under data/
+RESTORE_DIR = Path(__file__).parent.parent.parent / "data" / "restore"
+CHECKPOINT_FILE = RESTORE_DIR / "checkpoint.json"
+NAMES_FILE = RESTORE_DIR / "names.ndjson"
+
+# Referenced doctypes are restored before the doctypes that link to them;
+# doctypes not listed here are restored last
+RESTORE_ORDER = [
+    "Membership Type",
+    "Customer",
+    "Gym Member",
+    "Membership",
+    "Sales Invoice",
+    "Payment Entry",
+    "Journal Entry",
+]
+
+# Records per insert_many call
+RESTORE_BATCH_SIZE = 100
+
+# insert_many calls in flight at the same time
+RESTORE_WORKERS = 4
+
+# Errors kept for the status report
+MAX_REPORTED_ERRORS = 20
+
+# Server-managed columns dropped before insert
+SKIP_KEYS = {
+    "creation", "modified", "modified_by", "owner", "idx",
+    "_user_tags", "_comments", "_assign", "_liked_by", "_seen",
+}
+
+# Child rows are re-parented on insert, so their own identity goes too
+CHILD_SKIP_KEYS = SKIP_KEYS | {"name", "parent", "parentfield", "parenttype", "doctype", "docstatus"}
+
+
+def _open_backup(path: Path):
+    """Open a backup file as text, gzip-compressed or not."""
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rt', encoding='utf-8') if compressed else open(path, 'r', encoding='utf-8')
+
+
+def iter_backup_records(path: Path) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield (doctype, record) from a backup file.
+    Reads the NDJSON format line by line; the original single-document JSON
+    format (version 1.0.0) is still accepted.
+    """
+    with _open_backup(path) as f:
+        first = f.readline()
+        try:
+            header = json.loads(first)
+        except json.JSONDecodeError:
+            header = None
+
+        if not (isinstance(header, dict) and header.get("type") == "header"):
+            # Legacy backup - one indented JSON document
+            f.seek(0)
+            data = json.load(f)
+            if data.get("app") != "invictus-bjj-erpnext-backup":
+                raise ValueError("Invalid backup file")
+            for doctype, records in data.get("data", {}).items():
+                for record in records:
+                    yield doctype, record
+            return
+
+        if header.get("app") != "invictus-bjj-erpnext-backup":
+            raise ValueError("Invalid backup file")
+
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("type") == "record":
+                yield entry["doctype"], entry["data"]
+
+
+def _clean_record(doctype: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Prepare a backed-up record, and its child rows, for insert."""
+    doc = {}
+    for key, value in record.items():
+        if key in SKIP_KEYS:
+            continue
+        if isinstance(value, list):
+            value = [{k: v for k, v in row.items() if k not in CHILD_SKIP_KEYS} for row in value]
+        doc[key] = value
+    doc["doctype"] = doctype
+    return doc
+
+
+def _doctype_meta(url: str, headers: dict, doctype: str) -> Dict[str, Any]:
+    """
+    How ERPNext names a doctype and which fields link to other records.
+    links maps field -> (fieldtype, options) for Link and Dynamic Link
+    fields; tables holds the same per child table field.
+    """
+    response = requests.get(
+        f"{url}/api/method/frappe.desk.form.load.getdoctype",
+        headers=headers,
+        params={"doctype": doctype},
+        timeout=30
+    )
+    response.raise_for_status()
+    docs = {d["name"]: d for d in response.json().get("docs", [])}
+
+    def links(meta: Dict[str, Any]) -> Dict[str, Tuple[str, str]]:
+        return {f["fieldname"]: (f["fieldtype"], f["options"]) for f in meta.get("fields", [])
+                if f.get("fieldtype") in ("Link", "Dynamic Link") and f.get("options")}
+
+    meta = docs.get(doctype, {})
+    autoname = (meta.get("autoname") or "").lower()
+    return {
+        "keeps_names": autoname.startswith("field:") or autoname == "prompt",
+        "prompt": autoname == "prompt",
+        "links": links(meta),
+        "tables": {f["fieldname"]: links(docs.get(f.get("options"), {})) for f in meta.get("fields", [])
+                   if f.get("fieldtype") in ("Table", "Table MultiSelect")},
+    }
+
+
+def _relink(doc: Dict[str, Any], links: Dict[str, Tuple[str, str]], names: Dict[str, Dict[str, str]]) -> None:
+    """Point links at the names restored records were given."""
+    for field, (fieldtype, options) in links.items():
+        value = doc.get(field)
+        target = doc.get(options) if fieldtype == "Dynamic Link" else options
+        if value and target in names:
+            doc[field] = names[target].get(value, value)
+
+
+class ERPNextRestore:
+    """Resumable, bulk restore of ERPNext data."""
+
+    def __init__(self, directory: Path = RESTORE_DIR):
+        self._dir = directory
+        self._checkpoint_path = directory / CHECKPOINT_FILE.name
+        self._names_path = directory / NAMES_FILE.name
+        self._names: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._state: Dict[str, Any] = self._load_checkpoint()
+        if self._state.get("state") == "running":
+            # Process ended mid-restore
+            self._state["state"] = "interrupted"
+
+    def _connection(self):
+        """Get ERPNext URL and headers from configuration."""
+        config = get_config()
+        if not config.is_configured():
+            return None, None
+
+        erp_config = config.get_erpnext_config()
+        headers = {
+            'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+            'Content-Type': 'application/json'
+        }
+        return erp_config.get('url', '').rstrip('/'), headers
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        """Load the last restore checkpoint."""
+        if not self._checkpoint_path.exists():
+            return {"state": "idle"}
+        try:
+            with open(self._checkpoint_path, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"[Restore] Error loading checkpoint: {e}")
+            return {"state": "idle"}
+
+    def _save_checkpoint(self) -> None:
+        """Write the checkpoint atomically."""
+        self._dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._checkpoint_path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f, indent=2)
+        tmp_path.replace(self._checkpoint_path)
+
+    def _load_names(self) -> Dict[str, Dict[str, str]]:
+        """Read the old -> new names of records ERPNext renamed on insert."""
+        names: Dict[str, Dict[str, str]] = {}
+        if self._names_path.exists():
+            with open(self._names_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        doctype, old, new = json.loads(line)
+                        names.setdefault(doctype, {})[old] = new
+        return names
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get restore progress, including throughput in records/sec."""
+        with self._lock:
+            status = json.loads(json.dumps(self._state))
+        done = sum(status.get("done", {}).values())
+        elapsed = status.get("elapsed", 0)
+        if status.get("state") == "running" and status.get("resumed_at"):
+            elapsed += time.time() - status["resumed_at"]
+        processed = done - status.get("done_at_resume", 0) if status.get("state") == "running" else done
+        status["processed"] = done
+        status["total"] = sum(status.get("totals", {}).values())
+        status["records_per_sec"] = round(processed / elapsed, 1) if elapsed > 0 and processed else 0
+        status.pop("done_at_resume", None)
+        status.pop("resumed_at", None)
+        return status
+
+    def is_running(self) -> bool:
+        """Check if a restore is in progress."""
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self, backup_path: Path) -> Dict[str, Any]:
+        """Start restoring a backup file (already saved under the restore directory)."""
+        if self.is_running():
+            raise RuntimeError("A restore is already running")
+
+        with self._lock:
+            shutil.rmtree(self._dir / "spool", ignore_errors=True)
+            self._names_path.unlink(missing_ok=True)
+            self._state = {
+                "state": "running",
+                "file": backup_path.name,
+                "started_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "split": False,
+                "totals": {},
+                "done": {},
+                "inserted": {},
+                "skipped": {},
+                "failed": {},
+                "errors": [],
+                "elapsed": 0
+            }
+            self._save_checkpoint()
+        return self._launch()
+
+    def resume(self) -> Dict[str, Any]:
+        """Resume an interrupted restore from its checkpoint."""
+        if self.is_running():
+            raise RuntimeError("A restore is already running")
+        if self._state.get("state") not in ("interrupted", "failed", "stopped"):
+            raise ValueError("No interrupted restore to resume")
+        if not (self._dir / self._state.get("file", "")).exists():
+            raise ValueError("Backup file of the interrupted restore is missing")
+        return self._launch()
+
+    def stop(self) -> None:
+        """Ask a running restore to stop after its in-flight batches."""
+        self._stop.set()
+
+    def _launch(self) -> Dict[str, Any]:
+        url, headers = self._connection()
+        if not url:
+            raise ValueError("ERPNext not configured")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(url, headers), daemon=True)
+        self._thread.start()
+        return self.get_status()
+
+    def _run(self, url: str, headers: dict) -> None:
+        with self._lock:
+            self._state["state"] = "running"
+            self._state["resumed_at"] = time.time()
+            self._state["done_at_resume"] = sum(self._state.get("done", {}).values())
+            self._save_checkpoint()
+            self._names = self._load_names()
+
+        try:
+            if not self._state.get("split"):
+                self._split(self._dir / self._state["file"])
+
+            totals = self._state["totals"]
+            ordered = [d for d in RESTORE_ORDER if d in totals] + [d for d in totals if d not in RESTORE_ORDER]
+            for doctype in ordered:
+                if self._stop.is_set():
+                    break
+                if self._state["done"].get(doctype, 0) < totals[doctype]:
+                    self._restore_doctype(url, headers, doctype)
+
+            final_state = "stopped" if self._stop.is_set() else "completed"
+        except Exception as e:
+            print(f"[Restore] Failed: {e}")
+            final_state = "failed"
+            self._state.setdefault("errors", []).append(str(e))
+
+        with self._lock:
+            self._state["elapsed"] = self._state.get("elapsed", 0) + time.time() - self._state.pop("resumed_at")
+            self._state["state"] = final_state
+            if final_state == "completed":
+                self._state["completed_at"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                shutil.rmtree(self._dir / "spool", ignore_errors=True)
+            self._save_checkpoint()
+        print(f"[Restore] {final_state}: {self.get_status().get('processed')} records")
+
+    def _spool_path(self, doctype: str) -> Path:
+        return self._dir / "spool" / f"{doctype}.ndjson"
+
+    def _split(self, backup_path: Path) -> None:
+        """Stream the backup once into one spool file per doctype."""
+        spool_dir = self._dir / "spool"
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        spool_dir.mkdir(parents=True, exist_ok=True)
+
+        files = {}
+        totals: Dict[str, int] = {}
+        try:
+            for doctype, record in iter_backup_records(backup_path):
+                if doctype not in files:
+                    files[doctype] = open(self._spool_path(doctype), 'w', encoding='utf-8')
+                files[doctype].write(json.dumps(record, separators=(',', ':')) + "\n")
+                totals[doctype] = totals.get(doctype, 0) + 1
+        finally:
+            for f in files.values():
+                f.close()
+
+        with self._lock:
+            self._state["totals"] = totals
+            self._state["split"] = True
+            self._save_checkpoint()
+        print(f"[Restore] Backup split: {totals}")
+
+    def _insert_batch(self, url: str, headers: dict, doctype: str, batch: List[Dict[str, Any]],
+                      keeps_names: bool = True) -> Tuple[int, int, List[str], Dict[str, str]]:
+        """
+        Insert a batch with one insert_many call. If the batch is rejected
+        (e.g. some records already exist), fall back to one insert per record.
+        Records ERPNext renames are always inserted one by one, since
+        insert_many doesn't say which new name belongs to which record.
+        Returns (inserted, skipped, errors, old -> new names).
+        """
+        if keeps_names:
+            response = requests.post(
+                f"{url}/api/method/frappe.client.insert_many",
+                headers=headers,
+                json={"docs": batch},
+                timeout=120
+            )
+            if response.status_code == 200:
+                return len(batch), 0, [], {}
+
+        inserted, skipped, errors, renamed = 0, 0, [], {}
+        for doc in batch:
+            try:
+                single = requests.post(
+                    f"{url}/api/resource/{doctype}",
+                    headers=headers,
+                    json=doc,
+                    timeout=30
+                )
+                if single.status_code in (200, 201):
+                    inserted += 1
+                    if not keeps_names:
+                        renamed[doc["name"]] = single.json().get("data", {}).get("name", doc["name"])
+                elif single.status_code == 409 or "DuplicateEntryError" in single.text:
+                    skipped += 1
+                else:
+                    errors.append(f"{doctype} {doc.get('name')}: {single.text[:200]}")
+            except Exception as e:
+                errors.append(f"{doctype} {doc.get('name')}: {e}")
+        return inserted, skipped, errors, renamed
+
+    def _record_batch(self, doctype: str, result: Tuple[int, int, List[str], Dict[str, str]]) -> None:
+        inserted, skipped, errors, renamed = result
+        if renamed:
+            self._names.setdefault(doctype, {}).update(renamed)
+            with open(self._names_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps([doctype, old, new]) + "\n" for old, new in renamed.items())
+        state = self._state
+        state["inserted"][doctype] = state["inserted"].get(doctype, 0) + inserted
+        state["skipped"][doctype] = state["skipped"].get(doctype, 0) + skipped
+        state["failed"][doctype] = state["failed"].get(doctype, 0) + len(errors)
+        room = MAX_REPORTED_ERRORS - len(state["errors"])
+        if room > 0:
+            state["errors"].extend(errors[:room])
+
+    def _restore_doctype(self, url: str, headers: dict, doctype: str) -> None:
+        """Insert one doctype's spooled records from its checkpoint onwards."""
+        start = self._state["done"].get(doctype, 0)
+        print(f"[Restore] {doctype}: resuming at record {start}" if start else f"[Restore] {doctype}: starting")
+        meta = _doctype_meta(url, headers, doctype)
+        keeps_names = meta["keeps_names"]
+        restored = self._names.get(doctype, {})
+        required = list(BACKUP_CHILD_TABLES.get(doctype, {}))
+        rejected = 0
+        # A record linking to its own doctype needs the new name of a record
+        # inserted before it, so those doctypes go one record at a time
+        workers, queued, batch_size = RESTORE_WORKERS, RESTORE_WORKERS * 2, RESTORE_BATCH_SIZE
+        if not keeps_names and any(options == doctype for _, options in meta["links"].values()):
+            workers, queued, batch_size = 1, 1, 1
+
+        def batches() -> Iterator[Tuple[int, int, List[Dict[str, Any]]]]:
+            """Yield (first line, line after last, records); consecutive batches cover every line."""
+            nonlocal rejected
+            batch, cursor, end = [], start, start
+            with open(self._spool_path(doctype), 'r', encoding='utf-8') as f:
+                for index, line in enumerate(f):
+                    if index < start:
+                        continue
+                    end = index + 1
+                    record = json.loads(line)
+                    if record.get("docstatus") == 2:
+                        # Cancelled documents can't be inserted
+                        continue
+                    if record.get("name") in restored:
+                        # Inserted before the restore was interrupted
+                        continue
+                    if any(field not in record for field in required):
+                        rejected += 1
+                        continue
+                    doc = _clean_record(doctype, record)
+                    _relink(doc, meta["links"], self._names)
+                    for field, links in meta["tables"].items():
+                        for row in doc.get(field) or []:
+                            _relink(row, links, self._names)
+                    if meta["prompt"]:
+                        doc["__newname"] = doc.get("name")
+                    batch.append(doc)
+                    if len(batch) >= batch_size:
+                        yield cursor, end, batch
+                        batch, cursor = [], end
+            if batch:
+                yield cursor, end, batch
+
+        # Batches finish out of order; the checkpoint only advances over a contiguous prefix
+        finished: Dict[int, int] = {}
+        contiguous = start
+        in_flight = {}
+        batch_error = None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            source = batches()
+            exhausted = False
+            while True:
+                # Keep a bounded number of batches queued so memory stays flat
+                while not exhausted and not self._stop.is_set() and len(in_flight) < queued:
+                    try:
+                        batch_start, batch_end, batch = next(source)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = executor.submit(self._insert_batch, url, headers, doctype, batch, keeps_names)
+                    in_flight[future] = (batch_start, batch_end)
+                if not in_flight:
+                    break
+
+                completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                with self._lock:
+                    for future in completed:
+                        batch_start, batch_end = in_flight.pop(future)
+                        try:
+                            self._record_batch(doctype, future.result())
+                        except Exception as e:
+                            # Batch never reached ERPNext - stop and leave it for a resume
+                            batch_error = e
+                            self._stop.set()
+                            continue
+                        finished[batch_start] = batch_end
+                    while contiguous in finished:
+                        contiguous = finished.pop(contiguous)
+                    self._state["done"][doctype] = contiguous
+                    self._save_checkpoint()
+
+        with self._lock:
+            if rejected:
+                self._state["failed"][doctype] = self._state["failed"].get(doctype, 0) + rejected
+                if len(self._state["errors"]) < MAX_REPORTED_ERRORS:
+                    self._state["errors"].append(
+                        f"{doctype}: {rejected} records have no {', '.join(required)} "
+                        f"(backup older than 2.1.0) - take a new backup to restore them"
+                    )
+            if not self._stop.is_set():
+                self._state["done"][doctype] = self._state["totals"][doctype]
+            self._save_checkpoint()
+
+        if batch_error:
+            raise RuntimeError(f"{doctype} restore stopped: {batch_error}")
+
+
+# Singleton instance
+_restore = None
+
+
+def get_restore() -> ERPNextRestore:
+    """Get the ERPNext restore singleton."""
+    global _restore
+    if _restore is None:
+        _restore = ERPNextRestore()
+    return _restore
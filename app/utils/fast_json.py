@@ -0,0 +1,55 @@
+# app/utils/fast_json.py
+"""
+JSON encoding and decoding with orjson when it is installed, falling back to
+the standard library. Used for API responses (as the default response class)
+and for decoding ERPNext replies.
+"""
+import json
+from typing import Any
+
+from starlette.responses import JSONResponse as _StarletteJSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib produces the same documents, only slower
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def loads(data: Any) -> Any:
+    """Parse JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class JSONResponse(_StarletteJSONResponse):
+    """Drop-in JSONResponse rendered with the fast encoder."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def parse_once(response, *args, **kwargs):
+    """
+    requests response hook: decode the body with the fast parser at most once.
+    Later response.json() calls return the same parsed object, so callers
+    must not mutate it expecting a fresh copy.
+    """
+    parsed = []
+
+    def cached_json(**_kwargs):
+        if not parsed:
+            parsed.append(loads(response.content))
+        return parsed[0]
+
+    response.json = cached_json
+    return response
@@ -0,0 +1,156 @@
+# app/utils/health.py
+"""
+Liveness and readiness state for /healthz and /readyz.
+ERPNext is pinged on a schedule (every HEALTH_PING_INTERVAL seconds) and the
+result is cached, so a health check never waits on ERPNext and never renders
+a page. Readiness combines the last ping with the ERP client's circuit breakers,
+the worker thread pool's saturation and whether the staff directory is
+loaded, so a worker whose ERPNext connection is slow or failing is
+reported as not ready.
+"""
+import threading
+import time
+from typing import Dict, Any, Optional
+
+import requests
+
+from .config import get_config
+from .erp_resilience import erp_metrics
+
+# Seconds between ERPNext pings
+HEALTH_PING_INTERVAL = 15
+
+# A ping older than this is stale; /readyz then starts a new one in the background
+HEALTH_PING_STALE = HEALTH_PING_INTERVAL * 3
+
+HEALTH_PING_TIMEOUT = 5
+
+# Slower pings mark the ERPNext connection as degraded
+DEGRADED_LATENCY_MS = 2000
+
+# Consecutive failed pings before ERPNext is reported as down
+FAILURES_BEFORE_DOWN = 2
+
+# Share of worker threads in use above which the worker stops taking traffic
+MAX_THREAD_SATURATION = 0.9
+
+
+class HealthMonitor:
+    """Cached ERPNext ping and readiness checks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pinging = False
+        self._last: Optional[Dict[str, Any]] = None
+        self._failures = 0
+
+    def _connection(self):
+        """Get ERPNext URL and headers from configuration."""
+        config = get_config()
+        if not config.is_configured():
+            return None, None
+
+        erp_config = config.get_erpnext_config()
+        headers = {
+            'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+            'Content-Type': 'application/json'
+        }
+        return erp_config.get('url', '').rstrip('/'), headers
+
+    def ping(self) -> Optional[Dict[str, Any]]:
+        """Ping ERPNext once and cache the result (None if not configured)."""
+        url, headers = self._connection()
+        if not url:
+            return None
+
+        with self._lock:
+            if self._pinging:
+                return self._last
+            self._pinging = True
+
+        started = time.monotonic()
+        error = None
+        try:
+            # Authenticated, so an expired API key shows up here too
+            response = requests.get(f"{url}/api/method/ping", headers=headers, timeout=HEALTH_PING_TIMEOUT)
+            if response.status_code != 200:
+                error = f"HTTP {response.status_code}"
+        except Exception as e:
+            error = type(e).__name__
+        latency_ms = round((time.monotonic() - started) * 1000)
+
+        with self._lock:
+            self._failures = self._failures + 1 if error else 0
+            if error:
+                status = "down" if self._failures >= FAILURES_BEFORE_DOWN else "degraded"
+            else:
+                status = "degraded" if latency_ms > DEGRADED_LATENCY_MS else "ok"
+            self._last = {
+                "status": status,
+                "latency_ms": latency_ms,
+                "error": error,
+                "consecutive_failures": self._failures,
+                "checked_at": time.time(),
+            }
+            self._pinging = False
+            if status != "ok":
+                print(f"[Health] ERPNext {status}: {error or f'{latency_ms} ms'}")
+            return self._last
+
+    def erpnext(self) -> Dict[str, Any]:
+        """Last ping result; starts a background ping if it is missing or stale."""
+        with self._lock:
+            last = dict(self._last) if self._last else None
+        if last is None or time.time() - last["checked_at"] > HEALTH_PING_STALE:
+            threading.Thread(target=self.ping, daemon=True).start()
+        if last is None:
+            return {"status": "unknown"}
+        last["age_s"] = round(time.time() - last.pop("checked_at"), 1)
+        return last
+
+    def readiness(self, thread_pool: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Readiness report. An unconfigured app is ready (it serves the setup
+        page); a configured one needs a healthy ERPNext ping, spare worker
+        threads and a loaded staff directory.
+        """
+        from .rank_table import get_rank_table
+        from .staff_directory import get_staff_directory
+
+        if not get_config().is_configured():
+            return {"ready": True, "status": "setup", "reasons": [], "checks": {}}
+
+        erpnext = self.erpnext()
+        caches = {
+            "staff_directory": get_staff_directory().is_loaded(),
+            "rank_table": get_rank_table().is_loaded(),
+        }
+        breakers = erp_metrics()["breakers"]
+        reasons = []
+        if erpnext["status"] != "ok":
+            reasons.append(f"erpnext {erpnext['status']}")
+        if any(b["state"] == "open" for b in breakers.values()):
+            reasons.append("erpnext circuit open")
+        if thread_pool["saturation"] >= MAX_THREAD_SATURATION:
+            reasons.append("thread pool saturated")
+        if not caches["staff_directory"]:
+            reasons.append("staff directory not loaded")
+
+        return {
+            "ready": not reasons,
+            "status": "ready" if not reasons else "not ready",
+            "reasons": reasons,
+            "checks": {"erpnext": erpnext, "circuit_breakers": breakers, "thread_pool": thread_pool, "caches": caches},
+        }
+
+
+# Singleton instance
+_health_monitor = None
+
+
+def get_health_monitor() -> HealthMonitor:
+    """Get the health monitor singleton."""
+    global _health_monitor
+    if _health_monitor is None:
+        _health_monitor = HealthMonitor()
+    return _health_monitor
@@ -0,0 +1,227 @@
+# app/utils/http_middleware.py
+"""
+HTTP middleware for response size and revalidation.
+
+ETagMiddleware gives complete HTML/JSON GET responses a content-hash ETag
+and answers If-None-Match with 304, so a repeated view of unchanged data
+sends no body. CompressionMiddleware compresses text responses with Brotli
+(when the brotli package is installed) or gzip, for whole and streamed
+bodies alike. Both are plain ASGI middleware, so streamed responses pass
+through without being buffered in full.
+"""
+import hashlib
+import zlib
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+
+GZIP_LEVEL = 6
+# Brotli quality 4 compresses better than gzip 6 at a similar speed
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/javascript", "application/xml",
+    "application/x-ndjson", "image/svg+xml",
+)
+
+ETAG_TYPES = ("text/html", "application/json")
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+def _header(headers: Headers, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _without(headers: Headers, *names: bytes) -> Headers:
+    return [(k, v) for k, v in headers if k.lower() not in names]
+
+
+def _request_header(scope, name: bytes) -> bytes:
+    return _header(scope.get("headers") or [], name) or b""
+
+
+class ETagMiddleware:
+    """Content-hash ETags and 304 Not Modified for complete GET HTML/JSON responses."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = _request_header(scope, b"if-none-match")
+        start = None
+        passthrough = False
+
+        async def wrapped_send(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type = (_header(headers, b"content-type") or b"").decode("latin-1")
+                cache_control = (_header(headers, b"cache-control") or b"").lower()
+                if (message["status"] != 200 or _header(headers, b"etag") is not None
+                        or b"no-store" in cache_control
+                        or not content_type.startswith(ETAG_TYPES)):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+
+            if message["type"] != "http.response.body":
+                # Extension messages (e.g. http.response.debug) are not ours to handle
+                await send(message)
+                return
+
+            if message.get("more_body", False):
+                # Streamed body: no complete content to hash
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            etag = b'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest().encode() + b'"'
+            headers = _without(start.get("headers", []), b"etag")
+            headers.append((b"etag", etag))
+            if _header(headers, b"cache-control") is None:
+                # Stored, but revalidated on every view
+                headers.append((b"cache-control", b"private, no-cache"))
+
+            if etag in [tag.strip() for tag in if_none_match.split(b",")] or if_none_match.strip() == b"*":
+                await send({
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": _without(headers, b"content-length", b"content-type"),
+                })
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            await send({**start, "headers": headers})
+            await send(message)
+
+        await self.app(scope, receive, wrapped_send)
+
+
+class CompressionMiddleware:
+    """Brotli or gzip compression for text responses above a size threshold."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    @staticmethod
+    def _choose_encoding(scope) -> Optional[str]:
+        accepted = {
+            part.split(";")[0].strip()
+            for part in _request_header(scope, b"accept-encoding").decode("latin-1").lower().split(",")
+        }
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self._choose_encoding(scope)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        def new_compressor():
+            if encoding == "br":
+                return brotli.Compressor(quality=BROTLI_QUALITY)
+            return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+        def compress_chunk(data: bytes) -> bytes:
+            return compressor.process(data) if encoding == "br" else compressor.compress(data)
+
+        def finish() -> bytes:
+            return compressor.finish() if encoding == "br" else compressor.flush()
+
+        def compressed_headers(headers: Headers) -> Headers:
+            headers = _without(headers, b"content-length")
+            headers.append((b"content-encoding", encoding.encode()))
+            vary = _header(headers, b"vary")
+            if vary is None:
+                headers.append((b"vary", b"Accept-Encoding"))
+            elif b"accept-encoding" not in vary.lower():
+                headers = _without(headers, b"vary") + [(b"vary", vary + b", Accept-Encoding")]
+            return headers
+
+        async def wrapped_send(message):
+            nonlocal start, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type = (_header(headers, b"content-type") or b"").decode("latin-1")
+                if (_header(headers, b"content-encoding") is not None
+                        or not content_type.startswith(COMPRESSIBLE_TYPES)):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                if not more_body:
+                    # Whole body in one message: compress it only if it's worth it
+                    if len(body) < self.minimum_size:
+                        passthrough = True
+                        await send(start)
+                        await send(message)
+                        return
+                    compressor = new_compressor()
+                    data = compress_chunk(body) + finish()
+                    headers = compressed_headers(start.get("headers", []))
+                    headers.append((b"content-length", str(len(data)).encode()))
+                    await send({**start, "headers": headers})
+                    await send({"type": "http.response.body", "body": data})
+                    return
+
+                compressor = new_compressor()
+                await send({**start, "headers": compressed_headers(start.get("headers", []))})
+
+            data = compress_chunk(body)
+            if not more_body:
+                data += finish()
+            elif not data:
+                # Compressor is still buffering; nothing to send yet
+                return
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, wrapped_send)
@@ -0,0 +1,156 @@
+# app/utils/rank_table.py
+"""
+In-memory table of Belt Ranks.
+Ranks change only when the gym edits its belt system, so the whole table is
+loaded in one request instead of fetching a Belt Rank per member lookup,
+check-in or promotion. Edits arrive as change sync events and are applied
+in place; the TTL only matters while change sync isn't live.
+"""
+import json
+import threading
+import time
+from typing import Dict, Any, Optional, List
+
+import requests
+
+from .config import get_config
+from .sync_engine import get_sync_engine
+
+# Seconds before the table is considered stale
+RANK_CACHE_TTL = 600
+
+RANK_FIELDS = ["name", "rank_name", "color", "rank_order", "days_required", "stripes_available", "is_active"]
+
+
+class RankTable:
+    """Belt ranks keyed by document name, with rank order lookups."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ranks: Dict[str, Dict[str, Any]] = {}
+        self._ordered: List[Dict[str, Any]] = []
+        self._loaded_at = 0.0
+        self._loaded_url = None
+        self._version = 0
+
+    def _connection(self):
+        """Get ERPNext URL and headers from configuration."""
+        config = get_config()
+        if not config.is_configured():
+            return None, None
+
+        erp_config = config.get_erpnext_config()
+        headers = {
+            'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+            'Content-Type': 'application/json'
+        }
+        return erp_config.get('url', '').rstrip('/'), headers
+
+    def refresh(self) -> bool:
+        """Reload every Belt Rank. Keeps the previous table on failure."""
+        url, headers = self._connection()
+        if not url:
+            return False
+
+        with self._lock:
+            try:
+                response = requests.get(
+                    f"{url}/api/resource/Belt Rank",
+                    headers=headers,
+                    params={
+                        "fields": json.dumps(RANK_FIELDS),
+                        "order_by": "rank_order asc",
+                        "limit_page_length": 0
+                    },
+                    timeout=10
+                )
+                response.raise_for_status()
+                ranks = response.json().get("data", [])
+            except Exception as e:
+                print(f"[Rank-Table] Refresh failed: {e}")
+                return False
+
+            self._set(ranks)
+            self._loaded_at = time.monotonic()
+            self._loaded_url = url
+            print(f"[Rank-Table] Loaded {len(ranks)} belt ranks")
+            return True
+
+    def _set(self, ranks: List[Dict[str, Any]]) -> None:
+        self._ranks = {r["name"]: r for r in ranks}
+        self._ordered = sorted(
+            (r for r in ranks if r.get("is_active", 1)),
+            key=lambda r: r.get("rank_order") or 0
+        )
+        self._version += 1
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """Change sync subscriber: apply Belt Rank edits to a loaded table."""
+        if event["kind"] != "changes" or event["initial"] or not self.is_loaded():
+            return
+        with self._lock:
+            ranks = dict(self._ranks)
+            for record in event["changed"]:
+                ranks[record["name"]] = {f: record.get(f) for f in RANK_FIELDS}
+            for name in event["deleted"]:
+                ranks.pop(name, None)
+            self._set(list(ranks.values()))
+
+    def _ensure_fresh(self) -> None:
+        """Refresh the table if it is stale or was loaded for another ERPNext."""
+        url, _ = self._connection()
+        expired = time.monotonic() - self._loaded_at > RANK_CACHE_TTL and not get_sync_engine().is_live(["Belt Rank"])
+        if not self.is_loaded() or expired or url != self._loaded_url:
+            self.refresh()
+
+    def invalidate(self) -> None:
+        """Force a reload on the next lookup (call after editing Belt Ranks)."""
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def is_loaded(self) -> bool:
+        """Check if the table holds data from a successful load."""
+        return self._loaded_at > 0
+
+    @property
+    def version(self) -> int:
+        """Incremented on every successful load (for caches derived from ranks)."""
+        self._ensure_fresh()
+        return self._version
+
+    def get(self, rank_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Get a rank by document name."""
+        if not rank_id:
+            return None
+        self._ensure_fresh()
+        rank = self._ranks.get(rank_id)
+        return dict(rank) if rank else None
+
+    def next_rank(self, rank_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """The active rank following a rank in rank order."""
+        rank = self.get(rank_id)
+        if not rank:
+            return None
+        order = rank.get("rank_order") or 0
+        for candidate in self._ordered:
+            if (candidate.get("rank_order") or 0) > order:
+                return dict(candidate)
+        return None
+
+    def active_ranks(self) -> List[Dict[str, Any]]:
+        """Active ranks in rank order."""
+        self._ensure_fresh()
+        return [dict(r) for r in self._ordered]
+
+
+# Singleton instance
+_rank_table = None
+
+
+def get_rank_table() -> RankTable:
+    """Get the rank table singleton."""
+    global _rank_table
+    if _rank_table is None:
+        _rank_table = RankTable()
+        get_sync_engine().subscribe(["Belt Rank"], _rank_table.apply)
+    return _rank_table
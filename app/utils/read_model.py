@@ -0,0 +1,330 @@
+# app/utils/read_model.py
+"""
+Local read model: a SQLite mirror of the ERPNext doctypes most pages read.
+The mirror subscribes to the change sync (app/utils/sync_engine.py): changed
+records are upserted, deleted ones removed, and child tables that pages
+need (payment references, invoice items) arrive inside their parent.
+
+Pages query the mirror instead of ERPNext, so they cost a local query and
+still load while ERPNext is down. Until a doctype's initial load has been
+delivered, get_list() and get_doc() return None and the caller asks ERPNext
+as before. Writes made by this app are written through with upsert() so the
+next page view sees them without waiting for the sync.
+"""
+import re
+import threading
+from typing import Dict, Any, Optional, List
+
+from .config import get_config
+from .db import connect, transaction
+from .fast_json import loads, dumps
+from .sync_engine import get_sync_engine
+
+# Bump when the table layout changes; the mirror is then rebuilt
+SCHEMA_VERSION = 2
+
+# Mirrored doctypes: table name and the columns kept outside the JSON record
+# so they can be indexed. Every other field is still queryable through the record.
+MIRRORED_DOCTYPES = {
+    "Gym Member": {
+        "table": "gym_member",
+        "columns": {"rfid_tag": "TEXT", "customer": "TEXT", "full_name": "TEXT", "status": "TEXT", "member_type": "TEXT"},
+        "indexes": [["rfid_tag"], ["customer"], ["full_name"]],
+    },
+    "Belt Rank": {
+        "table": "belt_rank",
+        "columns": {"rank_order": "INTEGER"},
+        "indexes": [["rank_order"]],
+    },
+    "Membership Type": {
+        "table": "membership_type",
+        "columns": {"is_active": "INTEGER"},
+        "indexes": [],
+    },
+    "Gym Attendance": {
+        "table": "gym_attendance",
+        "columns": {"member": "TEXT", "attendance_date": "TEXT", "check_in_time": "TEXT"},
+        "indexes": [["member", "attendance_date"], ["attendance_date"]],
+    },
+    "Sales Invoice": {
+        "table": "sales_invoice",
+        "columns": {"customer": "TEXT", "posting_date": "TEXT", "due_date": "TEXT", "status": "TEXT",
+                    "docstatus": "INTEGER", "outstanding_amount": "REAL"},
+        "indexes": [["customer", "posting_date"], ["posting_date"], ["status", "due_date"]],
+    },
+    "Payment Entry": {
+        "table": "payment_entry",
+        "columns": {"party": "TEXT", "posting_date": "TEXT", "payment_type": "TEXT", "docstatus": "INTEGER"},
+        "indexes": [["posting_date"], ["party"]],
+    },
+}
+
+# Child tables stored inside their parent's record: parent doctype -> (field, child doctype)
+CHILD_TABLES = {
+    "Payment Entry": ("references", "Payment Entry Reference"),
+    "Sales Invoice": ("items", "Sales Invoice Item"),
+}
+
+_FIELD_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+_COMPARISONS = {"=", "!=", ">", ">=", "<", "<="}
+
+
+class ReadModel:
+    """SQLite mirror of MIRRORED_DOCTYPES, kept in step by change sync events."""
+
+    def __init__(self):
+        self._schema_lock = threading.Lock()
+        self._ready = set()
+        self._ready_url = None
+        self._initialized = False
+
+    def _connection(self):
+        """Get ERPNext URL and headers from configuration."""
+        config = get_config()
+        if not config.is_configured():
+            return None, None
+
+        erp_config = config.get_erpnext_config()
+        headers = {
+            'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+            'Content-Type': 'application/json'
+        }
+        return erp_config.get('url', '').rstrip('/'), headers
+
+    def _enabled(self) -> bool:
+        return bool(get_config().get("read_model_enabled", True))
+
+    def _init_schema(self) -> None:
+        if self._initialized:
+            return
+        with self._schema_lock:
+            if not self._initialized:
+                self._create_schema()
+
+    def _create_schema(self) -> None:
+        conn = connect()
+        with transaction(conn):
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+            rebuild = row is None or int(row["value"]) != SCHEMA_VERSION
+            if rebuild:
+                for table in ["sync_state", "loaded", *(spec["table"] for spec in MIRRORED_DOCTYPES.values())]:
+                    conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+
+            # Doctypes whose initial load has been delivered, and from which ERPNext
+            conn.execute("CREATE TABLE IF NOT EXISTS loaded (doctype TEXT PRIMARY KEY, url TEXT)")
+            for spec in MIRRORED_DOCTYPES.values():
+                table = spec["table"]
+                columns = "".join(f', "{c}" {t}' for c, t in spec["columns"].items())
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (name TEXT PRIMARY KEY, modified TEXT{columns}, data TEXT NOT NULL)')
+                for index in spec["indexes"]:
+                    index_name = f"ix_{table}_" + "_".join(index)
+                    index_columns = ", ".join(f'"{c}"' for c in index)
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table}" ({index_columns})')
+
+        if rebuild:
+            # An empty mirror needs the initial load replayed
+            get_sync_engine().reset(list(MIRRORED_DOCTYPES))
+
+        url, _ = self._connection()
+        self._ready = {row["doctype"] for row in conn.execute("SELECT doctype, url FROM loaded") if row["url"] == url}
+        self._ready_url = url
+        self._initialized = True
+
+    def is_ready(self, doctype: str) -> bool:
+        """Whether a doctype's initial load from the configured ERPNext has been delivered."""
+        if not self._enabled() or doctype not in MIRRORED_DOCTYPES:
+            return False
+        try:
+            self._init_schema()
+        except Exception as e:
+            print(f"[Read-Model] Database unavailable: {e}")
+            return False
+        url, _ = self._connection()
+        return url is not None and url == self._ready_url and doctype in self._ready
+
+    @staticmethod
+    def _row(spec: Dict[str, Any], record: Dict[str, Any]) -> tuple:
+        return (
+            record["name"],
+            record.get("modified"),
+            *(record.get(c) for c in spec["columns"]),
+            dumps(record).decode("utf-8"),
+        )
+
+    def _write(self, doctype: str, records: List[Dict[str, Any]]) -> None:
+        spec = MIRRORED_DOCTYPES[doctype]
+        table = spec["table"]
+        columns = ", ".join(["name", "modified", *(f'"{c}"' for c in spec["columns"]), "data"])
+        placeholders = ", ".join("?" * (len(spec["columns"]) + 3))
+        conn = connect()
+        with transaction(conn):
+            conn.executemany(
+                f'INSERT OR REPLACE INTO "{table}" ({columns}) VALUES ({placeholders})',
+                [self._row(spec, r) for r in records]
+            )
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """Change sync subscriber: apply one event to the mirror."""
+        doctype = event["doctype"]
+        table = MIRRORED_DOCTYPES[doctype]["table"]
+        self._init_schema()
+        conn = connect()
+
+        if event["kind"] == "reset":
+            self._ready.discard(doctype)
+            with transaction(conn):
+                conn.execute(f'DELETE FROM "{table}"')
+                conn.execute("DELETE FROM loaded WHERE doctype = ?", (doctype,))
+        elif event["kind"] == "changes":
+            if event["changed"]:
+                self._write(doctype, event["changed"])
+            if event["deleted"]:
+                with transaction(conn):
+                    conn.executemany(f'DELETE FROM "{table}" WHERE name = ?', [(n,) for n in event["deleted"]])
+        elif event["kind"] == "loaded":
+            url, _ = self._connection()
+            with transaction(conn):
+                conn.execute("INSERT OR REPLACE INTO loaded VALUES (?, ?)", (doctype, url))
+            if url != self._ready_url:
+                self._ready, self._ready_url = set(), url
+            self._ready.add(doctype)
+
+    @staticmethod
+    def _column(spec: Dict[str, Any], field: str) -> str:
+        if not _FIELD_RE.match(field):
+            raise ValueError(f"Invalid field name: {field}")
+        if field in ("name", "modified") or field in spec["columns"]:
+            return f'"{field}"'
+        return f"json_extract(data, '$.{field}')"
+
+    def _where(self, spec: Dict[str, Any], filters: List[list]) -> tuple:
+        clauses, params = [], []
+        for field, operator, value in filters:
+            column = self._column(spec, field)
+            operator = operator.lower()
+            if operator in _COMPARISONS:
+                clauses.append(f"{column} {'<>' if operator == '!=' else operator} ?")
+                params.append(value)
+            elif operator in ("in", "not in"):
+                values = list(value)
+                if not values:
+                    clauses.append("0" if operator == "in" else "1")
+                    continue
+                clauses.append(f"{column} {operator.upper()} ({', '.join('?' * len(values))})")
+                params.extend(values)
+            elif operator == "like":
+                clauses.append(f"{column} LIKE ?")
+                params.append(value)
+            elif operator == "is":
+                clauses.append(f"COALESCE({column}, '') {'<>' if value == 'set' else '='} ''")
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _order(self, spec: Dict[str, Any], order_by: Optional[str]) -> str:
+        if not order_by:
+            return ""
+        terms = []
+        for term in order_by.split(","):
+            field, _, direction = term.strip().partition(" ")
+            direction = direction.strip().upper() or "ASC"
+            if direction not in ("ASC", "DESC"):
+                raise ValueError(f"Invalid sort direction: {direction}")
+            terms.append(f"{self._column(spec, field)} {direction}")
+        return " ORDER BY " + ", ".join(terms)
+
+    def get_list(self, doctype: str, filters: Optional[List[list]] = None, order_by: Optional[str] = None,
+                 limit: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Query a mirrored doctype with Frappe-style filters ([field, operator, value]).
+        Returns full records, or None when the mirror can't answer (not synced
+        yet) and the caller should ask ERPNext.
+        """
+        if not self.is_ready(doctype):
+            return None
+        spec = MIRRORED_DOCTYPES[doctype]
+        where, params = self._where(spec, filters or [])
+        sql = f'SELECT data FROM "{spec["table"]}"{where}{self._order(spec, order_by)}'
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        try:
+            rows = connect().execute(sql, params).fetchall()
+        except Exception as e:
+            print(f"[Read-Model] Query on {doctype} failed: {e}")
+            return None
+        return [loads(row["data"]) for row in rows]
+
+    def get_doc(self, doctype: str, name: str) -> Optional[Dict[str, Any]]:
+        """A mirrored record by name, or None if it isn't mirrored (ask ERPNext)."""
+        docs = self.get_list(doctype, [["name", "=", name]], limit=1)
+        return docs[0] if docs else None
+
+    def upsert(self, doctype: str, doc: Dict[str, Any]) -> None:
+        """Store a record this app just created or saved in ERPNext (as ERPNext returned it)."""
+        if not doc or not doc.get("name") or not self.is_ready(doctype):
+            return
+        try:
+            child = CHILD_TABLES.get(doctype)
+            if child and child[0] not in doc:
+                # Keep the children already mirrored when the reply has none
+                existing = self.get_doc(doctype, doc["name"]) or {}
+                doc = {**doc, child[0]: existing.get(child[0], [])}
+            self._write(doctype, [doc])
+        except Exception as e:
+            print(f"[Read-Model] Write-through of {doctype} {doc.get('name')} failed: {e}")
+
+    def update(self, doctype: str, name: str, values: Dict[str, Any]) -> None:
+        """Apply a partial update this app just saved in ERPNext to the mirrored record."""
+        existing = self.get_doc(doctype, name)
+        if existing is not None:
+            self.upsert(doctype, {**existing, **values})
+
+    def delete(self, doctype: str, name: str) -> None:
+        """Drop a record this app just deleted in ERPNext."""
+        if not self.is_ready(doctype):
+            return
+        try:
+            conn = connect()
+            with transaction(conn):
+                conn.execute(f'DELETE FROM "{MIRRORED_DOCTYPES[doctype]["table"]}" WHERE name = ?', (name,))
+        except Exception as e:
+            print(f"[Read-Model] Delete of {doctype} {name} failed: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        """Readiness and row count per doctype, for /metrics."""
+        if not self._enabled():
+            return {"enabled": False}
+        try:
+            self._init_schema()
+            conn = connect()
+            counts = {
+                doctype: conn.execute(f'SELECT COUNT(*) FROM "{spec["table"]}"').fetchone()[0]
+                for doctype, spec in MIRRORED_DOCTYPES.items()
+            }
+        except Exception as e:
+            return {"enabled": True, "error": str(e)}
+        return {
+            "enabled": True,
+            "doctypes": {doctype: {"ready": doctype in self._ready, "rows": rows} for doctype, rows in counts.items()},
+        }
+
+
+# Singleton instance
+_read_model = None
+
+
+def get_read_model() -> ReadModel:
+    """Get the read model singleton."""
+    global _read_model
+    if _read_model is None:
+        _read_model = ReadModel()
+        if _read_model._enabled():
+            try:
+                # Before subscribing, so a rebuild can't reset the sync in the middle of a delivery
+                _read_model._init_schema()
+                get_sync_engine().subscribe(list(MIRRORED_DOCTYPES), _read_model.apply, children=CHILD_TABLES)
+            except Exception as e:
+                print(f"[Read-Model] Database unavailable: {e}")
+    return _read_model
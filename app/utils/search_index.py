@@ -0,0 +1,458 @@
+# app/utils/search_index.py
+"""
+In-process search index over customer and member names, emails and phones.
+Typeahead searches are answered from memory instead of a leading-wildcard
+LIKE query per keystroke. The index is loaded in bulk and kept current by
+change sync events; while change sync isn't live it is reloaded in the
+background every SEARCH_INDEX_TTL seconds.
+
+Every indexed word is kept in a sorted vocabulary (prefix matches by bisect)
+and broken into trigrams (substring and typo candidates). A query word
+scores the best of: exact word, word prefix, substring, or a prefix within
+one or two edits. Short words are corrected by looking up their one-edit
+variants, long ones through trigram overlap. Every query word must match, and
+entries whose name starts with the whole query rank first. Until the index is loaded, search() returns
+None and the caller asks ERPNext as before.
+"""
+import re
+import string
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from heapq import nlargest
+from itertools import islice
+from operator import itemgetter
+from typing import Callable, Dict, Any, Optional, List, Set, Tuple
+
+from .config import get_config
+from .erp_paging import iter_doctype
+from .sync_engine import get_sync_engine
+
+# Indexed doctypes: the field shown as the result label, the fields searched
+# as text, emails and phone numbers, and the fields kept for results and filters
+SEARCH_DOCTYPES = {
+    "Customer": {
+        "label": "customer_name",
+        "text": ["customer_name"],
+        "emails": ["email_id"],
+        "phones": ["mobile_no"],
+        "fields": ["customer_name", "email_id", "mobile_no"],
+    },
+    "Gym Member": {
+        "label": "full_name",
+        "text": ["full_name"],
+        "emails": ["email"],
+        "phones": ["phone"],
+        "fields": ["full_name", "email", "phone", "member_type", "status", "customer"],
+    },
+}
+
+# Seconds before a load is reloaded while change sync isn't live
+SEARCH_INDEX_TTL = 5 * 60
+
+# Query words shorter than this only match as exact words or prefixes
+SUBSTRING_MIN_LENGTH = 3
+
+# Query words shorter than this are never matched with typos
+FUZZY_MIN_LENGTH = 4
+
+# Query words this long are corrected through trigram overlap (up to two typos)
+# instead of their one-edit variants
+FUZZY_LONG_LENGTH = 8
+
+# Typos are only looked for when a query word matches fewer vocabulary words than
+# this as typed; also the number of long-word candidates checked, best overlap first
+FUZZY_CANDIDATES = 50
+
+# Match scores per query word; a name starting with the whole query gets LABEL_PREFIX_BONUS on top.
+# Typo matches lose FUZZY_PENALTY per edit beyond a swap of neighbouring letters,
+# and for a different first letter (rarely mistyped)
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+SUBSTRING_SCORE = 0.6
+FUZZY_SCORE = 0.5
+FUZZY_PENALTY = 0.1
+LABEL_PREFIX_BONUS = 0.5
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_PHONE_QUERY_RE = re.compile(r"[\d\s+()./-]+")
+
+
+def _fold(text: str) -> str:
+    """Lowercase text without accents or apostrophes (O'Brien matches obrien, José matches jose)."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.lower().replace("'", "").replace("’", "")
+
+
+def _digits(text: str) -> str:
+    return "".join(c for c in text if c.isdigit())
+
+
+def _trigrams(word: str, closed: bool = True) -> Set[str]:
+    """Trigrams of a word padded at the start (and at the end when closed), so short words have some."""
+    padded = "  " + word + (" " if closed else "")
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _prefix_distance(query: str, word: str, max_distance: int) -> int:
+    """
+    Fewest edits (insert, delete, substitute, swap neighbours) turning query
+    into some prefix of word; max_distance + 1 once it is certain to exceed max_distance.
+    """
+    word = word[:len(query) + max_distance]
+    before = None
+    previous = list(range(len(word) + 1))
+    for i in range(1, len(query) + 1):
+        current = [i] + [0] * len(word)
+        for j in range(1, len(word) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (query[i - 1] != word[j - 1]))
+            if i > 1 and j > 1 and query[i - 1] == word[j - 2] and query[i - 2] == word[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        before, previous = previous, current
+    return min(previous)
+
+
+def _one_edit_variants(word: str) -> Tuple[Set[str], Set[str]]:
+    """
+    Strings one edit away from word: those with two neighbouring letters
+    swapped (the most common typo), and those with a letter deleted,
+    substituted or inserted (before the last letter).
+    """
+    splits = [(word[:i], word[i:]) for i in range(len(word))]
+    swaps = {a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1}
+    others = {a + b[1:] for a, b in splits}
+    for c in string.ascii_lowercase:
+        others.update(a + c + b[1:] for a, b in splits)
+        others.update(a + c + b for a, b in splits)
+    swaps.discard(word)
+    others -= swaps
+    others.discard(word)
+    return swaps, others
+
+
+def _query_words(query: str) -> List[str]:
+    """
+    Split a query into words; phone numbers become their digits and parts
+    with an @ stay whole, keyed like indexed emails.
+    """
+    if _PHONE_QUERY_RE.fullmatch(query) and len(_digits(query)) >= SUBSTRING_MIN_LENGTH:
+        return [_digits(query)]
+    words = []
+    for part in _fold(query).split():
+        words.extend(["@" + part] if "@" in part else _WORD_RE.findall(part))
+    return words
+
+
+class _Collection:
+    """
+    Index of one doctype: records, their words, the sorted vocabulary and its
+    trigrams. Whole emails are indexed under a leading "@" so that only queries
+    containing one scan them; the words of their local part are indexed as well.
+    """
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.spec = spec
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.labels: Dict[str, str] = {}
+        self.words: Dict[str, Tuple[str, ...]] = {}
+        self.postings: Dict[str, Set[str]] = {}
+        self.vocabulary: List[str] = []
+        self.trigrams: Dict[str, Set[str]] = {}
+        # Names, their labels and each name's position in label order, rebuilt on the first search after a change
+        self._by_label: Optional[Tuple[List[str], List[str], Dict[str, int]]] = None
+
+    def _words_of(self, record: Dict[str, Any]) -> Set[str]:
+        words = set()
+        for field in self.spec["text"]:
+            words.update(_WORD_RE.findall(_fold(record.get(field) or "")))
+        for field in self.spec["emails"]:
+            email = (record.get(field) or "").strip().lower()
+            if email:
+                words.add("@" + email)
+                words.update(_WORD_RE.findall(_fold(email.split("@")[0])))
+        for field in self.spec["phones"]:
+            digits = _digits(record.get(field) or "")
+            if len(digits) >= SUBSTRING_MIN_LENGTH:
+                words.add(digits)
+        return words
+
+    def add(self, record: Dict[str, Any], bulk: bool = False) -> None:
+        """Index a record, replacing its previous version. bulk skips keeping the vocabulary sorted."""
+        name = record["name"]
+        if name in self.records:
+            self.remove(name)
+        self._by_label = None
+        self.records[name] = {"name": name, **{f: record.get(f) for f in self.spec["fields"]}}
+        self.labels[name] = " ".join(_WORD_RE.findall(_fold(record.get(self.spec["label"]) or "")))
+        words = self._words_of(record)
+        self.words[name] = tuple(words)
+        for word in words:
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = set()
+                if not bulk:
+                    insort(self.vocabulary, word)
+                if not word.startswith("@"):
+                    for gram in _trigrams(word):
+                        self.trigrams.setdefault(gram, set()).add(word)
+            posting.add(name)
+
+    def finish_bulk(self) -> None:
+        """Sort the vocabulary once the bulk adds are done."""
+        self.vocabulary = sorted(self.postings)
+
+    def remove(self, name: str) -> None:
+        """Drop a record and any words only it had."""
+        if self.records.pop(name, None) is None:
+            return
+        self._by_label = None
+        self.labels.pop(name, None)
+        for word in self.words.pop(name, ()):
+            posting = self.postings[word]
+            posting.discard(name)
+            if posting:
+                continue
+            del self.postings[word]
+            del self.vocabulary[bisect_left(self.vocabulary, word)]
+            if word.startswith("@"):
+                continue
+            for gram in _trigrams(word):
+                words = self.trigrams[gram]
+                words.discard(word)
+                if not words:
+                    del self.trigrams[gram]
+
+    def _with_prefix(self, prefix: str):
+        i = bisect_left(self.vocabulary, prefix)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(prefix):
+            yield self.vocabulary[i]
+            i += 1
+
+    def _match_word(self, query: str) -> Dict[str, float]:
+        """Score of every vocabulary word the query word matches."""
+        matches = {}
+        for word in self._with_prefix(query):
+            matches[word] = EXACT_SCORE if word == query else PREFIX_SCORE + 0.2 * len(query) / len(word)
+        if query.startswith("@"):
+            return matches
+
+        if len(query) >= SUBSTRING_MIN_LENGTH:
+            # A substring shares every inner trigram of the query word; start from the rarest
+            postings = sorted((self.trigrams.get(query[k:k + 3], set()) for k in range(len(query) - 2)), key=len)
+            if postings and postings[0]:
+                for word in postings[0].intersection(*postings[1:]):
+                    if word not in matches and query in word:
+                        matches[word] = SUBSTRING_SCORE
+
+        # Typos are only looked for when the word as typed matches little
+        if len(query) < FUZZY_MIN_LENGTH or query.isdigit() or len(matches) >= FUZZY_CANDIDATES:
+            return matches
+        if len(query) < FUZZY_LONG_LENGTH:
+            # A short word with a swapped letter may share no trigram with the intended one
+            swaps, others = _one_edit_variants(query)
+            for variants, score in ((swaps, FUZZY_SCORE), (others, FUZZY_SCORE - FUZZY_PENALTY)):
+                for variant in variants:
+                    for word in self._with_prefix(variant):
+                        if word not in matches and not word.startswith("@"):
+                            matches[word] = score - (FUZZY_PENALTY if word[0] != query[0] else 0)
+        else:
+            shared: Dict[str, int] = {}
+            for gram in _trigrams(query, closed=False):
+                for word in self.trigrams.get(gram, ()):
+                    shared[word] = shared.get(word, 0) + 1
+            for word in nlargest(FUZZY_CANDIDATES, (w for w in shared if w not in matches), key=shared.get):
+                distance = _prefix_distance(query, word, 2)
+                if distance <= 2:
+                    matches[word] = (FUZZY_SCORE - FUZZY_PENALTY * distance
+                                     - (FUZZY_PENALTY if word[0] != query[0] else 0))
+        return matches
+
+    def _label_order(self) -> Tuple[List[str], List[str], Dict[str, int]]:
+        if self._by_label is None:
+            names = sorted(self.records, key=self.labels.get)
+            self._by_label = (names, [self.labels[n] for n in names], {n: i for i, n in enumerate(names)})
+        return self._by_label
+
+    def search(self, query: str, limit: int, where: Optional[Callable[[Dict[str, Any]], bool]]) -> List[Dict[str, Any]]:
+        words = _query_words(query)
+        names, labels, position = self._label_order()
+        if not words:
+            matching = (n for n in names if where is None or where(self.records[n]))
+            return [dict(self.records[n]) for n in islice(matching, limit)]
+
+        scores: Optional[Dict[str, float]] = None
+        for query_word in words:
+            # Best score per record: lower scoring words first, so better ones overwrite them
+            best: Dict[str, float] = {}
+            for word, score in sorted(self._match_word(query_word).items(), key=itemgetter(1)):
+                best.update(dict.fromkeys(self.postings[word], score))
+            if scores is None:
+                scores = best
+            else:
+                if len(best) < len(scores):
+                    scores, best = best, scores
+                scores = {n: s + best[n] for n, s in scores.items() if n in best}
+            if not scores:
+                return []
+
+        # Names starting with the whole query are one range of the label order
+        phrase = " ".join(words)
+        start = bisect_left(labels, phrase)
+        end = bisect_left(labels, phrase + "\uffff", start)
+        for name in names[start:end]:
+            if name in scores:
+                scores[name] += LABEL_PREFIX_BONUS
+
+        # Equal scores keep label order (the sort is stable)
+        ranked = sorted(sorted(scores, key=position.get), key=scores.get, reverse=True)
+        ranked = (n for n in ranked if where is None or where(self.records[n]))
+        return [dict(self.records[n]) for n in islice(ranked, limit)]
+
+
+class SearchIndex:
+    """Typeahead search over SEARCH_DOCTYPES, loaded in bulk and kept current by change sync."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collections: Dict[str, _Collection] = {}
+        self._loaded_at = 0.0
+        self._loaded_url = None
+        self._loading = False
+        self._pending: List[Dict[str, Any]] = []
+
+    def _connection(self):
+        """Get ERPNext URL and headers from configuration."""
+        config = get_config()
+        if not config.is_configured():
+            return None, None
+
+        erp_config = config.get_erpnext_config()
+        headers = {
+            'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+            'Content-Type': 'application/json'
+        }
+        return erp_config.get('url', '').rstrip('/'), headers
+
+    def refresh(self) -> bool:
+        """Reload the index from ERPNext. Keeps the previous index on failure."""
+        url, headers = self._connection()
+        if not url:
+            return False
+
+        with self._lock:
+            if self._loading:
+                return False
+            self._loading = True
+            self._pending = []
+
+        started = time.monotonic()
+        try:
+            collections = {}
+            for doctype, spec in SEARCH_DOCTYPES.items():
+                collection = _Collection(spec)
+                for record in iter_doctype(url, headers, doctype, fields=spec["fields"], page_size=1000):
+                    collection.add(record, bulk=True)
+                collection.finish_bulk()
+                collections[doctype] = collection
+        except Exception as e:
+            with self._lock:
+                self._loading = False
+                self._pending = []
+            print(f"[Search-Index] Load failed: {e}")
+            return False
+
+        with self._lock:
+            self._collections = collections
+            self._loaded_at = time.monotonic()
+            self._loaded_url = url
+            self._loading = False
+            # Changes published while the load was running may be newer than what it read
+            for event in self._pending:
+                self._apply(event)
+            self._pending = []
+
+        counts = ", ".join(f"{len(c.records)} {d}" for d, c in collections.items())
+        print(f"[Search-Index] Loaded {counts} in {(time.monotonic() - started) * 1000:.0f} ms")
+        return True
+
+    def refresh_in_background(self) -> None:
+        """Start a reload on its own thread unless one is running."""
+        if not self._loading:
+            threading.Thread(target=self.refresh, name="search-index", daemon=True).start()
+
+    def _apply(self, event: Dict[str, Any]) -> None:
+        collection = self._collections.get(event["doctype"])
+        if collection is None:
+            return
+        for record in event["changed"]:
+            collection.add(record)
+        for name in event["deleted"]:
+            collection.remove(name)
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """Change sync subscriber: index changed records and drop deleted ones."""
+        if event["kind"] != "changes" or event["initial"]:
+            return
+        with self._lock:
+            if self._loading:
+                self._pending.append(event)
+            else:
+                self._apply(event)
+
+    def is_loaded(self) -> bool:
+        """Check if the index holds data from a successful load."""
+        return self._loaded_at > 0
+
+    def search(self, doctype: str, query: str, limit: int = 20,
+               where: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Best matches for query among records of doctype that pass where, best
+        first (an empty query lists them by name). Returns None when the index
+        isn't loaded for the configured ERPNext yet, starting a load in the background.
+        """
+        if not get_config().get("search_index_enabled", True):
+            return None
+
+        url, _ = self._connection()
+        if not url:
+            return None
+        if not self.is_loaded() or url != self._loaded_url:
+            self.refresh_in_background()
+            return None
+        if (time.monotonic() - self._loaded_at > SEARCH_INDEX_TTL
+                and not get_sync_engine().is_live(list(SEARCH_DOCTYPES))):
+            # Serve the current index while a fresh one loads
+            self.refresh_in_background()
+
+        with self._lock:
+            return self._collections[doctype].search(query.strip(), limit, where)
+
+    def status(self) -> Dict[str, Any]:
+        """Record and vocabulary counts per doctype, for /metrics."""
+        with self._lock:
+            return {
+                "loaded": self.is_loaded(),
+                "loading": self._loading,
+                "age_s": round(time.monotonic() - self._loaded_at, 1) if self.is_loaded() else None,
+                "doctypes": {
+                    doctype: {"records": len(c.records), "words": len(c.vocabulary)}
+                    for doctype, c in self._collections.items()
+                },
+            }
+
+
+# Singleton instance
+_search_index = None
+
+
+def get_search_index() -> SearchIndex:
+    """Get the search index singleton."""
+    global _search_index
+    if _search_index is None:
+        _search_index = SearchIndex()
+        get_sync_engine().subscribe(list(SEARCH_DOCTYPES), _search_index.apply)
+    return _search_index
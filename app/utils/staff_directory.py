@@ -0,0 +1,275 @@
+# app/utils/staff_directory.py
+"""
+In-memory directory of staff RFID cards.
+Resolves ERPNext Users (with roles) and Gym Staff (with belt rank) by RFID
+without a round trip per tap. The directory is loaded in bulk and reloaded
+when change sync reports an edit to a staff card, user or Gym Staff record,
+or early when a verification fails. While change sync isn't live it is
+refreshed on a short TTL instead.
+
+A stale directory keeps answering while it reloads in the background; only
+a directory that was never loaded (or was loaded for another ERPNext) makes
+a tap wait. Failed reloads back off, so while ERPNext is down taps don't
+each wait out a request timeout.
+"""
+import json
+import threading
+import time
+from typing import Dict, Any, Optional, List
+
+import requests
+
+from .config import get_config
+from .sync_engine import get_sync_engine
+
+# Seconds before the directory is considered stale
+STAFF_CACHE_TTL = 60
+
+# Minimum seconds between forced reloads triggered by failed verifications,
+# and the first backoff after a failed reload (doubled per failure up to MAX_RELOAD_BACKOFF)
+MIN_RELOAD_INTERVAL = 5
+MAX_RELOAD_BACKOFF = 5 * 60
+
+# Doctypes whose changes reload the directory
+STAFF_DOCTYPES = ["User", "Gym Staff"]
+
+
+class StaffDirectory:
+    """Staff directory keyed by RFID."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._staff: Dict[str, Dict[str, Any]] = {}
+        self._loaded_at = 0.0
+        self._loaded_url = None
+        self._last_reload_attempt = 0.0
+        self._refreshing = False
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def _connection(self):
+        """Get ERPNext URL and headers from configuration."""
+        config = get_config()
+        if not config.is_configured():
+            return None, None
+
+        erp_config = config.get_erpnext_config()
+        headers = {
+            'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+            'Content-Type': 'application/json'
+        }
+        return erp_config.get('url', '').rstrip('/'), headers
+
+    def _fetch_users(self, url: str, headers: dict) -> Dict[str, Dict[str, Any]]:
+        """Fetch enabled Users with an RFID card and their roles (two requests total)."""
+        response = requests.get(
+            f"{url}/api/resource/User",
+            headers=headers,
+            params={
+                "filters": json.dumps([["custom_user_rfid", "is", "set"], ["enabled", "=", 1]]),
+                "fields": json.dumps(["name", "full_name", "custom_user_rfid"]),
+                "limit_page_length": 0
+            },
+            timeout=10
+        )
+        response.raise_for_status()
+        users = response.json().get("data", [])
+
+        roles_by_user: Dict[str, List[str]] = {}
+        if users:
+            roles_response = requests.get(
+                f"{url}/api/method/frappe.client.get_list",
+                headers=headers,
+                params={
+                    "doctype": "Has Role",
+                    "parent": "User",
+                    "filters": json.dumps([
+                        ["parenttype", "=", "User"],
+                        ["parent", "in", [u["name"] for u in users]]
+                    ]),
+                    "fields": json.dumps(["parent", "role"]),
+                    "limit_page_length": 0
+                },
+                timeout=10
+            )
+            roles_response.raise_for_status()
+            for row in roles_response.json().get("message", []):
+                roles_by_user.setdefault(row.get("parent"), []).append(row.get("role"))
+
+        return {
+            u["custom_user_rfid"]: {
+                "user_id": u.get("name"),
+                "name": u.get("full_name"),
+                "roles": roles_by_user.get(u.get("name"), [])
+            }
+            for u in users if u.get("custom_user_rfid")
+        }
+
+    def _fetch_staff(self, url: str, headers: dict) -> Dict[str, Dict[str, Any]]:
+        """Fetch active Gym Staff with an RFID tag, resolving their belt rank."""
+        response = requests.get(
+            f"{url}/api/resource/Gym Staff",
+            headers=headers,
+            params={
+                "filters": json.dumps([["rfid_tag", "is", "set"], ["is_active", "=", 1]]),
+                "fields": json.dumps([
+                    "name", "staff_name", "role", "rfid_tag", "photo", "current_rank",
+                    "can_promote", "can_process_payments", "can_manage_members"
+                ]),
+                "limit_page_length": 0
+            },
+            timeout=10
+        )
+        response.raise_for_status()
+        staff_list = response.json().get("data", [])
+
+        ranks = {}
+        if any(s.get("current_rank") for s in staff_list):
+            rank_response = requests.get(
+                f"{url}/api/resource/Belt Rank",
+                headers=headers,
+                params={"fields": '["name", "rank_name", "color"]', "limit_page_length": 0},
+                timeout=10
+            )
+            if rank_response.status_code == 200:
+                ranks = {r["name"]: r for r in rank_response.json().get("data", [])}
+
+        directory = {}
+        for staff in staff_list:
+            rank = ranks.get(staff.get("current_rank"))
+            staff["rank"] = {"name": rank.get("rank_name"), "color": rank.get("color")} if rank else None
+            directory[staff["rfid_tag"]] = staff
+        return directory
+
+    def refresh(self) -> bool:
+        """
+        Reload the directory from ERPNext. Keeps the previous data on failure.
+        Returns False without a request if another reload is running.
+        """
+        url, headers = self._connection()
+        if not url:
+            return False
+
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            self._last_reload_attempt = time.monotonic()
+
+        # Fetched without the lock, so lookups keep answering from the current data
+        try:
+            users = self._fetch_users(url, headers)
+            staff = self._fetch_staff(url, headers)
+        except Exception as e:
+            with self._lock:
+                self._failures += 1
+                backoff = min(MIN_RELOAD_INTERVAL * 2 ** (self._failures - 1), MAX_RELOAD_BACKOFF)
+                self._retry_at = time.monotonic() + backoff
+                self._refreshing = False
+            print(f"[Staff-Directory] Refresh failed (retrying in {backoff}s): {e}")
+            return False
+
+        with self._lock:
+            self._users = users
+            self._staff = staff
+            self._loaded_at = time.monotonic()
+            self._loaded_url = url
+            self._failures = 0
+            self._retry_at = 0.0
+            self._refreshing = False
+        print(f"[Staff-Directory] Loaded {len(users)} users and {len(staff)} staff cards")
+        return True
+
+    def _may_reload(self) -> bool:
+        """No reload is running and the backoff after a failed one has passed."""
+        return not self._refreshing and time.monotonic() >= self._retry_at
+
+    def refresh_in_background(self) -> None:
+        """Start a reload on its own thread unless one is running or backing off."""
+        if self._may_reload():
+            threading.Thread(target=self.refresh, name="staff-directory", daemon=True).start()
+
+    def is_fresh(self) -> bool:
+        """Loaded, and either kept current by change sync or within its TTL."""
+        if not self.is_loaded():
+            return False
+        return get_sync_engine().is_live(STAFF_DOCTYPES) or time.monotonic() - self._loaded_at <= STAFF_CACHE_TTL
+
+    def _ensure_fresh(self) -> None:
+        """
+        Load the directory if it holds nothing for the configured ERPNext;
+        if it is only stale, keep serving it and reload in the background.
+        """
+        url, _ = self._connection()
+        if url != self._loaded_url:
+            if self._may_reload():
+                self.refresh()
+        elif not self.is_fresh():
+            self.refresh_in_background()
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """Change sync subscriber: reload when a change touches a staff card."""
+        if event["kind"] != "changes" or event["initial"] or not self.is_loaded():
+            return
+        if event["doctype"] == "User":
+            # Most User edits (and every customer portal user) have nothing to do with staff cards
+            known = {u["user_id"] for u in self._users.values()}
+            relevant = (any(r.get("custom_user_rfid") or r.get("name") in known for r in event["changed"])
+                        or any(n in known for n in event["deleted"]))
+        else:
+            relevant = True
+        if relevant:
+            self.refresh()
+
+    def invalidate(self) -> bool:
+        """
+        Reload after a failed verification (rate limited, and skipped while
+        failed reloads are backing off). Returns True if the directory was reloaded.
+        """
+        if time.monotonic() - self._last_reload_attempt < MIN_RELOAD_INTERVAL or not self._may_reload():
+            return False
+        return self.refresh()
+
+    def is_loaded(self) -> bool:
+        """Check if the directory holds data from a successful load."""
+        return self._loaded_at > 0
+
+    def find_user(self, rfid: str, roles: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Find the ERPNext User for an RFID card.
+        When roles are given, a user without any of them counts as a failed
+        verification and triggers a reload before the final answer.
+        """
+        self._ensure_fresh()
+        user = self._users.get(rfid)
+        if user is None or (roles and not any(r in user["roles"] for r in roles)):
+            if self.invalidate():
+                user = self._users.get(rfid)
+        return dict(user) if user else None
+
+    def find_staff(self, rfid: str, permission: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Find the active Gym Staff record for an RFID tag.
+        When a permission flag is given (e.g. can_promote), a staff member without
+        it counts as a failed verification and triggers a reload before the final answer.
+        """
+        self._ensure_fresh()
+        staff = self._staff.get(rfid)
+        if staff is None or (permission and not staff.get(permission)):
+            if self.invalidate():
+                staff = self._staff.get(rfid)
+        return dict(staff) if staff else None
+
+
+# Singleton instance
+_staff_directory = None
+
+
+def get_staff_directory() -> StaffDirectory:
+    """Get the staff directory singleton."""
+    global _staff_directory
+    if _staff_directory is None:
+        _staff_directory = StaffDirectory()
+        get_sync_engine().subscribe(STAFF_DOCTYPES, _staff_directory.apply)
+    return _staff_directory
@@ -0,0 +1,115 @@
+# app/utils/startup_profile.py
+"""
+Startup timing: how long the process spends importing, in each lifespan
+phase, and until its first request has been answered.
+The timings are always recorded (a few perf_counter calls) and summarized
+in one log line once the first request is served. Set PROFILE_STARTUP=1 to
+also log every phase as it finishes, with the modules it imported. For a
+per-module breakdown of the imports run `python -X importtime main.py`.
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+ENABLED = os.environ.get("PROFILE_STARTUP", "").lower() in ("1", "true", "yes")
+
+# Top-level packages imported by a phase that are listed in profile mode
+PROFILE_TOP_MODULES = 10
+
+
+class StartupProfile:
+    """Phase timings measured from the first import of main.py."""
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.phases: List[Dict[str, Any]] = []
+        self.ready_ms: Optional[float] = None
+        self.first_request_ms: Optional[float] = None
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._started) * 1000, 1)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time a block; records its duration and how many modules were imported
+        meanwhile (including by other threads, e.g. during the warm-up).
+        """
+        before = set(sys.modules) if ENABLED else None
+        module_count = len(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = {
+                "name": name,
+                "ms": round((time.perf_counter() - start) * 1000, 1),
+                "modules": len(sys.modules) - module_count,
+            }
+            with self._lock:
+                self.phases.append(entry)
+            if ENABLED:
+                new = sorted(set(sys.modules) - before)
+                top = sorted({m.split(".")[0] for m in new if not m.startswith("_")})[:PROFILE_TOP_MODULES]
+                print(f"[Startup] {name}: {entry['ms']} ms, {entry['modules']} modules"
+                      + (f" ({', '.join(top)})" if top else ""))
+
+    def mark_ready(self) -> None:
+        """The lifespan has finished; the server accepts requests from now on."""
+        self.ready_ms = self.elapsed_ms()
+        if ENABLED:
+            print(f"[Startup] Accepting requests after {self.ready_ms} ms")
+
+    def mark_first_request(self) -> None:
+        with self._lock:
+            if self.first_request_ms is not None:
+                return
+            self.first_request_ms = self.elapsed_ms()
+        imports = sum(p["ms"] for p in self.phases if p["name"].startswith("import"))
+        print(f"[Startup] First request served {self.first_request_ms} ms after start "
+              f"(imports {imports:.0f} ms, ready at {self.ready_ms} ms)")
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "phases": list(self.phases),
+                "ready_ms": self.ready_ms,
+                "first_request_ms": self.first_request_ms,
+                "uptime_ms": self.elapsed_ms(),
+            }
+
+
+class FirstRequestTimer:
+    """ASGI middleware that marks the first completed HTTP response, then only passes requests through."""
+
+    def __init__(self, app, profile: StartupProfile):
+        self.app = app
+        self.profile = profile
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.profile.first_request_ms is not None:
+            await self.app(scope, receive, send)
+            return
+
+        async def wrapped_send(message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                self.profile.mark_first_request()
+
+        await self.app(scope, receive, wrapped_send)
+
+
+# Singleton instance
+_profile = None
+
+
+def get_startup_profile() -> StartupProfile:
+    """Get the startup profile singleton."""
+    global _profile
+    if _profile is None:
+        _profile = StartupProfile()
+    return _profile
@@ -0,0 +1,372 @@
+# app/utils/sync_engine.py
+"""
+Change sync: tells in-process caches and mirrors what changed in ERPNext.
+Each subscribed doctype has a cursor, the (modified, name) of the last row
+delivered, persisted in SQLite. Every SYNC_INTERVAL seconds the rows past the
+cursor are pulled in pages ordered by (modified, name), published to the
+doctype's subscribers and the cursor is saved. A subscriber that raises does
+not stop the others, but the cursor stays where it was, so the page is
+delivered again on the next poll (subscribers apply events idempotently).
+A restart resumes from the saved cursor.
+
+`modified` never moves for a deleted record, so deletions are found by
+reconcile(): it compares the names ERPNext has with the names delivered so
+far, publishes the missing ones as deleted, and delivers any record the
+cursor skipped (e.g. restored with an old `modified`). Names alone can't
+show an edit that was never delivered, so resync() re-delivers every record
+nightly as a fallback.
+
+Subscribers receive one dict per event:
+    {"doctype": ..., "kind": "reset"}      forget this doctype (first sync, or another ERPNext)
+    {"doctype": ..., "kind": "changes", "changed": [records], "deleted": [names], "initial": bool}
+    {"doctype": ..., "kind": "loaded"}     the initial load has been delivered
+Changes with initial=True are the initial load or a full resync, which
+caches that load themselves can ignore.
+"""
+import json
+import threading
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Any, Optional, List, Iterator, Tuple
+
+import requests
+
+from .config import get_config
+from .db import connect, transaction
+from .erp_paging import CHILD_CHUNK_SIZE, attach_children, iter_doctype
+from .fast_json import loads
+
+SYNC_DB_FILE = Path(__file__).parent.parent.parent / "data" / "sync_state.sqlite3"
+
+# Seconds between change polls
+SYNC_INTERVAL = 30
+
+# Seconds between name-set reconciliations (deletion detection)
+RECONCILE_INTERVAL = 15 * 60
+
+# Rows per page when pulling changes
+SYNC_PAGE_SIZE = 500
+
+# A doctype polled successfully within this many seconds counts as live;
+# caches then rely on its change events instead of their TTL
+LIVE_WINDOW = SYNC_INTERVAL * 3
+
+Subscriber = Callable[[Dict[str, Any]], None]
+
+
+class SyncEngine:
+    """Per-doctype change cursors, polled on a schedule and published to subscribers."""
+
+    def __init__(self, path: Path = SYNC_DB_FILE):
+        self._path = path
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._children: Dict[str, Dict[str, str]] = {}
+        self._last_ok: Dict[str, float] = {}
+        self._failing = set()
+        self._initialized = False
+
+    def _connection(self):
+        """Get ERPNext URL and headers from configuration."""
+        config = get_config()
+        if not config.is_configured():
+            return None, None
+
+        erp_config = config.get_erpnext_config()
+        headers = {
+            'Authorization': f"token {erp_config.get('api_key', '')}:{erp_config.get('api_secret', '')}",
+            'Content-Type': 'application/json'
+        }
+        return erp_config.get('url', '').rstrip('/'), headers
+
+    def _db(self):
+        conn = connect(self._path)
+        if not self._initialized:
+            with transaction(conn):
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cursors (doctype TEXT PRIMARY KEY, url TEXT, modified TEXT, "
+                    "name TEXT, loaded INTEGER NOT NULL DEFAULT 0, reconciled_at REAL)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS names (doctype TEXT, name TEXT, PRIMARY KEY (doctype, name)) WITHOUT ROWID"
+                )
+            self._initialized = True
+        return conn
+
+    def subscribe(self, doctypes: List[str], callback: Subscriber,
+                  children: Optional[Dict[str, Tuple[str, str]]] = None) -> None:
+        """
+        Call callback with every event for doctypes. Subscribing starts the
+        sync of a doctype. children maps a doctype to (field, child doctype)
+        for child rows that should arrive inside its records.
+        """
+        with self._lock:
+            for doctype in doctypes:
+                self._subscribers.setdefault(doctype, []).append(callback)
+            for doctype, (field, child_doctype) in (children or {}).items():
+                self._children.setdefault(doctype, {})[field] = child_doctype
+
+    def _publish(self, event: Dict[str, Any]) -> None:
+        """
+        Deliver an event to every subscriber of its doctype. Raises once all
+        have been called if any failed, so the caller doesn't record the
+        event as delivered.
+        """
+        failed = []
+        for callback in list(self._subscribers.get(event["doctype"], [])):
+            try:
+                callback(event)
+            except Exception as e:
+                failed.append(getattr(callback, '__qualname__', str(callback)))
+                print(f"[Change-Sync] Subscriber {failed[-1]} failed on {event['doctype']} {event['kind']}: {e}")
+        if failed:
+            raise RuntimeError(f"{event['doctype']} {event['kind']} not delivered to {', '.join(failed)}")
+
+    def reset(self, doctypes: List[str]) -> None:
+        """Forget the cursors of doctypes; the next sync reloads them from the start."""
+        conn = self._db()
+        with transaction(conn):
+            for doctype in doctypes:
+                conn.execute("DELETE FROM cursors WHERE doctype = ?", (doctype,))
+                conn.execute("DELETE FROM names WHERE doctype = ?", (doctype,))
+
+    def _state(self, doctype: str) -> Optional[Dict[str, Any]]:
+        row = self._db().execute("SELECT * FROM cursors WHERE doctype = ?", (doctype,)).fetchone()
+        return dict(row) if row else None
+
+    def _save(self, doctype: str, state: Dict[str, Any], added: List[str] = (), removed: List[str] = ()) -> None:
+        conn = self._db()
+        with transaction(conn):
+            conn.execute(
+                "INSERT OR REPLACE INTO cursors VALUES (?, ?, ?, ?, ?, ?)",
+                (doctype, state["url"], state["modified"], state["name"], state["loaded"], state["reconciled_at"])
+            )
+            conn.executemany("INSERT OR IGNORE INTO names VALUES (?, ?)", [(doctype, n) for n in added])
+            conn.executemany("DELETE FROM names WHERE doctype = ? AND name = ?", [(doctype, n) for n in removed])
+
+    def _attach_children(self, url: str, headers: dict, doctype: str, records: List[Dict[str, Any]]) -> None:
+        """Fetch the child rows subscribers asked for and store them under their table field."""
+        attach_children(url, headers, doctype, records, self._children.get(doctype, {}))
+
+    def _pages(self, url: str, headers: dict, doctype: str, modified: Optional[str],
+               name: Optional[str]) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Pages of records past the (modified, name) cursor, in cursor order.
+        Frappe filters can't express "modified > m or (modified = m and
+        name > n)", so the rows tied on the cursor's `modified` are drained
+        by name before moving past it: at the start (a run may have stopped
+        inside a tie) and after every full page.
+        """
+        drain_ties = modified is not None and name is not None
+        while True:
+            if drain_ties:
+                ties = list(iter_doctype(url, headers, doctype, filters=[["modified", "=", modified], ["name", ">", name]],
+                                         page_size=SYNC_PAGE_SIZE))
+                if ties:
+                    yield ties
+                    name = ties[-1]["name"]
+
+            response = requests.get(
+                f"{url}/api/resource/{doctype}",
+                headers=headers,
+                params={
+                    "fields": '["*"]',
+                    "filters": json.dumps([["modified", ">", modified]] if modified else []),
+                    "order_by": "modified asc, name asc",
+                    "limit_page_length": SYNC_PAGE_SIZE
+                },
+                timeout=60
+            )
+            response.raise_for_status()
+            page = loads(response.content).get("data", [])
+            if not page:
+                return
+            yield page
+            if len(page) < SYNC_PAGE_SIZE:
+                return
+            modified, name = page[-1]["modified"], page[-1]["name"]
+            drain_ties = True
+
+    def _sync_doctype(self, url: str, headers: dict, doctype: str) -> int:
+        state = self._state(doctype)
+        if state is None or state["url"] != url:
+            self.reset([doctype])
+            state = {"url": url, "modified": None, "name": None, "loaded": 0, "reconciled_at": None}
+            self._publish({"doctype": doctype, "kind": "reset"})
+
+        initial = not state["loaded"]
+        delivered = 0
+        for page in self._pages(url, headers, doctype, state["modified"], state["name"]):
+            self._attach_children(url, headers, doctype, page)
+            self._publish({"doctype": doctype, "kind": "changes", "changed": page, "deleted": [], "initial": initial})
+            state["modified"], state["name"] = page[-1]["modified"], page[-1]["name"]
+            self._save(doctype, state, added=[r["name"] for r in page])
+            delivered += len(page)
+
+        if initial:
+            self._publish({"doctype": doctype, "kind": "loaded"})
+            state["loaded"] = 1
+            state["reconciled_at"] = time.time()
+            self._save(doctype, state)
+            print(f"[Change-Sync] Loaded {delivered} {doctype} records")
+        return delivered
+
+    def sync(self) -> Dict[str, Any]:
+        """
+        Pull and publish the changes of every subscribed doctype.
+        Returns rows delivered per doctype (an error message for a doctype
+        that failed), or {} if a sync or reconciliation is already running.
+        """
+        url, headers = self._connection()
+        if not url or not self._lock.acquire(blocking=False):
+            return {}
+        try:
+            results = {}
+            for doctype in list(self._subscribers):
+                try:
+                    results[doctype] = self._sync_doctype(url, headers, doctype)
+                    self._last_ok[doctype] = time.monotonic()
+                    if doctype in self._failing:
+                        self._failing.discard(doctype)
+                        print(f"[Change-Sync] {doctype} syncing again")
+                except Exception as e:
+                    results[doctype] = str(e)
+                    # Logged once per outage, not on every poll
+                    if doctype not in self._failing:
+                        self._failing.add(doctype)
+                        print(f"[Change-Sync] {doctype} sync failed: {e}")
+            return results
+        finally:
+            self._lock.release()
+
+    def _reconcile_doctype(self, url: str, headers: dict, doctype: str, state: Dict[str, Any]) -> Dict[str, int]:
+        remote = {r["name"] for r in iter_doctype(url, headers, doctype, fields=["name"], page_size=SYNC_PAGE_SIZE * 4)}
+        known = {row["name"] for row in self._db().execute("SELECT name FROM names WHERE doctype = ?", (doctype,))}
+        deleted = sorted(known - remote)
+        missing = sorted(remote - known)
+
+        if deleted:
+            self._publish({"doctype": doctype, "kind": "changes", "changed": [], "deleted": deleted, "initial": False})
+        for i in range(0, len(missing), CHILD_CHUNK_SIZE):
+            records = list(iter_doctype(url, headers, doctype, filters=[["name", "in", missing[i:i + CHILD_CHUNK_SIZE]]]))
+            self._attach_children(url, headers, doctype, records)
+            if records:
+                self._publish({"doctype": doctype, "kind": "changes", "changed": records, "deleted": [], "initial": False})
+                self._save(doctype, state, added=[r["name"] for r in records])
+
+        state["reconciled_at"] = time.time()
+        self._save(doctype, state, removed=deleted)
+        if deleted or missing:
+            print(f"[Change-Sync] Reconciled {doctype}: {len(deleted)} deleted, {len(missing)} missed")
+        return {"deleted": len(deleted), "missed": len(missing)}
+
+    def reconcile(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Find records deleted in ERPNext (and any the cursor skipped) by comparing
+        name sets, for every loaded doctype not reconciled in RECONCILE_INTERVAL.
+        """
+        url, headers = self._connection()
+        if not url or not self._lock.acquire(blocking=False):
+            return {}
+        try:
+            results = {}
+            for doctype in list(self._subscribers):
+                state = self._state(doctype)
+                if not state or not state["loaded"] or state["url"] != url:
+                    continue
+                if not force and time.time() - (state["reconciled_at"] or 0) < RECONCILE_INTERVAL:
+                    continue
+                try:
+                    results[doctype] = self._reconcile_doctype(url, headers, doctype, state)
+                except Exception as e:
+                    results[doctype] = str(e)
+                    print(f"[Change-Sync] {doctype} reconciliation failed: {e}")
+            return results
+        finally:
+            self._lock.release()
+
+    def _resync_doctype(self, url: str, headers: dict, doctype: str, state: Dict[str, Any]) -> Dict[str, int]:
+        known = {row["name"] for row in self._db().execute("SELECT name FROM names WHERE doctype = ?", (doctype,))}
+        remote = set()
+        records = iter_doctype(url, headers, doctype, page_size=SYNC_PAGE_SIZE)
+        while True:
+            page = list(islice(records, SYNC_PAGE_SIZE))
+            if not page:
+                break
+            self._attach_children(url, headers, doctype, page)
+            self._publish({"doctype": doctype, "kind": "changes", "changed": page, "deleted": [], "initial": True})
+            names = [r["name"] for r in page]
+            remote.update(names)
+            self._save(doctype, state, added=names)
+
+        deleted = sorted(known - remote)
+        if deleted:
+            self._publish({"doctype": doctype, "kind": "changes", "changed": [], "deleted": deleted, "initial": False})
+        state["reconciled_at"] = time.time()
+        self._save(doctype, state, removed=deleted)
+        print(f"[Change-Sync] Resynced {doctype}: {len(remote)} records, {len(deleted)} deleted")
+        return {"records": len(remote), "deleted": len(deleted)}
+
+    def resync(self) -> Dict[str, Any]:
+        """
+        Re-deliver every record of each loaded doctype and publish the ones
+        gone from ERPNext, repairing any change a subscriber missed. Cursors
+        are kept, and subscribers keep serving their data while it runs.
+        Waits for a running sync or reconciliation to finish.
+        """
+        url, headers = self._connection()
+        if not url:
+            return {}
+        with self._lock:
+            results = {}
+            for doctype in list(self._subscribers):
+                state = self._state(doctype)
+                if not state or not state["loaded"] or state["url"] != url:
+                    continue
+                try:
+                    results[doctype] = self._resync_doctype(url, headers, doctype, state)
+                except Exception as e:
+                    results[doctype] = str(e)
+                    print(f"[Change-Sync] {doctype} resync failed: {e}")
+            return results
+
+    def is_live(self, doctypes: List[str]) -> bool:
+        """Whether change events for every doctype are flowing (loaded and polled recently)."""
+        now = time.monotonic()
+        return all(now - self._last_ok.get(d, float("-inf")) < LIVE_WINDOW for d in doctypes)
+
+    def status(self) -> Dict[str, Any]:
+        """Cursor, delivered name count and liveness per doctype, for /metrics."""
+        try:
+            conn = self._db()
+            counts = dict(conn.execute("SELECT doctype, COUNT(*) FROM names GROUP BY doctype").fetchall())
+            states = {row["doctype"]: dict(row) for row in conn.execute("SELECT * FROM cursors")}
+        except Exception as e:
+            return {"error": str(e)}
+        now = time.monotonic()
+        return {
+            doctype: {
+                "subscribers": len(callbacks),
+                "loaded": bool(states.get(doctype, {}).get("loaded")),
+                "cursor": [states[doctype]["modified"], states[doctype]["name"]] if doctype in states else None,
+                "records": counts.get(doctype, 0),
+                "live": self.is_live([doctype]),
+                "last_poll_age_s": round(now - self._last_ok[doctype], 1) if doctype in self._last_ok else None,
+                "reconciled_age_s": round(time.time() - states[doctype]["reconciled_at"], 1)
+                if states.get(doctype, {}).get("reconciled_at") else None,
+            }
+            for doctype, callbacks in self._subscribers.items()
+        }
+
+
+# Singleton instance
+_sync_engine = None
+
+
+def get_sync_engine() -> SyncEngine:
+    """Get the sync engine singleton."""
+    global _sync_engine
+    if _sync_engine is None:
+        _sync_engine = SyncEngine()
+    return _sync_engine
@@ -0,0 +1,70 @@
+# app/utils/templating.py
+"""
+The one Jinja2 environment shared by every page.
+Routers import `templates` from here instead of building their own
+Jinja2Templates, so each template is parsed once per process. Compiled
+templates are also kept in a bytecode cache under data/, so a restarted
+process loads them instead of parsing the sources again, and precompile()
+can load them all at startup so the first page view after a deploy isn't
+the one that pays for it.
+"""
+import time
+from pathlib import Path
+from typing import Dict, Any
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from .assets import asset_url
+from .config import get_config
+
+TEMPLATE_DIR = Path(__file__).parent.parent / "templates"
+BYTECODE_CACHE_DIR = Path(__file__).parent.parent.parent / "data" / "jinja_cache"
+
+# Shown in page titles and headers
+GYM_NAME = "Invictus BJJ"
+
+
+def _bytecode_cache():
+    try:
+        BYTECODE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        return FileSystemBytecodeCache(str(BYTECODE_CACHE_DIR))
+    except OSError as e:
+        print(f"[Templates] Bytecode cache disabled: {e}")
+        return None
+
+
+def branding(request) -> Dict[str, Any]:
+    """Context processor: values that follow the configuration (set up at runtime)."""
+    config = get_config()
+    return {
+        "currency": config.get_currency(),
+        "company": config.get_company(),
+    }
+
+
+env = Environment(
+    loader=FileSystemLoader(str(TEMPLATE_DIR)),
+    autoescape=True,
+    bytecode_cache=_bytecode_cache(),
+    # Templates edited in place are still picked up (one stat per render)
+    auto_reload=True,
+)
+env.globals["asset_url"] = asset_url
+env.globals["gym_name"] = GYM_NAME
+
+templates = Jinja2Templates(env=env, context_processors=[branding])
+
+
+def precompile() -> int:
+    """Compile every template into the shared environment; returns the number compiled."""
+    started = time.monotonic()
+    count = 0
+    for name in env.list_templates(extensions=["html"]):
+        try:
+            env.get_template(name)
+            count += 1
+        except Exception as e:
+            print(f"[Templates] Failed to compile {name}: {e}")
+    print(f"[Templates] Precompiled {count} templates in {(time.monotonic() - started) * 1000:.0f} ms")
+    return count
@@ -1,13 +1,22 @@
 # main.py
-from fastapi import FastAPI, Request
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from contextlib import asynccontextmanager
+# Imported first so the startup timings include every other import
+from app.utils.startup_profile import get_startup_profile, FirstRequestTimer
 
-from app.routes import billing, attendance, customers, files, main, payment, overview, enrollment, handover, setup, settings, promotion, members
-from app.utils.config import get_config
+startup = get_startup_profile()
+
+with startup.phase("import framework"):
+    import threading
+    from fastapi import FastAPI, Request
+    from fastapi.responses import RedirectResponse
+    from contextlib import asynccontextmanager
+
+with startup.phase("import routers"):
+    from app.routes import billing, attendance, customers, files, main, payment, overview, enrollment, handover, setup, settings, promotion, members, health
+    from app.utils.config import get_config
+    from app.utils.fast_json import JSONResponse
+    from app.utils.http_middleware import ETagMiddleware, CompressionMiddleware
+    from app.utils.assets import StaticAssets, get_asset_manifest
+    from app.utils.templating import templates, precompile
 
 # Scheduler for automatic billing
 scheduler = None
@@ -25,15 +34,114 @@ def run_daily_billing():
         print(f"[Auto-Billing] Error: {e}")
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Startup and shutdown events."""
+def refresh_staff_directory():
+    """Reload the staff RFID directory so counter taps resolve locally (unless change sync keeps it current)."""
+    try:
+        from app.utils.staff_directory import get_staff_directory, STAFF_DOCTYPES
+        from app.utils.sync_engine import get_sync_engine
+        directory = get_staff_directory()
+        if not (directory.is_loaded() and get_sync_engine().is_live(STAFF_DOCTYPES)):
+            directory.refresh()
+    except Exception as e:
+        print(f"[Staff-Directory] Error: {e}")
+
+
+def run_nightly_backup():
+    """Write the nightly ERPNext backup snapshot (delta, or full when a new chain is due)."""
+    try:
+        from app.utils.config import get_config
+        if not get_config().is_configured():
+            return
+        from app.utils.erpnext_backup import get_backup_snapshots
+        get_backup_snapshots().take_snapshot("auto")
+    except Exception as e:
+        print(f"[Backup] Nightly snapshot error: {e}")
+
+
+def run_rank_progress_sweep():
+    """Rebuild member rank progress from ERPNext and correct promotion eligibility flags."""
+    try:
+        from app.utils.config import get_config
+        if not get_config().is_configured():
+            return
+        from app.services.rank_progress import get_rank_progress
+        get_rank_progress().sweep()
+    except Exception as e:
+        print(f"[Rank-Progress] Nightly sweep error: {e}")
+
+
+def ping_erpnext():
+    """Refresh the cached ERPNext ping used by /readyz."""
+    try:
+        from app.utils.health import get_health_monitor
+        get_health_monitor().ping()
+    except Exception as e:
+        print(f"[Health] Ping error: {e}")
+
+
+def sync_changes():
+    """Pull ERPNext changes and publish them to the read model, search index and caches."""
+    try:
+        from app.utils.read_model import get_read_model
+        from app.utils.search_index import get_search_index
+        from app.utils.sync_engine import get_sync_engine
+        # Subscribes the mirror and the search index, so they follow changes from the first sync
+        get_read_model()
+        search_index = get_search_index()
+        if not search_index.is_loaded():
+            search_index.refresh_in_background()
+        get_sync_engine().sync()
+    except Exception as e:
+        print(f"[Change-Sync] Sync error: {e}")
+
+
+def reconcile_changes():
+    """Publish records deleted in ERPNext, found by comparing name sets."""
+    try:
+        from app.utils.sync_engine import get_sync_engine
+        get_sync_engine().reconcile()
+    except Exception as e:
+        print(f"[Change-Sync] Reconciliation error: {e}")
+
+
+def resync_changes():
+    """Re-deliver every synced record, repairing changes a subscriber missed."""
+    try:
+        from app.utils.sync_engine import get_sync_engine
+        get_sync_engine().resync()
+    except Exception as e:
+        print(f"[Change-Sync] Resync error: {e}")
+
+
+def warm_up():
+    """
+    Hash static assets and compile templates ahead of their first use.
+    Runs beside the first requests instead of delaying them: anything a
+    request needs before this reaches it is hashed or compiled on demand.
+    """
+    with startup.phase("warm up assets"):
+        try:
+            get_asset_manifest().build()
+        except Exception as e:
+            print(f"[Assets] Failed to build manifest: {e}")
+
+    # Compile every template now rather than on each page's first view
+    if get_config().get("precompile_templates", True):
+        with startup.phase("warm up templates"):
+            precompile()
+
+
+def start_scheduler():
+    """Start the background jobs (billing, backups, sweeps, staff directory, change sync)."""
     global scheduler
 
-    # Start scheduler on startup
     try:
         from apscheduler.schedulers.background import BackgroundScheduler
         from apscheduler.triggers.cron import CronTrigger
+        from datetime import datetime
+        from app.utils.staff_directory import STAFF_CACHE_TTL
+        from app.utils.health import HEALTH_PING_INTERVAL
+        from app.utils.sync_engine import SYNC_INTERVAL, RECONCILE_INTERVAL
 
         scheduler = BackgroundScheduler()
         # Run billing daily at 6:00 AM
@@ -44,6 +152,73 @@ async def lifespan(app: FastAPI):
             name='Daily Membership Billing',
             replace_existing=True
         )
+        # Back up ERPNext nightly at 2:00 AM (incremental between weekly full backups)
+        scheduler.add_job(
+            run_nightly_backup,
+            CronTrigger(hour=2, minute=0),
+            id='nightly_backup',
+            name='Nightly ERPNext Backup',
+            replace_existing=True
+        )
+        # Rebuild rank progress nightly at 3:00 AM to correct any drift
+        scheduler.add_job(
+            run_rank_progress_sweep,
+            CronTrigger(hour=3, minute=0),
+            id='rank_progress_sweep',
+            name='Nightly Rank Progress Sweep',
+            replace_existing=True
+        )
+        # Preload the staff directory now and refresh it before it goes stale
+        scheduler.add_job(
+            refresh_staff_directory,
+            'interval',
+            seconds=max(STAFF_CACHE_TTL - 15, 15),
+            next_run_time=datetime.now(),
+            id='staff_directory',
+            name='Staff RFID Directory Refresh',
+            replace_existing=True
+        )
+        # Keep the ERPNext ping behind /readyz fresh
+        scheduler.add_job(
+            ping_erpnext,
+            'interval',
+            seconds=HEALTH_PING_INTERVAL,
+            next_run_time=datetime.now(),
+            id='erpnext_health',
+            name='ERPNext Health Ping',
+            replace_existing=True
+        )
+        # Publish ERPNext changes to the read model and caches (initial load on first run)
+        scheduler.add_job(
+            sync_changes,
+            'interval',
+            seconds=SYNC_INTERVAL,
+            next_run_time=datetime.now(),
+            id='change_sync',
+            name='ERPNext Change Sync',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+        # Detect deletions; each doctype is reconciled once per RECONCILE_INTERVAL
+        scheduler.add_job(
+            reconcile_changes,
+            'interval',
+            seconds=RECONCILE_INTERVAL // 3,
+            id='change_reconcile',
+            name='ERPNext Deletion Reconciliation',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+        # Full resync nightly at 4:00 AM as a fallback for anything the cursors missed
+        scheduler.add_job(
+            resync_changes,
+            CronTrigger(hour=4, minute=0),
+            id='change_resync',
+            name='Nightly ERPNext Full Resync',
+            replace_existing=True
+        )
         scheduler.start()
         print("[Scheduler] Auto-billing scheduler started (runs daily at 6:00 AM)")
     except ImportError:
@@ -51,6 +226,16 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"[Scheduler] Failed to start: {e}")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup and shutdown events."""
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+    with startup.phase("start scheduler"):
+        start_scheduler()
+    startup.mark_ready()
+
     yield
 
     # Shutdown scheduler
@@ -59,42 +244,62 @@ async def lifespan(app: FastAPI):
         print("[Scheduler] Shutdown complete")
 
 
-app = FastAPI(title="Invictus BJJ", lifespan=lifespan)
+app = FastAPI(title="Invictus BJJ", lifespan=lifespan, default_response_class=JSONResponse)
 
-# Initialize templates
-templates = Jinja2Templates(directory="app/templates")
+# Mount static files (fingerprinted names resolve to the current file)
+app.mount("/static", StaticAssets(directory="app/static", manifest=get_asset_manifest()), name="static")
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
+class SetupMiddleware:
+    """Middleware to redirect to setup page if app is not configured.
 
-class SetupMiddleware(BaseHTTPMiddleware):
-    """Middleware to redirect to setup page if app is not configured."""
+    Plain ASGI rather than BaseHTTPMiddleware: it sits inside the ETag and
+    compression middleware, and BaseHTTPMiddleware would re-stream every
+    response in chunks, hiding the complete body they need.
+    """
 
     # Paths that should be accessible without configuration
     ALLOWED_PATHS = [
+        '/healthz',
+        '/readyz',
+        '/metrics',
         '/setup',
         '/settings',
         '/static',
     ]
 
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
 
         # Allow setup and static paths without config check
         if any(path.startswith(allowed) for allowed in self.ALLOWED_PATHS):
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
 
         # Check if app is configured
         config = get_config()
         if not config.is_configured():
-            return RedirectResponse(url="/setup", status_code=302)
+            await RedirectResponse(url="/setup", status_code=302)(scope, receive, send)
+            return
 
-        return await call_next(request)
+        await self.app(scope, receive, send)
 
 
-# Add middleware
+# Add middleware (the last added runs first: compression wraps the ETag check)
 app.add_middleware(SetupMiddleware)
+app.add_middleware(ETagMiddleware)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(FirstRequestTimer, profile=startup)
+
+# Health checks (used by Docker, compose and nginx)
+app.include_router(health.router, tags=["health"])
 
 # Include setup router first (before other routers)
 app.include_router(setup.router, prefix="/setup", tags=["setup"])
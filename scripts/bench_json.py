@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Microbenchmark: stdlib json vs app.utils.fast_json on ERPNext-sized payloads.
+
+Usage (from the project root):
+    python scripts/bench_json.py [rows]
+
+Builds a list reply shaped like the overview/handover invoice queries and
+times decoding it, encoding an API response from it, and the old pattern of
+calling response.json() twice against the parse-once hook.
+"""
+import json
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.utils import fast_json  # noqa: E402
+
+
+def make_payload(rows: int) -> bytes:
+    rng = random.Random(42)
+    statuses = ["Unpaid", "Overdue", "Paid", "Partly Paid"]
+    data = [
+        {
+            "name": f"ACC-SINV-2026-{i:05d}",
+            "customer": f"Member {rng.randint(1, 400)}",
+            "customer_name": f"Member {rng.randint(1, 400)}",
+            "posting_date": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "due_date": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "grand_total": round(rng.uniform(50, 400), 2),
+            "outstanding_amount": round(rng.uniform(0, 400), 2),
+            "status": rng.choice(statuses),
+            "remarks": "Monthly membership fee - auto billed",
+        }
+        for i in range(rows)
+    ]
+    return json.dumps({"data": data}).encode("utf-8")
+
+
+class FakeResponse:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def json(self, **kwargs):
+        return json.loads(self.content)
+
+
+def bench(label: str, fn, number: int) -> float:
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"  {label:<34} {seconds * 1000:8.2f} ms")
+    return seconds
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    payload = make_payload(rows)
+    parsed = json.loads(payload)
+    number = max(1, 20000 // rows)
+
+    print(f"Payload: {rows} rows, {len(payload) / 1024:.0f} KiB, fast backend: {fast_json.BACKEND}")
+
+    print("Decode ERPNext reply")
+    slow = bench("stdlib json.loads", lambda: json.loads(payload), number)
+    fast = bench("fast_json.loads", lambda: fast_json.loads(payload), number)
+    print(f"  speedup x{slow / fast:.1f}")
+
+    print("Encode API response")
+    slow = bench("JSONResponse (stdlib)", lambda: json.dumps(
+        parsed, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8"), number)
+    fast = bench("fast_json.dumps", lambda: fast_json.dumps(parsed), number)
+    print(f"  speedup x{slow / fast:.1f}")
+
+    print("response.json() called twice")
+
+    def twice_stdlib():
+        response = FakeResponse(payload)
+        response.json()
+        response.json()
+
+    def twice_parse_once():
+        response = fast_json.parse_once(FakeResponse(payload))
+        response.json()
+        response.json()
+
+    slow = bench("stdlib, parsed twice", twice_stdlib, number)
+    fast = bench("parse_once hook", twice_parse_once, number)
+    print(f"  speedup x{slow / fast:.1f}")
+
+
+if __name__ == "__main__":
+    main()
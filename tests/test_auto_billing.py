@@ -0,0 +1,59 @@
+# tests/test_auto_billing.py
+"""
+Auto-billing must never create a second invoice for a period when it can't
+tell whether an earlier attempt already created one.
+"""
+import pytest
+
+from app.services import auto_billing
+from app.services.auto_billing import AutoBillingService
+from app.services.billing_ledger import BillingLedger
+
+MEMBER = {"name": "MEM-1", "full_name": "Ana", "current_membership_type": "Monthly",
+          "next_billing_date": "2026-10-01", "customer": "CUST-1"}
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(auto_billing, "get_billing_ledger", lambda: BillingLedger(tmp_path / "ledger.json"))
+    monkeypatch.setattr(auto_billing.time, "sleep", lambda seconds: None)
+    service = AutoBillingService()
+    monkeypatch.setattr(service, "_setup_connection", lambda: True)
+    monkeypatch.setattr(service, "get_members_due_for_billing", lambda: [dict(MEMBER)])
+    monkeypatch.setattr(service, "get_membership_type_details", lambda name: {"name": name, "is_recurring": 1})
+    monkeypatch.setattr(service, "update_next_billing_date", lambda *args: True)
+    service.created = []
+    service.lookups = []
+
+    def create(member, membership_type, billing_period=None):
+        service.created.append(member["name"])
+        # ERPNext saved the invoice, but the reply never arrived
+        return False, "Read timed out", None
+
+    monkeypatch.setattr(service, "create_sales_invoice", create)
+    return service
+
+
+def test_failed_lookup_never_creates_another_invoice(service, monkeypatch):
+    monkeypatch.setattr(service, "find_existing_invoice", lambda *args: service.lookups.append(args) or (False, None))
+
+    results = service.run_billing_cycle()
+
+    assert service.created == ["MEM-1"]
+    assert len(service.lookups) == auto_billing.MAX_INVOICE_ATTEMPTS - 1
+    assert results["invoices_created"] == 0
+    assert results["errors"]
+
+
+def test_next_run_checks_before_billing(service, monkeypatch):
+    monkeypatch.setattr(service, "find_existing_invoice", lambda *args: (False, None))
+    service.run_billing_cycle()
+    assert service.ledger.interrupted_members() == ["MEM-1"]
+
+    # The next day ERPNext answers: the invoice from the timed-out attempt exists
+    monkeypatch.setattr(service, "find_existing_invoice", lambda *args: (True, "SINV-1"))
+    results = service.run_billing_cycle()
+
+    assert service.created == ["MEM-1"]
+    assert results["invoices_created"] == 1
+    assert service.ledger.get("MEM-1", "2026-10-01")["invoice"] == "SINV-1"
@@ -0,0 +1,100 @@
+# tests/test_erp_resilience.py
+"""
+Circuit breaker probes: whatever a half-open probe ends in, the breaker
+must be able to let the next probe through. While it is open, only
+reference data may be answered from the stale cache.
+"""
+import pytest
+import requests
+
+from app.utils import erp_resilience
+from app.utils.erp_resilience import CircuitOpenError, ResilientSession
+
+URL = "http://erpnext.test/api/resource/Customer"
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(erp_resilience, "_breakers", {})
+    monkeypatch.setattr(erp_resilience, "_stale_cache", erp_resilience.StaleCache())
+    monkeypatch.setattr(erp_resilience.time, "sleep", lambda seconds: None)
+    breaker = erp_resilience.get_breaker(URL)
+    # Open long enough ago that the next request is the half-open probe
+    breaker.state, breaker.opened_at = "open", -erp_resilience.OPEN_SECONDS
+    return breaker
+
+
+def ok_response():
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'{"data": []}'
+    return response
+
+
+def replies(monkeypatch, *outcomes):
+    """Make the underlying session return or raise each outcome in turn."""
+    queue = list(outcomes)
+
+    def request(self, method, url, *args, **kwargs):
+        outcome = queue.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(requests.Session, "request", request)
+
+
+def test_truncated_probe_reopens_breaker(breaker, monkeypatch):
+    replies(monkeypatch, requests.exceptions.ChunkedEncodingError("truncated"))
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        ResilientSession().get(URL)
+    assert breaker.state == "open"
+    assert not breaker._probing
+
+
+def test_unrelated_probe_error_releases_probe(breaker, monkeypatch):
+    replies(monkeypatch, requests.TooManyRedirects("loop"), ok_response())
+    with pytest.raises(requests.TooManyRedirects):
+        ResilientSession().get(URL)
+    assert not breaker._probing
+
+    # The next request probes again instead of failing fast forever
+    assert ResilientSession().get(URL).status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_open_breaker_fails_fast(breaker, monkeypatch):
+    breaker.opened_at = erp_resilience.time.monotonic()
+    replies(monkeypatch)
+    with pytest.raises(CircuitOpenError):
+        ResilientSession().get(URL)
+
+
+@pytest.mark.parametrize("url, served", [
+    ("http://erpnext.test/api/resource/Belt Rank", True),
+    ("http://erpnext.test/api/resource/Sales%20Invoice/SINV-1", False),
+    ("http://erpnext.test/api/resource/Payment Entry", False),
+])
+def test_only_reference_data_is_served_stale(breaker, monkeypatch, url, served):
+    breaker.state = "closed"
+    replies(monkeypatch, ok_response())
+    ResilientSession().get(url)
+
+    breaker.state, breaker.opened_at = "open", erp_resilience.time.monotonic()
+    if served:
+        assert erp_resilience.STALE_HEADER in ResilientSession().get(url).headers
+    else:
+        with pytest.raises(CircuitOpenError):
+            ResilientSession().get(url)
+
+
+def test_invoice_lists_are_not_served_stale(breaker, monkeypatch):
+    url = "http://erpnext.test/api/method/frappe.client.get_list"
+    params = {"doctype": "Sales Invoice", "filters": "{}"}
+    breaker.state = "closed"
+    replies(monkeypatch, ok_response())
+    ResilientSession().get(url, params=params)
+
+    breaker.state, breaker.opened_at = "open", erp_resilience.time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        ResilientSession().get(url, params=params)
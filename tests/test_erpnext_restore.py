@@ -0,0 +1,146 @@
+# tests/test_erpnext_restore.py
+"""
+A backup must restore into an empty ERPNext: documents keep their child
+rows, and links survive ERPNext giving naming-series records new names.
+"""
+import gzip
+import json
+
+import pytest
+
+from app.utils import erpnext_backup, erpnext_restore
+from app.utils.erpnext_restore import ERPNextRestore
+
+META = {
+    "Customer": {"autoname": "field:customer_name", "fields": []},
+    "Gym Member": {"autoname": "naming_series:", "fields": [
+        {"fieldname": "customer", "fieldtype": "Link", "options": "Customer"},
+        {"fieldname": "parent_member", "fieldtype": "Link", "options": "Gym Member"},
+    ]},
+    "Sales Invoice": {"autoname": "naming_series:", "fields": [
+        {"fieldname": "customer", "fieldtype": "Link", "options": "Customer"},
+        {"fieldname": "items", "fieldtype": "Table", "options": "Sales Invoice Item"},
+    ]},
+    "Sales Invoice Item": {"fields": [{"fieldname": "item_code", "fieldtype": "Link", "options": "Item"}]},
+    "Payment Entry": {"autoname": "naming_series:", "fields": [
+        {"fieldname": "references", "fieldtype": "Table", "options": "Payment Entry Reference"},
+    ]},
+    "Payment Entry Reference": {"fields": [
+        {"fieldname": "reference_doctype", "fieldtype": "Link", "options": "DocType"},
+        {"fieldname": "reference_name", "fieldtype": "Dynamic Link", "options": "reference_doctype"},
+    ]},
+}
+
+CHILDREN = {
+    "Sales Invoice Item": [{"name": "row1", "parent": "SINV-OLD-1", "parenttype": "Sales Invoice",
+                            "parentfield": "items", "idx": 1, "item_code": "Monthly", "qty": 1}],
+    "Payment Entry Reference": [{"name": "row2", "parent": "PAY-OLD-1", "reference_doctype": "Sales Invoice",
+                                 "reference_name": "SINV-OLD-1", "allocated_amount": 50}],
+}
+
+
+class Reply:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.text = json.dumps(payload)
+        self.content = self.text.encode()
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+class FakeERPNext:
+    """Names naming-series records itself, as ERPNext does on insert."""
+
+    def __init__(self):
+        self.docs = {}
+        self.counter = 0
+
+    def _insert(self, doc):
+        if META[doc["doctype"]]["autoname"].startswith("naming_series"):
+            self.counter += 1
+            doc = {**doc, "name": f"NEW-{self.counter}"}
+        self.docs.setdefault(doc["doctype"], {})[doc["name"]] = doc
+        return doc
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        doctype = params["doctype"]
+        if url.endswith("getdoctype"):
+            children = [f["options"] for f in META[doctype]["fields"] if f["fieldtype"] == "Table"]
+            return Reply({"docs": [{"name": d, **META[d]} for d in [doctype] + children]})
+        return Reply({"message": CHILDREN.get(doctype, [])})
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        if url.endswith("insert_many"):
+            for doc in json["docs"]:
+                self._insert(doc)
+            return Reply({"message": []})
+        return Reply({"data": self._insert(json)})
+
+
+@pytest.fixture
+def erpnext(monkeypatch):
+    erp = FakeERPNext()
+    for module in (erpnext_backup, erpnext_restore):
+        monkeypatch.setattr(module.requests, "get", erp.get)
+        monkeypatch.setattr(module.requests, "post", erp.post)
+    return erp
+
+
+def restore_backup(tmp_path, monkeypatch, records, version="2.1.0"):
+    path = tmp_path / "backup.ndjson.gz"
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps({"type": "header", "app": erpnext_backup.BACKUP_APP, "version": version}) + "\n")
+        for doctype, record in records:
+            f.write(json.dumps({"type": "record", "doctype": doctype, "data": record}) + "\n")
+
+    restore = ERPNextRestore(tmp_path)
+    monkeypatch.setattr(restore, "_connection", lambda: ("http://erp", {}))
+    restore.start(path)
+    restore._thread.join()
+    return restore.get_status()
+
+
+def test_backup_includes_child_rows(erpnext):
+    records = [{"name": "SINV-OLD-1", "customer": "Ana"}]
+    erpnext_backup.attach_children("http://erp", {}, "Sales Invoice", records,
+                                   erpnext_backup.BACKUP_CHILD_TABLES["Sales Invoice"])
+    assert records[0]["items"][0]["item_code"] == "Monthly"
+
+
+def test_restore_relinks_renamed_records(tmp_path, monkeypatch, erpnext):
+    invoice = {"name": "SINV-OLD-1", "customer": "Ana", "docstatus": 1, "taxes": [],
+               "items": CHILDREN["Sales Invoice Item"]}
+    payment = {"name": "PAY-OLD-1", "docstatus": 1, "deductions": [],
+               "references": CHILDREN["Payment Entry Reference"]}
+    status = restore_backup(tmp_path, monkeypatch, [
+        ("Payment Entry", payment),
+        ("Sales Invoice", invoice),
+        ("Gym Member", {"name": "GYM-OLD-1", "customer": "Ana"}),
+        ("Gym Member", {"name": "GYM-OLD-2", "customer": "Ana", "parent_member": "GYM-OLD-1"}),
+        ("Customer", {"name": "Ana", "customer_name": "Ana"}),
+    ])
+
+    assert status["state"] == "completed" and not status["errors"]
+    members = {m.get("parent_member"): m["name"] for m in erpnext.docs["Gym Member"].values()}
+    assert erpnext.docs["Gym Member"][members[None]]["customer"] == "Ana"
+    assert set(members) == {None, members[None]}
+
+    new_invoice, = erpnext.docs["Sales Invoice"].values()
+    assert new_invoice["items"] == [{"item_code": "Monthly", "qty": 1}]
+    new_payment, = erpnext.docs["Payment Entry"].values()
+    assert new_payment["references"][0]["reference_name"] == new_invoice["name"]
+
+
+def test_backup_without_child_rows_is_rejected(tmp_path, monkeypatch, erpnext):
+    status = restore_backup(tmp_path, monkeypatch, [
+        ("Sales Invoice", {"name": "SINV-OLD-1", "customer": "Ana", "docstatus": 1}),
+    ], version="2.0.0")
+
+    assert "Sales Invoice" not in erpnext.docs
+    assert status["failed"]["Sales Invoice"] == 1
+    assert "take a new backup" in status["errors"][0]
@@ -0,0 +1,218 @@
+# tests/test_field_projections.py
+"""
+Views may only read the columns their FIELD_PROJECTIONS entry requests.
+Each view runs against a fake ERPNext that answers list queries with the
+projected columns only, in records that log every other key a view reads.
+"""
+import asyncio
+import json
+
+import pytest
+
+from app.routes import overview
+from app.services import billing_service, handover_service
+from app.services.billing_service import BillingService
+from app.services.handover_service import HandoverService
+from app.services.payment_service import PaymentService
+from app.utils import erp_client as erp
+from app.utils.erp_client import ERPNextClient, FIELD_PROJECTIONS
+
+
+def sample_value(field):
+    """A plausible value for a column, so views get past their parsing."""
+    if field in ("creation", "received_at", "transferred_at") or field.endswith("_time"):
+        return "2026-01-15 10:00:00"
+    if "date" in field:
+        return "2026-01-15"
+    if any(word in field for word in ("amount", "total", "fee")):
+        return 10.0
+    if field == "custom_attendance":
+        return "[]"
+    if field == "status":
+        return "Unpaid"
+    return f"{field}-1"
+
+
+class ProjectedRecord(dict):
+    """A list row holding a view's columns; reads of any other key are logged."""
+
+    def __init__(self, view, unprojected):
+        super().__init__({field: sample_value(field) for field in FIELD_PROJECTIONS[view]})
+        self._view = view
+        self._unprojected = unprojected
+
+    def _check(self, key):
+        if key not in self:
+            self._unprojected.append((self._view, key))
+
+    def __getitem__(self, key):
+        self._check(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._check(key)
+        return super().get(key, default)
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self._payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeERPNext:
+    """Session answering projected list queries with one ProjectedRecord, and single documents with a stub."""
+
+    def __init__(self):
+        self.headers = {}
+        self.views = set()
+        self.unprojected = []
+        self._by_fields = {json.dumps(fields): view for view, fields in FIELD_PROJECTIONS.items()}
+
+    def get(self, url, params=None, **kwargs):
+        fields = (params or {}).get("fields")
+        if fields is None:
+            # A single document (payment detail, user) is fetched whole
+            return FakeResponse({"data": {"name": url.rsplit("/", 1)[-1]}})
+
+        view = self._by_fields.get(fields)
+        rows = []
+        if view is not None:
+            self.views.add(view)
+            rows = [ProjectedRecord(view, self.unprojected)]
+        key = "data" if "/api/resource/" in url else "message"
+        return FakeResponse({key: rows})
+
+
+class EmptyReadModel:
+    def get_list(self, *args, **kwargs):
+        return None
+
+
+class TemplateContext:
+    def TemplateResponse(self, name, context):
+        return context
+
+
+@pytest.fixture
+def erpnext(monkeypatch):
+    for module in (billing_service, handover_service, overview):
+        monkeypatch.setattr(module, "get_read_model", EmptyReadModel)
+    monkeypatch.setattr(overview, "templates", TemplateContext())
+    monkeypatch.setattr(erp, "_family_group_cache", {"groups": None, "base_url": None, "loaded_at": 0.0})
+    monkeypatch.setattr(erp, "_unprojected_views", {})
+
+    client = ERPNextClient("http://erpnext.test", "key", "secret")
+    client.session = FakeERPNext()
+    return client
+
+
+def test_customer_billing_reads_only_projected_fields(erpnext):
+    asyncio.run(BillingService(erpnext).get_customer_billing("customer_name-1"))
+
+    assert erpnext.session.views == {"customer", "billing_invoices"}
+    assert erpnext.session.unprojected == []
+
+
+def test_payment_scan_reads_only_projected_fields(erpnext):
+    result = asyncio.run(PaymentService(erpnext).process_initial_scan("rfid-1"))
+
+    assert result["invoices"]
+    assert erpnext.session.views == {"customer", "invoice_selection"}
+    assert erpnext.session.unprojected == []
+
+
+def test_customer_transactions_read_only_projected_fields(erpnext):
+    assert erpnext.get_customer_transactions("customer-1")
+
+    assert erpnext.session.views == {"customer_transactions"}
+    assert erpnext.session.unprojected == []
+
+
+def test_overview_reads_only_projected_fields(erpnext):
+    context = asyncio.run(overview.get_overview(request=None, days=7, erp_client=erpnext))
+
+    assert context["recent_payments"]
+    assert erpnext.session.views == {"overview_invoices", "overview_payments", "customer"}
+    assert erpnext.session.unprojected == []
+
+
+def test_overview_loads_customers_in_one_request(erpnext, monkeypatch):
+    invoices = [{"name": f"SINV-{i}", "customer": f"customer-{i}", "due_date": "2026-01-15",
+                 "grand_total": 10.0, "outstanding_amount": 10.0} for i in range(30)]
+
+    class ReadModel:
+        def get_list(self, doctype, *args, **kwargs):
+            return invoices if doctype == "Sales Invoice" else []
+
+    monkeypatch.setattr(overview, "get_read_model", ReadModel)
+    session_get = erpnext.session.get
+    customer_queries = []
+
+    def get(url, params=None, **kwargs):
+        if url.endswith("/Customer"):
+            customer_queries.append(params)
+        return session_get(url, params=params, **kwargs)
+
+    erpnext.session.get = get
+    context = asyncio.run(overview.get_overview(request=None, days=7, erp_client=erpnext))
+
+    assert len(context["invoices"]["overdue"]) == 30
+    assert len(customer_queries) == 1
+
+
+def test_handovers_read_only_projected_fields(erpnext):
+    service = HandoverService(erpnext)
+    assert asyncio.run(service.get_pending_handovers())
+    assert asyncio.run(service.get_payment_history())
+
+    assert erpnext.session.views == {"handover_payments", "payment_handovers"}
+    assert erpnext.session.unprojected == []
+
+
+class RejectingERPNext:
+    """Session whose projected list queries fail with a given error; fields ["*"] succeeds."""
+
+    def __init__(self, status_code, error):
+        self.headers = {}
+        self.status_code = status_code
+        self.error = error
+        self.fields = []
+
+    def get(self, url, params=None, **kwargs):
+        self.fields.append(params["fields"])
+        if params["fields"] == '["*"]':
+            return FakeResponse({"data": []})
+        return FakeResponse({"exception": self.error}, self.status_code)
+
+
+def test_transient_error_does_not_drop_the_projection(erpnext):
+    erpnext.session = RejectingERPNext(500, "pymysql.err.OperationalError: (1213, 'Deadlock found')")
+
+    response = erpnext.get_projected("http://erpnext.test/api/resource/Customer", {}, "customer")
+
+    assert response.status_code == 500
+    assert erpnext.session.fields == [json.dumps(FIELD_PROJECTIONS["customer"])]
+    assert erp.projection("customer") == json.dumps(FIELD_PROJECTIONS["customer"])
+
+
+@pytest.mark.parametrize("status_code, error", [
+    (500, "pymysql.err.OperationalError: (1054, \"Unknown column 'custom_customer_rfid' in 'field list'\")"),
+    (403, "frappe.exceptions.PermissionError: Field not permitted in query: custom_attendance"),
+])
+def test_rejected_projection_falls_back_until_retry_interval(erpnext, monkeypatch, status_code, error):
+    erpnext.session = RejectingERPNext(status_code, error)
+
+    response = erpnext.get_projected("http://erpnext.test/api/resource/Customer", {}, "customer")
+
+    assert response.status_code == 200
+    assert erpnext.session.fields[-1] == '["*"]'
+    assert erp.projection("customer") == '["*"]'
+
+    # The projection is tried again once the retry interval has passed
+    erp._unprojected_views["customer"] -= erp.PROJECTION_RETRY_INTERVAL
+    assert erp.projection("customer") == json.dumps(FIELD_PROJECTIONS["customer"])
@@ -0,0 +1,69 @@
+# tests/test_handovers.py
+"""
+A payment that was handed over must never be listed as pending again: all
+handovers are loaded, and a failure to load them is an error, not an empty list.
+"""
+import asyncio
+import json
+
+import pytest
+
+from app.services import handover_service
+from app.services.handover_service import HandoverService
+
+PAYMENTS = {f"PAY-{i:03d}": {"name": f"PAY-{i:03d}", "party": "CUST-1", "paid_amount": 10.0,
+                             "payment_type": "Receive", "docstatus": 1, "references": []}
+            for i in range(30)}
+
+
+class Reply:
+    def __init__(self, payload, status_code=200):
+        self._payload = payload
+        self.status_code = status_code
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self._payload
+
+
+class Session:
+    """ERPNext holding a handover for every payment; honours Frappe's default page length."""
+
+    def __init__(self, handovers_status=200):
+        self.handovers_status = handovers_status
+
+    def get(self, url, params=None, **kwargs):
+        if params and params.get("doctype") == "Payment Handover":
+            rows = [{"payment_entry": name} for name in PAYMENTS]
+            limit = params.get("limit_page_length", 20)
+            return Reply({"message": rows[:limit] if limit else rows}, self.handovers_status)
+        return Reply({"data": {"full_name": "Coach"}})
+
+
+class Client:
+    base_url = "http://erpnext.test"
+
+    def __init__(self, session):
+        self.session = session
+
+
+class Mirror:
+    def get_list(self, doctype, filters=None, order_by=None, limit=None):
+        excluded = next(value for field, operator, value in filters if operator == "not in")
+        return [p for name, p in PAYMENTS.items() if name not in excluded]
+
+
+@pytest.fixture(autouse=True)
+def mirror(monkeypatch):
+    monkeypatch.setattr(handover_service, "get_read_model", Mirror)
+
+
+def test_handed_over_payments_are_not_pending():
+    service = HandoverService(Client(Session()))
+    assert asyncio.run(service.get_pending_handovers()) == []
+
+
+def test_failed_handover_lookup_is_an_error():
+    service = HandoverService(Client(Session(handovers_status=502)))
+    with pytest.raises(RuntimeError):
+        asyncio.run(service.get_pending_handovers())
@@ -0,0 +1,97 @@
+# tests/test_http_middleware.py
+"""
+ETags and compression through the same middleware stack main.py builds, so
+a middleware that re-streams bodies (as BaseHTTPMiddleware does) shows up
+as missing ETags or uncompressed responses.
+"""
+import asyncio
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import main
+from app.utils.http_middleware import ETagMiddleware, CompressionMiddleware
+
+LARGE = {"members": [{"name": f"Member {i}", "status": "Active"} for i in range(200)]}
+
+
+def build_app():
+    app = Starlette(routes=[
+        Route("/large", lambda request: JSONResponse(LARGE)),
+        Route("/small", lambda request: JSONResponse({"ok": True})),
+        Route("/text", lambda request: PlainTextResponse("x" * 10)),
+    ])
+    app.add_middleware(main.SetupMiddleware)
+    app.add_middleware(ETagMiddleware)
+    app.add_middleware(CompressionMiddleware)
+    return app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    class Configured:
+        def is_configured(self):
+            return True
+
+    monkeypatch.setattr(main, "get_config", lambda: Configured())
+    return TestClient(build_app())
+
+
+def test_etag_and_not_modified(client):
+    first = client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    second = client.get("/large", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.content == b""
+
+
+def test_large_body_compressed_small_body_not(client):
+    large = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert large.headers["content-encoding"] == "gzip"
+    assert large.json() == LARGE
+
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert small.json() == {"ok": True}
+
+
+def test_unconfigured_app_redirects_to_setup(monkeypatch):
+    class Unconfigured:
+        def is_configured(self):
+            return False
+
+    monkeypatch.setattr(main, "get_config", lambda: Unconfigured())
+    response = TestClient(build_app()).get("/large", follow_redirects=False)
+    assert response.status_code == 302
+    assert response.headers["location"] == "/setup"
+
+
+@pytest.mark.parametrize("middleware", [ETagMiddleware, CompressionMiddleware])
+def test_extension_messages_pass_through(middleware):
+    async def app(scope, receive, send):
+        # Template responses send this before the response starts
+        await send({"type": "http.response.debug", "info": {}})
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    scope = {"type": "http", "method": "GET", "path": "/",
+             "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(middleware(app)(scope, receive, send))
+
+    types = [message["type"] for message in sent]
+    assert types == ["http.response.debug", "http.response.start", "http.response.body"]
+    assert sent[-1]["body"] == b"{}"
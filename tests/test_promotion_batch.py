@@ -0,0 +1,108 @@
+# tests/test_promotion_batch.py
+"""
+A ceremony batch whose ERPNext reply is lost must still finish every
+member, and a coach retrying it must not write their rank history twice.
+"""
+import json
+
+import pytest
+import requests
+
+from app.services import promotion_batch
+
+ITEMS = [{"member_id": f"MEM-{i}", "action": "promote", "new_rank_id": "Blue"} for i in range(3)]
+
+
+class Reply:
+    def __init__(self, payload, status_code=200):
+        self._payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.status_code)
+
+
+class FakeERPNext:
+    """Commits insert_many and bulk_update, then times out before replying."""
+
+    def __init__(self):
+        self.histories = []
+        self.members = {}
+        self.single_inserts = 0
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        members = json.loads(params["filters"])[0][2]
+        return Reply({"data": [h for h in self.histories if h["member"] in members]})
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        if url.endswith("insert_many"):
+            self.histories.extend(json["docs"])
+            raise requests.exceptions.ReadTimeout("Read timed out")
+        if url.endswith("bulk_update"):
+            raise requests.exceptions.ConnectionError("Connection reset")
+        self.single_inserts += 1
+        self.histories.append(json)
+        return Reply({"data": json})
+
+    def put(self, url, headers=None, json=None, timeout=None):
+        self.members[url.rsplit("/", 1)[-1]] = json
+        return Reply({"data": json})
+
+
+class Progress:
+    def __init__(self):
+        self.promoted = []
+
+    def refresh_members(self, member_ids, today):
+        return {m: {"full_name": m, "current_rank": "White", "current_stripes": 2,
+                    "days_at_current_rank": 120, "rank": {"stripes_available": 4}} for m in member_ids}
+
+    def record_promotion(self, member_id, rank, today):
+        self.promoted.append(member_id)
+
+
+class Ranks:
+    def get(self, rank_id):
+        return {"name": rank_id, "rank_name": rank_id, "is_active": 1}
+
+
+class Mirror:
+    def update(self, doctype, name, values):
+        pass
+
+
+@pytest.fixture
+def erpnext(monkeypatch):
+    erp = FakeERPNext()
+    for method in ("get", "post", "put"):
+        monkeypatch.setattr(promotion_batch.requests, method, getattr(erp, method))
+    monkeypatch.setattr(promotion_batch, "get_rank_table", Ranks)
+    monkeypatch.setattr(promotion_batch, "get_read_model", Mirror)
+    return erp
+
+
+def test_lost_replies_still_finish_every_member(erpnext, monkeypatch):
+    progress = Progress()
+    monkeypatch.setattr(promotion_batch, "get_rank_progress", lambda: progress)
+
+    results = promotion_batch.apply_batch("http://erp", {}, "COACH-1", ITEMS)
+
+    assert all(r["success"] for r in results)
+    assert len(erpnext.histories) == 3 and erpnext.single_inserts == 0
+    assert sorted(erpnext.members) == ["MEM-0", "MEM-1", "MEM-2"]
+    assert progress.promoted == ["MEM-0", "MEM-1", "MEM-2"]
+
+
+def test_retry_does_not_duplicate_history(erpnext, monkeypatch):
+    monkeypatch.setattr(promotion_batch, "get_rank_progress", Progress)
+    promotion_batch.apply_batch("http://erp", {}, "COACH-1", ITEMS)
+
+    # The coach saw an error and sends the same batch again
+    results = promotion_batch.apply_batch("http://erp", {}, "COACH-1", ITEMS)
+
+    assert all(r["success"] for r in results)
+    assert len(erpnext.histories) == 3
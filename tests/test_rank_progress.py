@@ -0,0 +1,71 @@
+# tests/test_rank_progress.py
+"""
+Gym Member edits made in ERPNext must reach rank progress through change
+sync, so promotion candidates don't wait for the nightly sweep.
+"""
+from datetime import date
+
+import pytest
+
+from app.services import rank_progress
+from app.services.rank_progress import RankProgress
+
+TODAY = date(2026, 10, 18)
+
+
+class Ranks:
+    version = 1
+    RANKS = {"White": {"name": "White", "rank_name": "White", "days_required": 100},
+             "Blue": {"name": "Blue", "rank_name": "Blue", "days_required": 300}}
+
+    def get(self, rank_id):
+        return self.RANKS.get(rank_id)
+
+    def next_rank(self, rank_id):
+        return self.RANKS["Blue"] if rank_id == "White" else None
+
+
+def member(name, rank="White", days=120, rfid=None):
+    return {"name": name, "full_name": name, "status": "Active", "payment_status": "Current",
+            "current_rank": rank, "current_stripes": 0, "days_at_current_rank": days,
+            "total_training_days": days, "rfid_tag": rfid}
+
+
+def changes(changed=(), deleted=(), initial=False):
+    return {"doctype": "Gym Member", "kind": "changes", "changed": list(changed),
+            "deleted": list(deleted), "initial": initial}
+
+
+@pytest.fixture
+def progress(tmp_path, monkeypatch):
+    monkeypatch.setattr(rank_progress, "get_rank_table", Ranks)
+    progress = RankProgress(tmp_path / "rank_progress.json")
+    progress._loaded = True
+    progress._swept_at = "2026-10-18T03:00:00"
+    progress._store(progress._entry(member("MEM-1", rfid="TAG-1"), [["2026-10-17", 1]]))
+    return progress
+
+
+def eligible(progress):
+    return {c["member_id"] for c in progress.candidates(TODAY) if c["is_eligible"]}
+
+
+def test_erpnext_edits_update_candidates(progress):
+    assert eligible(progress) == {"MEM-1"}
+
+    # Promoted in the ERPNext desk; a member added there is already eligible
+    progress.apply(changes([member("MEM-1", rank="Blue", days=0, rfid="TAG-1"), member("MEM-2")]))
+
+    assert eligible(progress) == {"MEM-2"}
+    assert progress.get("MEM-1", today=TODAY)["training_days_last_30"] == 1
+
+
+def test_deleted_member_is_dropped(progress):
+    progress.apply(changes(deleted=["MEM-1"]))
+    assert eligible(progress) == set()
+    assert "TAG-1" not in progress._by_rfid
+
+
+def test_initial_load_is_left_to_the_sweep(progress):
+    progress.apply(changes([member("MEM-1", rank="Blue", days=0)], initial=True))
+    assert eligible(progress) == {"MEM-1"}
@@ -0,0 +1,17 @@
+# tests/test_startup_imports.py
+"""
+Subsystems that settings endpoints import on first use must stay out of the
+app's import graph, or deferring them saves nothing at startup.
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+DEFERRED = ["app.utils.erpnext_backup", "app.utils.erpnext_restore", "app.utils.erpnext_init"]
+
+
+def test_deferred_modules_are_not_imported_at_startup():
+    script = f"import sys, main; print([m for m in {DEFERRED!r} if m in sys.modules])"
+    result = subprocess.run([sys.executable, "-c", script], cwd=Path(__file__).parent.parent,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip().splitlines()[-1] == "[]"
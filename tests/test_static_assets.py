@@ -0,0 +1,65 @@
+# tests/test_static_assets.py
+"""
+Fingerprinted and precompressed static files must never reach outside the
+static directory, whatever the request path looks like.
+"""
+import asyncio
+
+import pytest
+from starlette.exceptions import HTTPException
+
+from app.utils.assets import AssetManifest, StaticAssets
+
+SECRET = '{"api_secret": "' + "s" * 2000 + '"}'
+
+
+@pytest.fixture
+def static(tmp_path):
+    static_dir = tmp_path / "static"
+    (static_dir / "css").mkdir(parents=True)
+    (static_dir / "css" / "index.css").write_text("body { color: black; }\n" * 200)
+    (tmp_path / "config.json").write_text(SECRET)
+    manifest = AssetManifest(static_dir)
+    return StaticAssets(directory=str(static_dir), manifest=manifest), manifest
+
+
+def get(app, path):
+    scope = {"type": "http", "method": "GET", "path": "/static/" + path,
+             "headers": [(b"accept-encoding", b"gzip, br")]}
+    try:
+        return asyncio.run(app.get_response(path, scope))
+    except HTTPException as e:
+        return e
+
+
+@pytest.mark.parametrize("path", [
+    "../config.json",
+    "css/../../config.json",
+    "../config.0123456789ab.json",
+])
+def test_parent_paths_are_not_served(static, path):
+    app, manifest = static
+    assert manifest.resolve(path)[1] is None
+    response = get(app, path)
+    assert response.status_code == 404
+    assert b"api_secret" not in getattr(response, "body", b"")
+
+
+def test_absolute_paths_are_not_indexed(static, tmp_path):
+    _, manifest = static
+    assert manifest.url(str(tmp_path / "config.json")).endswith("config.json")
+    assert manifest.resolve(str(tmp_path / "config.json"))[1] is None
+
+
+def test_directories_are_not_indexed(static):
+    _, manifest = static
+    assert manifest.resolve("css")[1] is None
+
+
+def test_static_files_still_served_precompressed(static):
+    app, manifest = static
+    url = manifest.url("css/index.css")
+    response = get(app, url[len("/static/"):])
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] in ("gzip", "br")
+    assert "immutable" in response.headers["cache-control"]
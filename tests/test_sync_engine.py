@@ -0,0 +1,130 @@
+# tests/test_sync_engine.py
+"""
+Change sync against a fake ERPNext: cursors must not move past a page a
+subscriber failed on, rows tied on the cursor's timestamp must not be
+skipped after an interrupted run, and resync() must repair content.
+"""
+import json
+
+import pytest
+
+from app.utils import erpnext_backup, sync_engine
+from app.utils.sync_engine import SyncEngine
+
+DOCTYPE = "Gym Member"
+
+
+class Reply:
+    def __init__(self, data):
+        self.content = json.dumps({"data": data}).encode()
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeERPNext:
+    """Answers /api/resource list queries over in-memory rows."""
+
+    def __init__(self, rows):
+        self.rows = {r["name"]: dict(r) for r in rows}
+        self.fail_after = None
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                raise ConnectionError("ERPNext went away")
+            self.fail_after -= 1
+        rows = list(self.rows.values())
+        for field, operator, value in json.loads(params.get("filters") or "[]"):
+            if operator == "=":
+                rows = [r for r in rows if r[field] == value]
+            elif operator == ">":
+                rows = [r for r in rows if r[field] > value]
+            elif operator == "in":
+                rows = [r for r in rows if r[field] in value]
+        keys = [term.split()[0] for term in params.get("order_by", "name asc").split(",")]
+        rows.sort(key=lambda r: tuple(r[k] for k in keys))
+        limit = params.get("limit_page_length") or len(rows)
+        return Reply(rows[:limit])
+
+
+def member(name, modified, rank="White"):
+    return {"name": name, "modified": modified, "current_rank": rank}
+
+
+@pytest.fixture
+def erpnext(monkeypatch):
+    erp = FakeERPNext([member(f"MEM-{i:03d}", "2026-01-01 10:00:00") for i in range(5)])
+    monkeypatch.setattr(sync_engine.requests, "get", erp.get)
+    monkeypatch.setattr(erpnext_backup.requests, "get", erp.get)
+    monkeypatch.setattr(sync_engine, "SYNC_PAGE_SIZE", 2)
+    return erp
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = SyncEngine(tmp_path / "sync_state.sqlite3")
+    monkeypatch.setattr(engine, "_connection", lambda: ("http://erp", {}))
+    return engine
+
+
+class Mirror:
+    """Subscriber keeping the latest record per name; can be told to fail."""
+
+    def __init__(self):
+        self.records = {}
+        self.failing = False
+
+    def __call__(self, event):
+        if self.failing and event["kind"] == "changes":
+            raise RuntimeError("disk full")
+        if event["kind"] == "changes":
+            for record in event["changed"]:
+                self.records[record["name"]] = record
+            for name in event["deleted"]:
+                self.records.pop(name, None)
+
+
+def test_failed_delivery_is_retried(erpnext, engine):
+    mirror = Mirror()
+    engine.subscribe([DOCTYPE], mirror)
+    engine.sync()
+    assert len(mirror.records) == 5
+
+    erpnext.rows["MEM-002"] = member("MEM-002", "2026-01-02 09:00:00", rank="Blue")
+    mirror.failing = True
+    assert isinstance(engine.sync()[DOCTYPE], str)
+    assert mirror.records["MEM-002"]["current_rank"] == "White"
+
+    mirror.failing = False
+    engine.sync()
+    assert mirror.records["MEM-002"]["current_rank"] == "Blue"
+
+
+def test_interrupted_tie_is_drained(erpnext, engine):
+    mirror = Mirror()
+    engine.subscribe([DOCTYPE], mirror)
+    # Every row shares one timestamp; the run stops after its first page
+    erpnext.fail_after = 1
+    engine.sync()
+    assert sorted(mirror.records) == ["MEM-000", "MEM-001"]
+
+    erpnext.fail_after = None
+    engine.sync()
+    assert sorted(mirror.records) == [f"MEM-{i:03d}" for i in range(5)]
+
+
+def test_resync_repairs_content_and_deletions(erpnext, engine):
+    mirror = Mirror()
+    engine.subscribe([DOCTYPE], mirror)
+    engine.sync()
+
+    # An edit the mirror never saw, e.g. lost before this fix, and a deletion
+    mirror.records["MEM-001"] = member("MEM-001", "2026-01-01 10:00:00", rank="Purple")
+    del erpnext.rows["MEM-004"]
+
+    result = engine.resync()
+    assert result[DOCTYPE] == {"records": 4, "deleted": 1}
+    assert mirror.records["MEM-001"]["current_rank"] == "White"
+    assert "MEM-004" not in mirror.records
@@ -0,0 +1,131 @@
+# tests/test_write_through.py
+"""
+Payments and promotions must reach the read model straight away: check-in
+reads members and unpaid invoices from it, and a stale row would block a
+member who just paid or undo a promotion.
+"""
+from app.routes import attendance
+from app.services import payment_service, promotion_batch
+from app.services.payment_service import PaymentService
+
+
+class FakeReadModel:
+    """Mirror holding rows per doctype, every doctype loaded."""
+
+    def __init__(self, rows=None):
+        self.rows = {doctype: dict(docs) for doctype, docs in (rows or {}).items()}
+
+    def is_ready(self, doctype):
+        return True
+
+    def get_list(self, doctype, filters=None, order_by=None, limit=None):
+        docs = list(self.rows.get(doctype, {}).values())
+        for field, operator, value in filters or []:
+            if operator == "=":
+                docs = [d for d in docs if d.get(field) == value]
+            elif operator == ">":
+                docs = [d for d in docs if (d.get(field) or 0) > value]
+        return docs[:limit] if limit else docs
+
+    def get_doc(self, doctype, name):
+        return self.rows.get(doctype, {}).get(name)
+
+    def upsert(self, doctype, doc):
+        self.rows.setdefault(doctype, {})[doc["name"]] = doc
+
+    def update(self, doctype, name, values):
+        if name in self.rows.get(doctype, {}):
+            self.rows[doctype][name] = {**self.rows[doctype][name], **values}
+
+
+class Reply:
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+UNPAID = {"name": "SINV-1", "customer": "CUST-1", "posting_date": "2026-01-01",
+          "outstanding_amount": 50.0, "docstatus": 1}
+
+
+def test_mirror_hit_is_confirmed_with_erpnext(monkeypatch):
+    monkeypatch.setattr(attendance, "get_read_model", lambda: FakeReadModel({"Sales Invoice": {"SINV-1": UNPAID}}))
+    monkeypatch.setattr(attendance.requests, "get", lambda *a, **k: Reply({"data": []}))
+    assert attendance.oldest_unpaid_invoice("http://erp", {}, "CUST-1", timeout=1) is None
+
+
+def test_mirror_hit_stands_when_erpnext_fails(monkeypatch):
+    monkeypatch.setattr(attendance, "get_read_model", lambda: FakeReadModel({"Sales Invoice": {"SINV-1": UNPAID}}))
+    monkeypatch.setattr(attendance.requests, "get", lambda *a, **k: Reply({}, status_code=500))
+    assert attendance.oldest_unpaid_invoice("http://erp", {}, "CUST-1", timeout=1)["name"] == "SINV-1"
+
+
+def test_mirror_miss_needs_no_request(monkeypatch):
+    monkeypatch.setattr(attendance, "get_read_model", lambda: FakeReadModel())
+
+    def fail(*args, **kwargs):
+        raise AssertionError("ERPNext queried")
+
+    monkeypatch.setattr(attendance.requests, "get", fail)
+    assert attendance.oldest_unpaid_invoice("http://erp", {}, "CUST-1", timeout=1) is None
+
+
+def test_payment_refreshes_invoices_and_members(monkeypatch):
+    mirror = FakeReadModel({
+        "Sales Invoice": {"SINV-1": UNPAID},
+        "Gym Member": {"MEM-1": {"name": "MEM-1", "customer": "CUST-1", "payment_status": "Overdue"}},
+    })
+    monkeypatch.setattr(payment_service, "get_read_model", lambda: mirror)
+
+    class Session:
+        def get(self, url, params=None):
+            if url.endswith("/Sales Invoice"):
+                return Reply({"data": [{**UNPAID, "outstanding_amount": 0.0, "status": "Paid"}]})
+            return Reply({"data": [{"name": "MEM-1", "customer": "CUST-1", "payment_status": "Current"}]})
+
+    class Client:
+        base_url = "http://erp"
+        session = Session()
+
+    PaymentService(Client())._write_through({"name": "PAY-1", "party": "CUST-1"}, ["SINV-1"], "CUST-1")
+
+    assert mirror.rows["Payment Entry"]["PAY-1"]["party"] == "CUST-1"
+    assert mirror.rows["Sales Invoice"]["SINV-1"]["outstanding_amount"] == 0.0
+    assert mirror.rows["Gym Member"]["MEM-1"]["payment_status"] == "Current"
+
+
+def test_batch_promotion_resets_mirrored_rank(monkeypatch):
+    mirror = FakeReadModel({"Gym Member": {"MEM-1": {
+        "name": "MEM-1", "current_rank": "White", "current_stripes": 4, "days_at_current_rank": 300}}})
+    monkeypatch.setattr(promotion_batch, "get_read_model", lambda: mirror)
+
+    class Ranks:
+        def get(self, rank_id):
+            return {"name": rank_id, "rank_name": rank_id, "is_active": 1}
+
+    class Progress:
+        def refresh_members(self, member_ids, today):
+            return {"MEM-1": {"full_name": "Ana", "current_rank": "White", "current_stripes": 4,
+                              "days_at_current_rank": 300, "rank": {"stripes_available": 4}}}
+
+        def record_promotion(self, *args):
+            pass
+
+    monkeypatch.setattr(promotion_batch, "get_rank_table", lambda: Ranks())
+    monkeypatch.setattr(promotion_batch, "get_rank_progress", lambda: Progress())
+    monkeypatch.setattr(promotion_batch, "_insert_histories", lambda *a: {})
+    monkeypatch.setattr(promotion_batch, "_update_members", lambda *a: {})
+
+    results = promotion_batch.apply_batch("http://erp", {}, "COACH-1",
+                                          [{"member_id": "MEM-1", "action": "promote", "new_rank_id": "Blue"}])
+
+    assert results[0]["success"]
+    member = mirror.rows["Gym Member"]["MEM-1"]
+    assert (member["current_rank"], member["days_at_current_rank"], member["current_stripes"]) == ("Blue", 0, 0)